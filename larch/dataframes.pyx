@@ -8,6 +8,7 @@ from .general_precision cimport l4_float_t
 
 from libc.string cimport memset
 cimport cython
+from cython.parallel cimport prange
 
 import pandas
 import numpy
@@ -118,6 +119,83 @@ def _df_values_c_contiguous(df, re_shape=None, dtype=None):
 		else:
 			return numpy.ascontiguousarray(df.values.astype(dtype))
 
+# Parallel conversions between idca and idce layouts.  Each routine
+# writes into a preallocated output, one independent idce row per
+# iteration, so the loops need neither the GIL nor any locking.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_fill_reversemap(
+		const int64_t[:] caseindexes,
+		const int64_t[:] altindexes,
+		int64_t[:,:] reversemap,
+) nogil:
+	cdef int64_t row
+	for row in prange(caseindexes.shape[0]):
+		reversemap[caseindexes[row], altindexes[row]] = row
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_gather_float(
+		const l4_float_t[:,:] source,
+		const int64_t[:] caseindexes,
+		const int64_t[:] altindexes,
+		l4_float_t[:] out,
+) nogil:
+	cdef int64_t row
+	for row in prange(out.shape[0]):
+		out[row] = source[caseindexes[row], altindexes[row]]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_gather_int8(
+		const int8_t[:,:] source,
+		const int64_t[:] caseindexes,
+		const int64_t[:] altindexes,
+		int8_t[:] out,
+) nogil:
+	cdef int64_t row
+	for row in prange(out.shape[0]):
+		out[row] = source[caseindexes[row], altindexes[row]]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_scatter_float(
+		const l4_float_t[:] source,
+		const int64_t[:] caseindexes,
+		const int64_t[:] altindexes,
+		l4_float_t[:,:] out,
+) nogil:
+	cdef int64_t row
+	for row in prange(source.shape[0]):
+		out[caseindexes[row], altindexes[row]] = source[row]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_gather_case_rows(
+		const l4_float_t[:,:] source,
+		const int64_t[:] caseindexes,
+		l4_float_t[:,:] out,
+) nogil:
+	cdef int64_t row, v
+	for row in prange(out.shape[0]):
+		for v in range(out.shape[1]):
+			out[row, v] = source[caseindexes[row], v]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _ce_scatter_rows(
+		const l4_float_t[:,:] source,
+		const int64_t[:] caseindexes,
+		const int64_t[:] altpositions,
+		l4_float_t[:,:,:] out,
+) nogil:
+	cdef int64_t row, v
+	for row in prange(source.shape[0]):
+		for v in range(source.shape[1]):
+			out[caseindexes[row], altpositions[row], v] = source[row, v]
+
+
 def _fast_check_multiindex_equality(i, j):
 	if not isinstance(i, pandas.MultiIndex):
 		return False
@@ -635,6 +713,27 @@ cdef class DataFrames:
 						index=self.caseindex,
 						columns=self.alternative_codes(),
 					)
+				elif (
+						self.data_ce is not None
+						and _fast_check_multiindex_equality(self.data_ce.index, ch.index)
+						and numpy.array_equal(self.data_ce.index.levels[1], self.alternative_codes())
+				):
+					logger.debug(" DataFrames ~ scatter ch from ce")
+					_ch_temp = numpy.zeros(
+						[self._array_ce_reversemap.shape[0], len(self.alternative_codes())],
+						dtype=l4_float_dtype,
+					)
+					_ce_scatter_float(
+						numpy.ascontiguousarray(ch.values, dtype=l4_float_dtype),
+						self._array_ce_caseindexes,
+						self._array_ce_altindexes,
+						_ch_temp,
+					)
+					ch = pandas.DataFrame(
+						data=_ch_temp,
+						index=self.caseindex,
+						columns=self.alternative_codes(),
+					)
 				else:
 					logger.debug(" DataFrames ~ unstack ch (slow)")
 					ch = ch.unstack().fillna(0)
@@ -901,7 +1000,7 @@ cdef class DataFrames:
 		"""
 		return self._is_computational_ready(activate)
 
-	def to_feathers(self, filename, components=None):
+	def to_feathers(self, filename, components=None, uncompressed=False):
 		"""
 		Output data to a collection of Feather files.
 
@@ -913,6 +1012,12 @@ cdef class DataFrames:
 			will be created.
 		components : subset of {'co','ca','ce','wt','av','ch','meta'}
 			Only these data components will be exported.
+		uncompressed : bool, default False
+			Write uncompressed files, each holding a single record batch,
+			so that `from_feathers` can memory-map them and use the data
+			without copying it.  In this layout the idce data values are
+			stored as one fixed size list column, which older versions
+			of Larch cannot read.
 
 		"""
 		import pyarrow as pa
@@ -949,12 +1054,37 @@ cdef class DataFrames:
 				tb = tb.cast(new_schema)
 				pf.write_feather(tb, str(filename)+".metadata")
 
+			write_options = {}
+			if uncompressed:
+				write_options['compression'] = 'uncompressed'
+
 			# core data
 			def segment_out(seg):
 				array_ = getattr(self, f'array_{seg}')()
 				if array_ is not None:
-					if seg == 'ce':
-						pf.write_feather(self.data_ce.reset_index(), str(filename)+f".data_ce")
+					if seg == 'ce' and uncompressed:
+						index = self.data_ce.index
+						n_vars = array_.shape[1]
+						values = pa.FixedSizeListArray.from_arrays(
+							pa.array(numpy.ascontiguousarray(array_).reshape(-1)),
+							n_vars,
+						)
+						tb = pa.table(
+							[
+								index.get_level_values(0).to_numpy(),
+								index.get_level_values(1).to_numpy(),
+								values,
+							],
+							[str(index.names[0]), str(index.names[1]), 'data_ce'],
+						)
+						columns = pickle.dumps(self.data_ce.columns)
+						metadata = tb.schema.metadata or {}
+						metadata[b'COLUMNS'] = pa.compress(columns, asbytes=True)
+						metadata[b'COLUMNSBYTES'] = str(len(columns))
+						tb = tb.cast(tb.schema.with_metadata(metadata))
+						pf.write_feather(tb, str(filename)+f".data_ce", chunksize=max(len(tb), 1), **write_options)
+					elif seg == 'ce':
+						pf.write_feather(self.data_ce.reset_index(), str(filename)+f".data_ce", **write_options)
 					else:
 						if array_.flags['F_CONTIGUOUS']:
 							tb = pa.table([array_.T.reshape(-1)], [f'data_{seg}'])
@@ -971,7 +1101,7 @@ cdef class DataFrames:
 							metadata[b'COLUMNSBYTES'] = str(len(columns))
 						new_schema = tb.schema.with_metadata(metadata)
 						tb = tb.cast(new_schema)
-						pf.write_feather(tb, str(filename)+f".data_{seg}")
+						pf.write_feather(tb, str(filename)+f".data_{seg}", chunksize=max(len(tb), 1), **write_options)
 			for seg in components:
 				if seg == 'meta': continue
 				segment_out(seg)
@@ -1019,7 +1149,30 @@ cdef class DataFrames:
 			raise
 
 	@classmethod
-	def from_feathers(cls, filename, components=None):
+	def from_feathers(cls, filename, components=None, memory_map=False):
+		"""
+		Read data from a collection of Feather files.
+
+		Parameters
+		----------
+		filename : path-like
+			The base filename for the input files, as given to
+			`to_feathers`.
+		components : subset of {'co','ca','ce','wt','av','ch','meta'}
+			Only these data components will be imported.
+		memory_map : bool, default False
+			Memory-map the files, and use the co, ca, ce and av data
+			directly from the map without copying where the layout and
+			dtypes allow, which requires files written by `to_feathers`
+			with `uncompressed=True`.  These arrays are read-only, and
+			several processes reading the same files share one copy in
+			the operating system page cache.  Choice and weight data
+			are always copied, as they must be writeable.
+
+		Returns
+		-------
+		DataFrames
+		"""
 		import pyarrow as pa
 		import pyarrow.feather as pf
 		import pickle
@@ -1058,22 +1211,46 @@ cdef class DataFrames:
 		else:
 			wgtnorm = 1.0
 
+		def column_values(column):
+			# a single chunk without nulls can be viewed in place
+			if memory_map and column.num_chunks == 1:
+				chunk = column.chunk(0)
+				if isinstance(chunk, pa.FixedSizeListArray):
+					chunk = chunk.values
+				try:
+					return chunk.to_numpy(zero_copy_only=True)
+				except (pa.ArrowInvalid, NotImplementedError):
+					pass
+			if pa.types.is_fixed_size_list(column.type):
+				return column.combine_chunks().flatten().to_numpy()
+			return column.to_numpy()
+
 		kwargs = {}
 		def segment_in(seg):
 			try:
 				filename_seg = str(filename)+f".data_{seg}"
 				if os.path.exists(filename_seg):
 					if seg == 'ce':
-						df = pf.read_feather(filename_seg)
-						df = df.set_index(list(df.columns[:2]))
+						tb = pf.read_table(filename_seg, memory_map=memory_map)
+						if 'data_ce' in tb.column_names:
+							columns = from_metadata(tb, b'COLUMNS')
+							idx = pandas.MultiIndex.from_arrays(
+								[tb.column(0).to_numpy(), tb.column(1).to_numpy()],
+								names=tb.column_names[:2],
+							)
+							arr = column_values(tb['data_ce']).reshape(-1, len(columns))
+							df = pandas.DataFrame(arr, columns=columns, index=idx, copy=False)
+						else:
+							df = tb.to_pandas()
+							df = df.set_index(list(df.columns[:2]))
 					else:
-						tb = pf.read_table(filename_seg)
+						tb = pf.read_table(filename_seg, memory_map=memory_map)
 						columns = from_metadata(tb, b'COLUMNS')
 						transpose = tb.schema.metadata.get(b'T', b'N')
 						if transpose == b'Y':
-							arr = tb[f'data_{seg}'].to_numpy().reshape(len(columns), -1).T
+							arr = column_values(tb[f'data_{seg}']).reshape(len(columns), -1).T
 						else:
-							arr = tb[f'data_{seg}'].to_numpy().reshape(-1, len(columns))
+							arr = column_values(tb[f'data_{seg}']).reshape(-1, len(columns))
 						if seg == 'ca':
 							idx = pandas.MultiIndex.from_product([
 							    caseindex,
@@ -1081,7 +1258,7 @@ cdef class DataFrames:
 							], names=['_caseid_', '_altid_'])
 						else:
 							idx = caseindex
-						df = pandas.DataFrame(arr, columns=columns, index=idx)
+						df = pandas.DataFrame(arr, columns=columns, index=idx, copy=False)
 						if seg in ('ch','wt'):
 							df = df.copy() # these two arrays must be writeable
 					kwargs[seg] = df
@@ -1155,10 +1332,12 @@ cdef class DataFrames:
 		array_ce = self.array_ce()
 		if array_ce is not None and 'ce' in components:
 			filename_ce = str(filename)+".data_ce"
-			df = pf.read_feather(filename_ce)
-			df = df.set_index(list(df.columns[:2]))
-			arr = df.to_numpy().reshape(array_ce.shape[0], array_ce.shape[1])
-			array_ce[:] = arr[:]
+			tb = pf.read_table(filename_ce)
+			if 'data_ce' in tb.column_names:
+				arr = tb['data_ce'].combine_chunks().flatten().to_numpy()
+			else:
+				arr = tb.to_pandas().iloc[:, 2:].to_numpy()
+			array_ce[:] = arr.reshape(array_ce.shape[0], array_ce.shape[1])[:]
 
 		array_av = self.array_av()
 		if array_av is not None and 'av' in components:
@@ -1507,7 +1686,8 @@ cdef class DataFrames:
 			# Change level names if requested
 			caseindex_name = self._caseindex_name or df.index.names[0]
 			altindex_name = self._altindex_name or df.index.names[1]
-			df = df.set_index(df.index.set_names([caseindex_name, altindex_name]))
+			if list(df.index.names) != [caseindex_name, altindex_name]:
+				df = df.set_index(df.index.set_names([caseindex_name, altindex_name]))
 
 			if self._computational:
 				self._data_ca = _ensure_dataframe_of_dtype(df, l4_float_dtype, 'data_ca')
@@ -1567,7 +1747,8 @@ cdef class DataFrames:
 
 			# Change index name if requested
 			caseindex_name = self._caseindex_name or df.index.names[0]
-			df = df.set_index(df.index.set_names(caseindex_name))
+			if df.index.names[0] != caseindex_name:
+				df = df.set_index(df.index.set_names(caseindex_name))
 
 			if not df.index.is_monotonic_increasing:
 				df = df.sort_index()
@@ -1594,16 +1775,9 @@ cdef class DataFrames:
 		"""
 		if self.data_co is None:
 			return None
-		cdef int c,a,v,row,n_vars
-		n_vars = self._array_co.shape[1]
-		arr = numpy.zeros( [len(self.data_ce), n_vars], dtype=l4_float_dtype )
-		for c in range(self._array_ce_reversemap.shape[0]):
-			for a in range(self._array_ce_reversemap.shape[1]):
-				row = self._array_ce_reversemap[c,a]
-				if row >= 0:
-					for v in range(n_vars):
-						arr[row,v] = self._array_co[c,v]
-		return pandas.DataFrame(arr, index=self.data_ce.index, columns=['weight'])
+		arr = numpy.empty( [len(self.data_ce), self._array_co.shape[1]], dtype=l4_float_dtype )
+		_ce_gather_case_rows(self._array_co, self._array_ce_caseindexes, arr)
+		return pandas.DataFrame(arr, index=self.data_ce.index, columns=self.data_co.columns)
 
 	@property
 	def data_ce(self):
@@ -1611,7 +1785,6 @@ cdef class DataFrames:
 
 	@data_ce.setter
 	def data_ce(self, df:pandas.DataFrame):
-		cdef int64_t i, c, a, min_case_x
 		if df is None:
 			self._data_ce = None
 			self._array_ce = None
@@ -1634,7 +1807,8 @@ cdef class DataFrames:
 			# Change level names if requested
 			caseindex_name = self._caseindex_name or df.index.names[0]
 			altindex_name = self._altindex_name or df.index.names[1]
-			df = df.set_index(df.index.set_names([caseindex_name, altindex_name]))
+			if list(df.index.names) != [caseindex_name, altindex_name]:
+				df = df.set_index(df.index.set_names([caseindex_name, altindex_name]))
 
 			if not df.index.is_monotonic_increasing:
 				df = df.sort_index()
@@ -1645,21 +1819,26 @@ cdef class DataFrames:
 				self._data_ce = df
 				self._array_ce = None
 
-			unique_labels, new_labels =numpy.unique(self.data_ce.index.codes[0], return_inverse=True)
-			self._array_ce_caseindexes = new_labels
-
-			# min_case_x = self.data_ce.index.labels[0].min()
-			# if min_case_x == 0:
-			# 	self._array_ce_caseindexes = self.data_ce.index.labels[0]
-			# else:
-			# 	self._array_ce_caseindexes = self.data_ce.index.labels[0] - min_case_x
-			self._array_ce_altindexes  = self.data_ce.index.codes[1]
-			self._array_ce_reversemap = numpy.full([self._array_ce_caseindexes.max()+1, self._array_ce_altindexes.max()+1], -1, dtype=numpy.int64)
-			for i in range(len(self._array_ce_caseindexes)):
-				c = self._array_ce_caseindexes[i]
-				a = self._array_ce_altindexes[i]
-				self._array_ce_reversemap[c, a] = i
-			#self._array_ce_reversemap[self._array_ce_caseindexes, self._array_ce_altindexes] = numpy.arange(len(self._array_ce_caseindexes), dtype=numpy.int64)
+			case_codes = numpy.asarray(self.data_ce.index.codes[0], dtype=numpy.int64)
+			if case_codes.size == 0 or (case_codes[1:] >= case_codes[:-1]).all():
+				# sorted codes are renumbered densely without a sort
+				new_labels = numpy.zeros_like(case_codes)
+				if case_codes.size:
+					numpy.cumsum(case_codes[1:] != case_codes[:-1], out=new_labels[1:])
+			else:
+				unique_labels, new_labels = numpy.unique(case_codes, return_inverse=True)
+			self._array_ce_caseindexes = numpy.ascontiguousarray(new_labels, dtype=numpy.int64)
+			self._array_ce_altindexes  = numpy.asarray(self.data_ce.index.codes[1], dtype=numpy.int64)
+			self._array_ce_reversemap = numpy.full(
+				[self._array_ce_caseindexes.max()+1, self._array_ce_altindexes.max()+1],
+				-1,
+				dtype=numpy.int64,
+			)
+			_ce_fill_reversemap(
+				self._array_ce_caseindexes,
+				self._array_ce_altindexes,
+				self._array_ce_reversemap,
+			)
 
 			if self._data_ca is not None and self._data_ce is not None:
 				self.data_ca = None
@@ -1681,14 +1860,36 @@ cdef class DataFrames:
 		-------
 		pandas.DataFrame
 		"""
+		ce_index = self.data_ce.index
+		case_codes = numpy.unique(ce_index.codes[0])
+		alt_codes, altpositions = numpy.unique(self._array_ce_altindexes, return_inverse=True)
+		altpositions = numpy.ascontiguousarray(altpositions, dtype=numpy.int64)
+		n_cases = case_codes.size
+		n_alts = alt_codes.size
+		index = pandas.MultiIndex.from_product(
+			[ce_index.levels[0][case_codes], ce_index.levels[1][alt_codes]],
+			names=ce_index.names,
+		)
+		if self._array_ce is not None:
+			arr = numpy.zeros([n_cases, n_alts, self._array_ce.shape[1]], dtype=l4_float_dtype)
+			_ce_scatter_rows(self._array_ce, self._array_ce_caseindexes, altpositions, arr)
+			result = pandas.DataFrame(
+				arr.reshape(n_cases * n_alts, -1),
+				index=index,
+				columns=self.data_ce.columns,
+			)
+		else:
+			columns = {}
+			for name in self.data_ce.columns:
+				values = self.data_ce[name].values
+				arr = numpy.zeros([n_cases, n_alts], dtype=values.dtype)
+				arr[self._array_ce_caseindexes, altpositions] = values
+				columns[name] = arr.reshape(-1)
+			result = pandas.DataFrame(columns, index=index)
 		if promote:
-			self.data_ce[promote] = numpy.int8(1)
-		result = self.data_ce.unstack().fillna(0).stack()
-		try:
-			result = result.astype(self.data_ce.dtypes)
-		except ValueError:
-			pass
-		if promote:
+			present = numpy.zeros([n_cases, n_alts], dtype=numpy.int8)
+			present[self._array_ce_caseindexes, altpositions] = 1
+			result[promote] = present.reshape(-1)
 			self.data_ca = result
 		return result
 
@@ -1718,13 +1919,8 @@ cdef class DataFrames:
 				raise NotImplementedError('not implemented when data_ce and data_av are None')
 			return self._data_av[self._data_av.stack().astype(bool).values]
 
-		arr = numpy.zeros( [len(self.data_ce)], dtype=numpy.int8 )
-		cdef int c,a,row
-		for c in range(self._array_ce_reversemap.shape[0]):
-			for a in range(self._array_ce_reversemap.shape[1]):
-				row = self._array_ce_reversemap[c,a]
-				if row >= 0:
-					arr[row] = self._array_av[c,a]
+		arr = numpy.empty( [len(self.data_ce)], dtype=numpy.int8 )
+		_ce_gather_int8(self._array_av, self._array_ce_caseindexes, self._array_ce_altindexes, arr)
 		return pandas.DataFrame(arr, index=self.data_ce.index, columns=['avail'])
 
 
@@ -1837,13 +2033,8 @@ cdef class DataFrames:
 				raise NotImplementedError('not implemented when data_ce and data_av are None')
 			return self._data_ch[self._data_av.stack().astype(bool).values]
 
-		arr = numpy.zeros( [len(self.data_ce)], dtype=l4_float_dtype )
-		cdef int c,a,row
-		for c in range(self._array_ce_reversemap.shape[0]):
-			for a in range(self._array_ce_reversemap.shape[1]):
-				row = self._array_ce_reversemap[c,a]
-				if row >= 0:
-					arr[row] = self._array_ch[c,a]
+		arr = numpy.empty( [len(self.data_ce)], dtype=l4_float_dtype )
+		_ce_gather_float(self._array_ch, self._array_ce_caseindexes, self._array_ce_altindexes, arr)
 		return pandas.DataFrame(arr, index=self.data_ce.index, columns=['choice'])
 
 	@property
@@ -1860,13 +2051,12 @@ cdef class DataFrames:
 	def data_wt_as_ce(self):
 		if self.data_wt is None:
 			return None
-		arr = numpy.zeros( [len(self.data_ce)], dtype=l4_float_dtype )
-		cdef int c,a,row
-		for c in range(self._array_ce_reversemap.shape[0]):
-			for a in range(self._array_ce_reversemap.shape[1]):
-				row = self._array_ce_reversemap[c,a]
-				if row >= 0:
-					arr[row] = self._array_wt[c]
+		arr = numpy.empty( [len(self.data_ce), 1], dtype=l4_float_dtype )
+		_ce_gather_case_rows(
+			numpy.asarray(self._array_wt).reshape(-1, 1),
+			self._array_ce_caseindexes,
+			arr,
+		)
 		return pandas.DataFrame(arr, index=self.data_ce.index, columns=['weight'])
 
 	@property
@@ -2327,18 +2517,16 @@ cdef class DataFrames:
 		"""
 		if self._data_ce is None:
 			raise ValueError('no data_ce set')
-		cdef int c,a,row
-		result = pandas.Series(
-			index = self.data_ce.index,
-			data = 0,
-			dtype = arr.dtype,
-		)
-		for c in range(self._n_cases()):
-			for a in range(self._n_alts()):
-				row = self._array_ce_reversemap[c,a]
-				if row >= 0:
-					result.values[row] = arr[c,a]
-		return result
+		arr = numpy.asarray(arr)
+		if arr.dtype == l4_float_dtype:
+			values = numpy.empty(len(self.data_ce), dtype=l4_float_dtype)
+			_ce_gather_float(arr, self._array_ce_caseindexes, self._array_ce_altindexes, values)
+		elif arr.dtype == numpy.int8:
+			values = numpy.empty(len(self.data_ce), dtype=numpy.int8)
+			_ce_gather_int8(arr, self._array_ce_caseindexes, self._array_ce_altindexes, values)
+		else:
+			values = arr[self._array_ce_caseindexes, self._array_ce_altindexes]
+		return pandas.Series(values, index=self.data_ce.index)
 
 
 	def compute_utility_onecase(
@@ -1,4 +1,5 @@
 import logging
+import re
 import warnings
 import numpy as np
 import pandas as pd
@@ -1059,6 +1060,19 @@ Dataset = _sharrow_Dataset
 #     #     return self.indexes[self.ALTID]
 #
 
+def _expression_strings(expressions):
+    """Yield every string in a nested collection of expressions."""
+    if isinstance(expressions, str):
+        yield expressions
+    elif isinstance(expressions, Mapping):
+        for k, v in expressions.items():
+            yield from _expression_strings(k)
+            yield from _expression_strings(v)
+    elif isinstance(expressions, Iterable):
+        for i in expressions:
+            yield from _expression_strings(i)
+
+
 class DataTree(_sharrow_DataTree):
 
     DatasetType = Dataset
@@ -1186,6 +1200,103 @@ class DataTree(_sharrow_DataTree):
         obj.root_dataset = obj.root_dataset.dc.query_cases(*args, **kwargs)
         return obj
 
+    def sample_alternatives(self, *args, **kwargs):
+        """
+        Return a new DataTree, with alternatives sampled in the root Dataset.
+
+        The root Dataset must be dense |idca| data.  It is replaced by
+        |idce| data holding a random sample of alternatives for each case,
+        and a sampling correction variable.  Other datasets in the tree
+        are unchanged, so data about the alternatives that should follow
+        the sampled rows needs to be in the root Dataset.
+
+        Parameters
+        ----------
+        n_samples : int or Mapping
+            The number of draws to take for each case, or for each stratum
+            when `strata` are given.
+        size, chosen, avail, strata, seed, correction
+            See `Dataset.dc.sample_alternatives`.
+
+        Returns
+        -------
+        DataTree
+
+        See Also
+        --------
+        Dataset.dc.sample_alternatives
+        """
+        obj = self.copy()
+        obj.root_dataset = obj.root_dataset.dc.sample_alternatives(*args, **kwargs)
+        return obj
+
+    def subset_subspaces(self, expressions, load=True):
+        """
+        Return a new DataTree holding only the data used by some expressions.
+
+        In each Dataset other than the root, variables that are not named
+        in any of the expressions, and are not used by the relationships
+        of the tree, are dropped.  If the relationships are not yet
+        digitized, dimensions that are only reached by label-based
+        relationships are also trimmed to the labels that actually appear
+        in the linking variables, so that for example only the skim rows
+        and columns for zones that appear in the data are retained.
+
+        This is most useful when the datasets are lazily loaded, e.g.
+        with `Dataset.construct.from_omx_lazy` or `from_zarr`, as then
+        the unused matrices, rows and columns are never read at all.
+
+        Parameters
+        ----------
+        expressions : str or Iterable[str] or Mapping
+            The expressions that will be evaluated on the tree.  For a
+            mapping, both keys and values are considered.
+        load : bool, default True
+            Load the retained data into memory.
+
+        Returns
+        -------
+        DataTree
+        """
+        text = "\n".join(_expression_strings(expressions))
+        root_name = self.root_node_name
+        relationships = list(self.list_relationships())
+        linked = {}
+        for r in relationships:
+            linked.setdefault(r.parent_data, set()).add(r.parent_name)
+            linked.setdefault(r.child_data, set()).add(r.child_name)
+        labels = {}
+        if not self.relationships_are_digitized:
+            for r in relationships:
+                key = (r.child_data, r.child_name)
+                if r.indexing != 'label':
+                    labels[key] = None
+                elif labels.get(key, ()) is not None:
+                    parent = self.subspaces[r.parent_data][r.parent_name]
+                    labels[key] = np.union1d(
+                        labels.get(key, ()), np.unique(np.asarray(parent.values)),
+                    )
+        replacements = {}
+        for name, dataset in self.subspaces.items():
+            if name == root_name:
+                continue
+            keep = linked.get(name, set())
+            drop = [
+                k for k in dataset.data_vars
+                if k not in keep and not re.search(rf"(?<!\w){re.escape(str(k))}(?!\w)", text)
+            ]
+            subset = dataset.drop_vars(drop)
+            for (child_data, child_name), used in labels.items():
+                if child_data != name or used is None or child_name not in subset.dims:
+                    continue
+                positions = np.nonzero(np.isin(subset[child_name].values, used))[0]
+                if len(positions) < subset.dims[child_name]:
+                    subset = subset.isel({child_name: positions})
+            if load:
+                subset = subset.compute()
+            replacements[name] = subset
+        return self.replace_datasets(replacements, redigitize=False)
+
     def caseids(self):
         """
         Access the caseids coordinates as an index.
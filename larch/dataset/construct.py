@@ -124,6 +124,70 @@ class _DatasetConstruct:
     from_omx = _steal(sd.from_omx)
     from_omx_3d = _steal(sd.from_omx_3d)
 
+    @classmethod
+    def from_omx_lazy(cls, omx, index_names=("otaz", "dtaz"), indexes="one-based", renames=None, chunks=None):
+        """
+        Construct a Dataset from an OMX file without loading the matrices.
+
+        Each matrix is wrapped in a chunked dask array, so that data is
+        read from the file only for the matrices, rows and columns that
+        are actually used, e.g. when a DataTree holding this Dataset is
+        trimmed with `DataTree.subset_subspaces` before preparing model
+        data.  The file must stay open while the Dataset is in use.
+
+        Parameters
+        ----------
+        omx : OMX or openmatrix.File
+            An open OMX file.
+        index_names : tuple[str, str], default ("otaz", "dtaz")
+            Names for the row and column dimensions.
+        indexes : {'one-based', 'zero-based'} or tuple[array-like, array-like]
+            Coordinates for the row and column dimensions.
+        renames : Mapping, optional
+            Rename matrices, by mapping file names to variable names.
+            If given, only the matrices named in the mapping are included.
+        chunks : int or tuple or 'auto', optional
+            Chunk sizes for the dask arrays.  The default is the chunk
+            shape of each matrix in the file, or a whole matrix for
+            matrices that are not chunked.
+
+        Returns
+        -------
+        Dataset
+        """
+        import dask.array as da
+        omx_data = omx.data if hasattr(omx, 'data') else omx.root['data']
+        names = list(omx_data._v_children)
+        if renames is None:
+            renames = {k: k for k in names}
+        shape = None
+        data_vars = {}
+        for k, name in renames.items():
+            node = omx_data._v_children[k]
+            if shape is None:
+                shape = node.shape
+            node_chunks = chunks
+            if node_chunks is None:
+                node_chunks = getattr(node, 'chunkshape', None) or node.shape
+            data_vars[name] = xr.DataArray(
+                da.from_array(node, chunks=node_chunks, name=f"omx-{k}", lock=True),
+                dims=index_names,
+            )
+        if shape is None:
+            shape = tuple(omx.shape) if not callable(omx.shape) else tuple(omx.shape())
+        if isinstance(indexes, str):
+            if indexes == "one-based":
+                indexes = (np.arange(1, shape[0] + 1), np.arange(1, shape[1] + 1))
+            elif indexes == "zero-based":
+                indexes = (np.arange(shape[0]), np.arange(shape[1]))
+            else:
+                raise ValueError(f"unknown indexes {indexes!r}")
+        coords = {
+            index_names[0]: np.asarray(indexes[0]),
+            index_names[1]: np.asarray(indexes[1]),
+        }
+        return sd.Dataset(data_vars, coords=coords)
+
     @classmethod
     def from_idco(cls, df, alts=None):
         """
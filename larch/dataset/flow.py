@@ -533,22 +533,111 @@ class _DatasetDC(_GenericFlow):
         result = self.transfer_dimension_attrs(result)
         return result
 
+    def slice_cases(self, start, stop):
+        """
+        Return a new dataset with a contiguous range of cases.
+
+        Unlike a plain `isel` on the CASEID dimension, this also selects
+        the matching rows of any |idce| data, and rebases the case
+        pointers so they index into the selected rows.  Variables are
+        indexed lazily, so for datasets backed by zarr stores or
+        memory-mapped arrays only the selected cases are read later.
+
+        Parameters
+        ----------
+        start, stop : int
+            Positions of the first case, and one past the last case.
+
+        Returns
+        -------
+        Dataset
+        """
+        indexers = {self.CASEID: slice(start, stop)}
+        ptr_name = self.CASEPTR
+        if ptr_name is not None:
+            ptr = self._obj[ptr_name].values
+            indexers[self.CASEALT] = slice(ptr[start], ptr[stop])
+            indexers[ptr_name] = slice(start, stop + 1)
+        result = self._obj.isel(indexers)
+        if ptr_name is not None:
+            result = result.assign_coords({
+                ptr_name: result[ptr_name] - ptr[start],
+            })
+        return self.transfer_dimension_attrs(result)
+
+    def sample_alternatives(
+            self,
+            n_samples,
+            size=None,
+            chosen=None,
+            avail=None,
+            strata=None,
+            seed=None,
+            correction='sampling_correction',
+    ):
+        """
+        Draw a random sample of alternatives for each case.
+
+        Draws are taken with replacement, either uniformly or in proportion
+        to a size term, optionally within strata of alternatives.  The
+        result is |idce| data with one row per distinct sampled alternative,
+        including a McFadden sampling correction to be added to utility.
+
+        Parameters
+        ----------
+        n_samples : int or Mapping
+            The number of draws to take for each case, or for each stratum
+            when `strata` are given.  A mapping gives the number of draws
+            for each stratum label.
+        size : str or array-like, optional
+            Sampling weights with the ALTID dimension and optionally the
+            CASEID dimension.  If not given, draws are uniform.
+        chosen : str, optional
+            Name of a variable giving the observed choices, which are always
+            included in the sample.
+        avail : str, optional
+            Name of a variable giving availability.  Unavailable alternatives
+            are never drawn.
+        strata : str or array-like, optional
+            Labels giving a stratum for each alternative.
+        seed : int, optional
+            Seed for the random draws.
+        correction : str, default 'sampling_correction'
+            Name of the variable holding the sampling correction.  It should
+            enter the utility function with a coefficient fixed at 1.
+
+        Returns
+        -------
+        Dataset
+        """
+        from .sampling import sample_alternatives
+        return sample_alternatives(
+            self._obj,
+            n_samples,
+            size=size,
+            chosen=chosen,
+            avail=avail,
+            strata=strata,
+            seed=seed,
+            correction=correction,
+        )
+
     def to_arrays(self, graph, float_dtype=np.float64):
         from ..numba.data_arrays import DataArrays
         from ..numba.cascading import array_av_cascade, array_ch_cascade
 
         if 'co' in self:
-            co = self['co'].values.astype(float_dtype)
+            co = self['co'].values.astype(float_dtype, copy=False)
         else:
             co = np.empty( (self.n_cases, 0), dtype=float_dtype)
 
         if 'ca' in self:
-            ca = self['ca'].values.astype(float_dtype)
+            ca = self['ca'].values.astype(float_dtype, copy=False)
         else:
             ca = np.empty( (self.n_cases, self.n_alts, 0), dtype=float_dtype)
 
         if 'ce_data' in self:
-            ce_data = self['ce_data'].values.astype(float_dtype)
+            ce_data = self['ce_data'].values.astype(float_dtype, copy=False)
         else:
             ce_data = np.empty( (0, 0), dtype=float_dtype)
 
@@ -565,7 +654,7 @@ class _DatasetDC(_GenericFlow):
             ce_caseptr = np.empty( (self.n_cases, 0), dtype=np.int16)
 
         if 'wt' in self:
-            wt = self['wt'].values.astype(float_dtype)
+            wt = self['wt'].values.astype(float_dtype, copy=False)
         else:
             wt = np.ones(self.n_cases, dtype=float_dtype)
 
@@ -582,3 +671,62 @@ class _DatasetDC(_GenericFlow):
         return DataArrays(
             ch, av, wt, co, ca, ce_data, ce_altidx, ce_caseptr
         )
+
+    def to_sparse_arrays(self, float_dtype=np.float64):
+        """
+        Convert |idce| model data to arrays with sparse choice and availability.
+
+        Choice and availability are read from the `ch_ce` and `av_ce`
+        variables when present, or else gathered from dense `ch` and `av`
+        arrays at the case-alternative rows of the |idce| data.  Without
+        either, no alternative is chosen and all rows are available.
+
+        Parameters
+        ----------
+        float_dtype : dtype, default np.float64
+
+        Returns
+        -------
+        SparseDataArrays
+        """
+        from ..numba.data_arrays import SparseDataArrays
+
+        if self.CASEPTR is None or self.ALTIDX is None:
+            raise ValueError("sparse data arrays require idce data")
+        ce_caseptr = np.asarray(self[self.CASEPTR].values)
+        ce_altidx = np.asarray(self[self.ALTIDX].values)
+        n_rows = ce_altidx.shape[0]
+        row_case = np.repeat(np.arange(ce_caseptr.shape[0] - 1), np.diff(ce_caseptr))
+
+        if 'co' in self:
+            co = self['co'].values.astype(float_dtype, copy=False)
+        else:
+            co = np.empty( (self.n_cases, 0), dtype=float_dtype)
+
+        if 'ce_data' in self:
+            ce_data = self['ce_data'].values.astype(float_dtype, copy=False)
+        else:
+            ce_data = np.empty( (n_rows, 0), dtype=float_dtype)
+
+        if 'wt' in self:
+            wt = self['wt'].values.astype(float_dtype, copy=False)
+        else:
+            wt = np.ones(self.n_cases, dtype=float_dtype)
+
+        if 'ch_ce' in self:
+            ch = self['ch_ce'].values.astype(float_dtype)
+        elif 'ch' in self:
+            ch = self['ch'].values[row_case, ce_altidx].astype(float_dtype)
+        else:
+            ch = np.zeros(n_rows, dtype=float_dtype)
+
+        if 'av_ce' in self:
+            av = self['av_ce'].values.astype(np.int8)
+        elif 'av' in self:
+            av = self['av'].values[row_case, ce_altidx].astype(np.int8)
+        else:
+            av = np.ones(n_rows, dtype=np.int8)
+
+        return SparseDataArrays(
+            ch, av, wt, co, ce_data, ce_altidx, ce_caseptr, self.n_alts,
+        )
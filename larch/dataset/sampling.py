@@ -0,0 +1,267 @@
+"""
+Sampling of alternatives from large choice sets.
+
+A random subset of alternatives is drawn for each case, with replacement,
+and the result is stored as |idce| data.  Estimating a multinomial logit
+model on the sampled alternatives is consistent when each utility is
+shifted by the McFadden sampling correction
+
+    log(n_j) - log(K_s * q_j)
+
+where `n_j` is the number of times alternative `j` appears in the sample
+for the case (including the forced inclusion of the chosen alternative),
+`K_s` is the number of draws taken from the stratum holding `j`, and
+`q_j` is the probability that a single draw from that stratum selects `j`.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import numba as nb
+from typing import Mapping
+
+from .dim_names import CASEALT, ALTIDX, CASEPTR
+
+
+@nb.njit(parallel=True, cache=True)
+def _cumulative_weights(weights, strata_alts, strata_ptr):
+    out = np.zeros((weights.shape[0], strata_alts.shape[0]), dtype=np.float64)
+    for row in nb.prange(weights.shape[0]):
+        for s in range(strata_ptr.shape[0] - 1):
+            total = 0.0
+            for i in range(strata_ptr[s], strata_ptr[s + 1]):
+                w = weights[row, strata_alts[i]]
+                if w > 0:
+                    total += w
+                out[row, i] = total
+    return out
+
+
+@nb.njit(parallel=True, cache=True)
+def _draw_alternatives(
+        cumw,
+        weights,
+        strata_alts,
+        strata_ptr,
+        alt_stratum,
+        n_draws,
+        chosen_alts,
+        chosen_ptr,
+        seed,
+        out_alt,
+        out_correction,
+        n_unique,
+):
+    n_cases = n_unique.shape[0]
+    n_strata = strata_ptr.shape[0] - 1
+    for c in nb.prange(n_cases):
+        # seeded per case, so results do not depend on the thread layout
+        np.random.seed((seed + c) % 4294967296)
+        row = 0 if cumw.shape[0] == 1 else c
+        draws = np.empty(out_alt.shape[1], dtype=np.int32)
+        j = 0
+        for s in range(n_strata):
+            lo = strata_ptr[s]
+            hi = strata_ptr[s + 1]
+            if hi <= lo:
+                continue
+            total = cumw[row, hi - 1]
+            if total <= 0:
+                continue
+            for _ in range(n_draws[s]):
+                r = lo + np.searchsorted(cumw[row, lo:hi], np.random.random() * total, side='right')
+                if r >= hi:
+                    r = hi - 1
+                draws[j] = strata_alts[r]
+                j += 1
+        for i in range(chosen_ptr[c], chosen_ptr[c + 1]):
+            draws[j] = chosen_alts[i]
+            j += 1
+        draws[:j].sort()
+        u = -1
+        for i in range(j):
+            if u < 0 or draws[i] != out_alt[c, u]:
+                u += 1
+                out_alt[c, u] = draws[i]
+                out_correction[c, u] = 1.0
+            else:
+                out_correction[c, u] += 1.0
+        n_unique[c] = u + 1
+        for i in range(u + 1):
+            a = out_alt[c, i]
+            s = alt_stratum[a]
+            count = out_correction[c, i]
+            out_correction[c, i] = np.log(count)
+            if s < 0 or n_draws[s] == 0:
+                continue
+            total = cumw[row, strata_ptr[s + 1] - 1]
+            w = weights[row, a]
+            if w > 0 and total > 0:
+                out_correction[c, i] -= np.log(n_draws[s] * w / total)
+
+
+def _as_case_alt_array(dataset, x, caseid, altid, dtype):
+    """Get an array with shape (1 or n_cases, n_alts) from a variable name or values."""
+    if isinstance(x, str):
+        x = dataset[x]
+    if isinstance(x, xr.DataArray):
+        if caseid in x.dims:
+            x = x.transpose(caseid, altid)
+        else:
+            x = x.transpose(altid).expand_dims(caseid)
+        x = x.values
+    x = np.asarray(x, dtype=dtype)
+    if x.ndim == 1:
+        x = x[np.newaxis, :]
+    return x
+
+
+def sample_alternatives(
+        dataset,
+        n_samples,
+        size=None,
+        chosen=None,
+        avail=None,
+        strata=None,
+        seed=None,
+        correction='sampling_correction',
+):
+    """
+    Draw a random sample of alternatives for each case.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        A dense |idca| dataset, with both CASEID and ALTID dimensions.
+    n_samples : int or Mapping
+        The number of draws to take for each case, with replacement.
+        When `strata` are given, this is the number of draws from each
+        stratum, or a mapping of stratum labels to numbers of draws.
+    size : str or array-like, optional
+        Sampling weights, either a variable name or an array with the
+        ALTID dimension and optionally the CASEID dimension.  Within
+        each stratum, alternatives are drawn with probability
+        proportional to this size.  If not given, draws are uniform.
+    chosen : str, optional
+        Name of a variable giving the observed choices.  Alternatives
+        with non-zero values are always included in the sample.
+    avail : str, optional
+        Name of a variable giving availability.  Unavailable
+        alternatives are never drawn.
+    strata : str or array-like, optional
+        Labels giving a stratum for each alternative.  Alternatives with
+        missing labels are never drawn.
+    seed : int, optional
+        Seed for the random draws.
+    correction : str, default 'sampling_correction'
+        Name of the variable to hold the sampling correction, which
+        should enter the utility of each alternative with a coefficient
+        fixed at 1, e.g. by adding ``P.sampling_correction *
+        X.sampling_correction`` to `utility_ca` and locking that
+        parameter at 1.
+
+    Returns
+    -------
+    Dataset
+        An |idce| dataset holding one row per sampled alternative
+        for each case.  Variables of the input with the ALTID dimension
+        are gathered onto those rows.
+    """
+    caseid = dataset.dc.CASEID
+    altid = dataset.dc.ALTID
+    if caseid is None or altid is None or altid not in dataset.dims:
+        raise ValueError("sampling alternatives requires idca data with CASEID and ALTID dimensions")
+    n_cases = dataset.dims[caseid]
+    n_alts = dataset.dims[altid]
+
+    if size is None:
+        weights = np.ones((1, n_alts), dtype=np.float64)
+    else:
+        weights = _as_case_alt_array(dataset, size, caseid, altid, np.float64)
+    weights = np.nan_to_num(weights, nan=0.0, posinf=0.0, neginf=0.0)
+    if avail is not None:
+        av = _as_case_alt_array(dataset, avail, caseid, altid, np.float64)
+        weights = np.where(av != 0, weights, 0.0)
+    weights = np.ascontiguousarray(weights)
+
+    if strata is None:
+        alt_stratum = np.zeros(n_alts, dtype=np.int32)
+        labels = [None]
+    else:
+        if isinstance(strata, str):
+            strata = dataset[strata].transpose(altid).values
+        codes, labels = pd.factorize(np.asarray(strata).reshape(-1), sort=True)
+        alt_stratum = codes.astype(np.int32)
+    if isinstance(n_samples, Mapping):
+        n_draws = np.asarray([n_samples.get(i, 0) for i in labels], dtype=np.int64)
+    else:
+        n_draws = np.full(len(labels), n_samples, dtype=np.int64)
+
+    in_strata = np.where(alt_stratum >= 0)[0]
+    strata_alts = in_strata[np.argsort(alt_stratum[in_strata], kind='stable')].astype(np.int32)
+    strata_ptr = np.zeros(len(labels) + 1, dtype=np.int64)
+    strata_ptr[1:] = np.cumsum(np.bincount(alt_stratum[in_strata], minlength=len(labels)))
+    cumw = _cumulative_weights(weights, strata_alts, strata_ptr)
+
+    if chosen is not None:
+        ch = _as_case_alt_array(dataset, chosen, caseid, altid, np.float64)
+        ch = np.broadcast_to(ch, (n_cases, n_alts))
+        chosen_cases, chosen_alts = np.nonzero(ch)
+    else:
+        chosen_cases = chosen_alts = np.zeros(0, dtype=np.int64)
+    chosen_ptr = np.zeros(n_cases + 1, dtype=np.int64)
+    chosen_ptr[1:] = np.cumsum(np.bincount(chosen_cases, minlength=n_cases))
+    max_chosen = int(np.diff(chosen_ptr).max()) if n_cases else 0
+
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    seed = int(seed) % 4294967296
+    width = int(n_draws.sum()) + max_chosen
+    out_alt = np.zeros((n_cases, width), dtype=np.int32)
+    out_correction = np.zeros((n_cases, width), dtype=np.float64)
+    n_unique = np.zeros(n_cases, dtype=np.int64)
+    _draw_alternatives(
+        cumw,
+        weights,
+        strata_alts,
+        strata_ptr,
+        alt_stratum,
+        n_draws,
+        chosen_alts.astype(np.int32),
+        chosen_ptr,
+        seed,
+        out_alt,
+        out_correction,
+        n_unique,
+    )
+
+    keep = np.arange(width)[np.newaxis, :] < n_unique[:, np.newaxis]
+    row_alt = out_alt[keep]
+    row_case = np.repeat(np.arange(n_cases), n_unique)
+    caseptr = np.zeros(n_cases + 1, dtype=np.int64)
+    caseptr[1:] = np.cumsum(n_unique)
+
+    data_vars = {}
+    for name, da in dataset.data_vars.items():
+        if altid in da.dims and caseid in da.dims:
+            da = da.transpose(caseid, altid, ...)
+            data_vars[name] = ((CASEALT, *da.dims[2:]), da.values[row_case, row_alt])
+        elif altid in da.dims:
+            da = da.transpose(altid, ...)
+            data_vars[name] = ((CASEALT, *da.dims[1:]), da.values[row_alt])
+        else:
+            data_vars[name] = da
+    data_vars[correction] = ((CASEALT,), out_correction[keep])
+
+    coords = {
+        k: v for k, v in dataset.coords.items()
+        if not (caseid in v.dims and altid in v.dims)
+    }
+    coords[ALTIDX] = xr.DataArray(row_alt, dims=CASEALT)
+    coords[CASEPTR] = xr.DataArray(caseptr, dims=CASEPTR)
+    result = type(dataset)(data_vars=data_vars, coords=coords, attrs=dict(dataset.attrs))
+    result.attrs['_exclude_dims_'] = (caseid, altid, CASEPTR)
+    result.dc.CASEALT = CASEALT
+    result.dc.ALTIDX = ALTIDX
+    result.dc.CASEPTR = CASEPTR
+    return result
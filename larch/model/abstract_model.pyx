@@ -640,6 +640,33 @@ cdef class AbstractChoiceModel(ParameterFrame):
 		from .optimization import maximize_loglike
 		return maximize_loglike(self, *args, **kwargs)
 
+	def multi_start_estimate(self, *args, **kwargs):
+		"""
+		Maximize the log likelihood from several starting points.
+
+		Parameters
+		----------
+		starts : int or Sequence, default 10
+			Either the number of random starts, or a sequence of
+			starting values.
+		prune_after : int, optional
+			Run every start for only this many iterations first, and
+			then continue only the best starts.
+		executor : {'process', 'thread', None}, default 'process'
+			How to run starts concurrently.
+
+		Returns
+		-------
+		list[dictx]
+			Results of `maximize_loglike` for every start, best first.
+
+		See Also
+		--------
+		larch.model.optimization.multi_start_estimate
+		"""
+		from .optimization import multi_start_estimate
+		return multi_start_estimate(self, *args, **kwargs)
+
 	def estimate(self, dataservice=None, autoscale_weights=True, **kwargs):
 		"""
 		A convenience method to load data, maximize loglike, and get covariance.
@@ -133,6 +133,54 @@ class LatentClassModel(AbstractChoiceModel):
 		if x is not None:
 			self._k_membership.set_values(x)
 
+	def _uses_numba(self):
+		"""bool : Whether all the component models are NumbaModels."""
+		from ..numba.model import NumbaModel
+		return isinstance(self._k_membership, NumbaModel) and all(
+			isinstance(m, NumbaModel) for m in self._k_models.values()
+		)
+
+	def _numba_evaluate(
+			self,
+			x=None,
+			*,
+			start_case=0,
+			stop_case=-1,
+			step_case=1,
+			leave_out=-1,
+			keep_only=-1,
+			subsample=-1,
+			**kwargs,
+	):
+		"""
+		Evaluate the model in the fused latent class kernel.
+
+		Other keyword arguments are passed to `latent_class_evaluate`.
+		"""
+		from ..numba.latent_class import latent_class_evaluate, case_index
+		self.__prep_for_compute(x)
+		classes = [self._k_models[k] for k in self._k_model_names()]
+		for m in (self._k_membership, *classes):
+			m.unmangle()
+			if not m._frame.index.equals(self._frame.index):
+				raise ValueError("parameter frames of the component models are not synchronized")
+		return latent_class_evaluate(
+			self._k_membership,
+			classes,
+			self._frame.holdfast.to_numpy(),
+			self.pvals,
+			case_index(
+				self.n_cases,
+				start_case=start_case,
+				stop_case=stop_case,
+				step_case=step_case,
+				leave_out=leave_out,
+				keep_only=keep_only,
+				subsample=subsample,
+			),
+			**kwargs,
+		)
+
 	def class_membership_probability(self, x=None, start_case=0, stop_case=-1, step_case=1):
 		self.__prep_for_compute(x)
 		return self._k_membership.probability(
@@ -155,6 +203,21 @@ class LatentClassModel(AbstractChoiceModel):
 	def probability(self, x=None, start_case=0, stop_case=-1, step_case=1, return_dataframe=False,):
 		self.__prep_for_compute(x)
 
+		if self._uses_numba():
+			p = self._numba_evaluate(
+				start_case=start_case, stop_case=stop_case, step_case=step_case,
+				return_probability=True,
+			).probability
+			if return_dataframe and self.dataframes is not None:
+				if stop_case == -1:
+					stop_case = self.dataframes.n_cases
+				return pandas.DataFrame(
+					p,
+					index=self._dataframes.caseindex[start_case:stop_case:step_case],
+					columns=self._dataframes.alternative_codes(),
+				)
+			return p
+
 		if self.dataframes is not None:
 			if start_case >= self.dataframes.n_cases:
 				raise IndexError("start_case >= n_cases")
@@ -380,11 +443,38 @@ class LatentClassModel(AbstractChoiceModel):
 			Other arrays are also included if `persist` is set to True.
 
 		"""
+		from ..util import dictx
+
+		if self._uses_numba():
+			result = self._numba_evaluate(
+				x,
+				start_case=start_case, stop_case=stop_case, step_case=step_case,
+				leave_out=leave_out, keep_only=keep_only, subsample=subsample,
+				return_gradient=not probability_only,
+				return_bhhh=bool(persist & persist_flags.PERSIST_BHHH) and not probability_only,
+				return_probability=probability_only or bool(persist & persist_flags.PERSIST_PROBABILITY),
+			)
+			y = dictx()
+			if probability_only:
+				y.ll = numpy.nan
+				y.probability = result.probability
+				return y
+			y.ll = result.loglike
+			y.dll = result.d_loglike
+			if persist & persist_flags.PERSIST_PROBABILITY:
+				y.probability = result.probability
+			if persist & persist_flags.PERSIST_BHHH:
+				y.bhhh = result.bhhh
+			if (
+					start_case==0 and (stop_case==-1 or stop_case==self.n_cases) and step_case==1
+					and leave_out==-1 and keep_only==-1 and subsample==-1
+			):
+				self._check_if_best(y.ll)
+			return y
+
 		if leave_out != -1 or keep_only != -1 or subsample != -1:
 			raise NotImplementedError()
 
-		from ..util import dictx
-
 		self.__prep_for_compute(x)
 		pr = self.probability(
 			x=None,
@@ -558,6 +648,26 @@ class LatentClassModel(AbstractChoiceModel):
 			A dictx is returned if `persist` is non-zero.
 		"""
 		self.__prep_for_compute(x)
+		if self._uses_numba():
+			from ..util import dictx
+			result = self._numba_evaluate(
+				start_case=start_case, stop_case=stop_case, step_case=step_case,
+				leave_out=leave_out, keep_only=keep_only, subsample=subsample,
+				return_probability=probability_only or bool(persist & persist_flags.PERSIST_PROBABILITY),
+			)
+			if probability_only:
+				return result.probability
+			y = dictx(ll=result.loglike)
+			if (
+					start_case==0 and (stop_case==-1 or stop_case==self.n_cases) and step_case==1
+					and leave_out==-1 and keep_only==-1 and subsample==-1
+			):
+				self._check_if_best(y.ll)
+			if persist & persist_flags.PERSIST_PROBABILITY:
+				y.probability = result.probability
+			if persist:
+				return y
+			return y.ll
 		pr = self.probability(
 			x=None,
 			start_case=start_case,
@@ -6,8 +6,69 @@ from . import persist_flags
 from ..exceptions import ParameterNotInModelWarning
 from .constraints import ParametricConstraintList
 from collections.abc import MutableSequence
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import pickle
+import warnings
+
+
+_WORKER_MODELS = None
+
+
+def _init_worker(models_pickle, shared_names):
+	global _WORKER_MODELS
+	_WORKER_MODELS = pickle.loads(models_pickle)
+	for model, shared_name in zip(_WORKER_MODELS, shared_names):
+		# models are pickled without their data, which is attached
+		# from shared memory instead
+		model.dataset = shared_name
+
+
+def _set_member_values(model, values):
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", category=ParameterNotInModelWarning)
+		model.set_values(**values)
+
+
+def _call_member(model, method, kwargs):
+	return getattr(model, method)(**kwargs)
+
+
+def _call_worker_member(i, values, method, kwargs):
+	model = _WORKER_MODELS[i]
+	_set_member_values(model, values)
+	return _call_member(model, method, kwargs)
+
 
 class ModelGroup(AbstractChoiceModel, MutableSequence):
+	"""
+	A group of models that share a set of parameters.
+
+	The log likelihood of the group is the sum of the log likelihoods
+	of the member models, and derivatives are combined on the shared
+	parameter frame.
+
+	Parameters
+	----------
+	models : Iterable[AbstractChoiceModel]
+		The member models.  Any ModelGroup given here is flattened
+		into its members.
+	executor : {None, 'thread', 'process'} or concurrent.futures.Executor, optional
+		How to evaluate the member models.  By default they are
+		evaluated one at a time.  With 'thread', they are evaluated
+		concurrently in a thread pool; the model kernels release the GIL,
+		but for numba models a thread safe threading layer ('tbb' or
+		'omp') is needed.  With 'process', each worker process holds
+		its own copy of the member models, made when the pool is first
+		used, and only parameter values and results are sent between
+		processes.  The prepared data of the members is published to
+		shared memory at that time, and the workers attach to it, so
+		this requires NumbaModel members with a prepared `dataset`.
+		An existing Executor can also be given, and is used as a
+		thread pool.
+	n_workers : int, optional
+		The number of workers for a 'thread' or 'process' executor,
+		defaults to the number of member models.
+	"""
 
 	constraints = ParametricConstraintList()
 
@@ -20,6 +81,8 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 			title=None,
 			dataservice=None,
 			constraints=None,
+			executor=None,
+			n_workers=None,
 	):
 		super().__init__(
 			parameters=parameters,
@@ -36,6 +99,10 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 		self._dataframes = None
 		self._mangled = True
 		self.constraints = constraints
+		self._pool = None
+		self._shared_data = []
+		self.n_workers = n_workers
+		self.executor = executor
 
 	def __getitem__(self, x):
 		return self._k_models[x]
@@ -43,9 +110,11 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 	def __setitem__(self, i, value):
 		assert isinstance(value, AbstractChoiceModel)
 		self._k_models[i] = value
+		self.shutdown_executor()
 
 	def __delitem__(self, x):
 		del self._k_models[x]
+		self.shutdown_executor()
 
 	def __len__(self):
 		return len(self._k_models)
@@ -56,6 +125,121 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 	def insert(self, i, value):
 		assert isinstance(value, AbstractChoiceModel)
 		self._k_models.insert(i,value)
+		self.shutdown_executor()
+
+	@property
+	def executor(self):
+		"""{None, 'thread', 'process'} or Executor : How member models are evaluated."""
+		return self._executor
+
+	@executor.setter
+	def executor(self, value):
+		if value not in (None, 'thread', 'process') and not isinstance(value, Executor):
+			raise ValueError(f"executor must be None, 'thread', 'process' or an Executor, not {value!r}")
+		self.shutdown_executor()
+		self._executor = value
+
+	def shutdown_executor(self):
+		"""
+		Shut down the pool of workers used to evaluate member models.
+
+		A new pool is started the next time it is needed.  For a
+		'process' executor, this must be called after changing the data
+		or specification of the member models, so that the workers get
+		fresh copies of them, and it releases the shared memory holding
+		the data of the members.  An Executor given by the user is not
+		shut down, only released.
+		"""
+		pool = getattr(self, '_pool', None)
+		self._pool = None
+		if pool is not None and not isinstance(getattr(self, '_executor', None), Executor):
+			pool.shutdown(wait=True)
+		shared_data = getattr(self, '_shared_data', [])
+		self._shared_data = []
+		for handle in shared_data:
+			handle.unlink()
+
+	def _share_member_data(self):
+		"""
+		Publish the prepared data of every member to shared memory.
+
+		Returns
+		-------
+		list[str]
+			The names of the shared data, in the order of the members.
+		"""
+		from ..exceptions import MissingDataError
+		from ..numba.shared_data import publish_dataset
+		shared_names = []
+		try:
+			for k in self._k_models:
+				if not hasattr(k, 'share_dataset'):
+					raise TypeError(
+						f"the 'process' executor requires NumbaModel members, not {type(k)}"
+					)
+				if k.shared_data is not None:
+					shared_names.append(k.shared_data)
+					continue
+				dataset = k.dataset
+				if dataset is None:
+					raise MissingDataError(
+						"the 'process' executor requires members with a prepared dataset"
+					)
+				handle = publish_dataset(dataset)
+				self._shared_data.append(handle)
+				shared_names.append(handle.name)
+		except BaseException:
+			self.shutdown_executor()
+			raise
+		return shared_names
+
+	def _get_pool(self):
+		if self._pool is None:
+			n_workers = self.n_workers or len(self._k_models)
+			if isinstance(self._executor, Executor):
+				self._pool = self._executor
+			elif self._executor == 'thread':
+				self._pool = ThreadPoolExecutor(max_workers=n_workers)
+			else:
+				shared_names = self._share_member_data()
+				self._pool = ProcessPoolExecutor(
+					max_workers=n_workers,
+					initializer=_init_worker,
+					initargs=(pickle.dumps(self._k_models), shared_names),
+				)
+		return self._pool
+
+	def _map_members(self, method, **kwargs):
+		"""
+		Call a method on every member model, using the group's executor.
+
+		Parameters
+		----------
+		method : str
+			Name of the method to call.
+		**kwargs
+			Passed to the method.
+
+		Returns
+		-------
+		list
+			The results, in the order of the member models.
+		"""
+		if self._executor is None or len(self._k_models) < 2:
+			return [_call_member(k, method, kwargs) for k in self._k_models]
+		pool = self._get_pool()
+		if self._executor == 'process':
+			values = dict(self.pf.value)
+			futures = [
+				pool.submit(_call_worker_member, i, values, method, kwargs)
+				for i in range(len(self._k_models))
+			]
+		else:
+			futures = [
+				pool.submit(_call_member, k, method, kwargs)
+				for k in self._k_models
+			]
+		return [f.result() for f in futures]
 
 	@property
 	def dataframes(self):
@@ -222,7 +406,7 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 
 		from ..util import dictx
 		self.__prep_for_compute(x)
-		ll2_parts = [m.loglike(persist=persist) for m in self._k_models]
+		ll2_parts = self._map_members('loglike', persist=persist)
 		if not persist:
 			result = sum(ll2_parts)
 			self._check_if_best(result)
@@ -287,14 +471,10 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 
 		from ..util import dictx
 		self.__prep_for_compute(x)
-		ll2_parts = [m.loglike2(persist=persist) for m in self._k_models]
-		dll = ll2_parts[0].dll
-		for y in ll2_parts[1:]:
-			dll = dll.add(y.dll, fill_value=0)
-		dll = dll[self.pf.index]
+		ll2_parts = self._map_members('loglike2', persist=persist, return_series=True)
 		ll2 = dictx(
 			ll=sum(y.ll for y in ll2_parts),
-			dll=dll,
+			dll=self._combine_dll(ll2_parts),
 		)
 		for key in ll2_parts[0].keys():
 			if key not in {'ll','dll'}:
@@ -302,6 +482,84 @@ class ModelGroup(AbstractChoiceModel, MutableSequence):
 		self._check_if_best(ll2.ll)
 		return ll2
 
+	def _combine_dll(self, parts):
+		dll = pd.Series(0.0, index=self.pf.index)
+		for y in parts:
+			dll = dll.add(pd.Series(y.dll), fill_value=0)
+		return dll[self.pf.index]
+
+	def _combine_bhhh(self, parts):
+		bhhh = pd.DataFrame(0.0, index=self.pf.index, columns=self.pf.index)
+		for y in parts:
+			bhhh = bhhh.add(pd.DataFrame(y.bhhh), fill_value=0)
+		return bhhh.loc[self.pf.index, self.pf.index]
+
+	def loglike2_bhhh(
+			self,
+			x=None,
+			*,
+			return_series=False,
+			start_case=0,
+			stop_case=-1,
+			step_case=1,
+			persist=0,
+			leave_out=-1,
+			keep_only=-1,
+			subsample=-1,
+	):
+		"""
+		Compute a log likelihood value, its first derivative, and the BHHH approximation of the Hessian.
+
+		Parameters
+		----------
+		x : {'null', 'init', 'best', array-like, dict, scalar}, optional
+			Values for the parameters.  See :ref:`set_values` for details.
+		return_series : bool, default False
+			Return the derivative as a Series and the BHHH matrix as a
+			DataFrame, indexed by parameter name, instead of as arrays.
+
+		Returns
+		-------
+		dictx
+			The log likelihood is given by key 'll', the first derivative by key 'dll',
+			and the BHHH matrix by 'bhhh'. Each is summed over the member models, on the
+			parameter frame of the group. Other arrays are also included, as lists over
+			the member models, if `persist` is set to True.
+
+		"""
+
+		if start_case != 0:
+			raise NotImplementedError('start_case != 0')
+		if stop_case != -1:
+			raise NotImplementedError('stop_case != -1')
+		if step_case != 1:
+			raise NotImplementedError('step_case != 1')
+		if leave_out != -1:
+			raise NotImplementedError('leave_out != -1')
+		if keep_only != -1:
+			raise NotImplementedError('keep_only != -1')
+		if subsample != -1:
+			raise NotImplementedError('subsample != -1')
+
+		from ..util import dictx
+		self.__prep_for_compute(x)
+		ll2_parts = self._map_members('loglike2_bhhh', persist=persist, return_series=True)
+		dll = self._combine_dll(ll2_parts)
+		bhhh = self._combine_bhhh(ll2_parts)
+		if not return_series:
+			dll = dll.values
+			bhhh = bhhh.values
+		ll2 = dictx(
+			ll=sum(y.ll for y in ll2_parts),
+			dll=dll,
+			bhhh=bhhh,
+		)
+		for key in ll2_parts[0].keys():
+			if key not in {'ll','dll','bhhh'}:
+				ll2[key] = list(y[key] for y in ll2_parts)
+		self._check_if_best(ll2.ll)
+		return ll2
+
 	def doctor(
 			self,
 			repair_ch_av=None,
@@ -5,6 +5,7 @@ from .controller import Model5c
 from ..exceptions import MissingDataError, BHHHSimpleStepFailure
 
 import logging
+import pickle
 from ..log import logger_name
 logger = logging.getLogger(logger_name)
 
@@ -47,6 +48,77 @@ class ModelDashboard:
                     self.body.update(body, force=force)
 
 
+class FusedObjective:
+    """
+    Negative log likelihood and its derivatives, from one pass over the data.
+
+    SciPy optimizers call the objective function and its gradient (and
+    for some methods its Hessian) as separate callables, usually at the
+    same parameter values.  This computes all of them with one call to
+    `loglike2` (or `loglike2_bhhh`) at each new set of values, and serves
+    the other callables from a small cache keyed by those values.
+
+    Parameters
+    ----------
+    model : AbstractChoiceModel
+    args : tuple
+        The start_case, stop_case, step_case, leave_out, keep_only and
+        subsample arguments for the model's log likelihood.
+    bhhh : bool, default False
+        Also compute the BHHH matrix, which `hess` gives as an
+        approximation of the Hessian of the negative log likelihood.
+    cache_size : int, default 4
+        The number of sets of parameter values to remember.
+    """
+
+    def __init__(self, model, args=(None, None, None, -1, -1, -1), bhhh=False, cache_size=4):
+        from collections import OrderedDict
+        self.model = model
+        self.kwargs = dict(zip(
+            ('start_case', 'stop_case', 'step_case', 'leave_out', 'keep_only', 'subsample'),
+            args,
+        ))
+        self.bhhh = bhhh
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.n_evaluations = 0
+
+    def _evaluate(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        key = x.tobytes()
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            return result
+        if self.bhhh:
+            part = self.model.loglike2_bhhh(x, **self.kwargs)
+            bhhh = np.asarray(part.bhhh, dtype=np.float64)
+        else:
+            part = self.model.loglike2(x, return_series=False, **self.kwargs)
+            bhhh = None
+        self.n_evaluations += 1
+        result = (-float(part.ll), -np.asarray(part.dll, dtype=np.float64), bhhh)
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def fun(self, x, *args):
+        """The negative log likelihood."""
+        return self._evaluate(x)[0]
+
+    def jac(self, x, *args):
+        """The gradient of the negative log likelihood."""
+        return self._evaluate(x)[1]
+
+    def hess(self, x, *args):
+        """The BHHH approximation of the Hessian of the negative log likelihood."""
+        result = self._evaluate(x)
+        if result[2] is None:
+            raise ValueError("the BHHH matrix is only computed with bhhh=True")
+        return result[2]
+
+
 def maximize_loglike(
         model,
         method=None,
@@ -70,6 +142,7 @@ def maximize_loglike(
         return_dashboard=False,
         dashboard=None,
         prior_result=None,
+        bhhh_hessian=False,
         **kwargs,
 ):
     """
@@ -84,9 +157,15 @@ def maximize_loglike(
         The optimization method to use.  See scipy.optimize for
         most possibilities, or use 'BHHH'. Defaults to SLSQP if
         there are any constraints or finite parameter bounds,
-        otherwise defaults to BHHH.
+        otherwise defaults to BHHH.  For a NumbaModel, 'trust-bhhh'
+        uses Levenberg-Marquardt trust region steps with the BHHH
+        matrix, which respects bounds but not other constraints.
     quiet : bool, default False
         Whether to suppress the dashboard.
+    bhhh_hessian : bool, default False
+        For SciPy methods that use a Hessian, such as 'trust-constr'
+        or 'newton-cg', supply the BHHH matrix, which is computed in
+        the same pass over the data as the log likelihood and gradient.
 
     Returns
     -------
@@ -232,6 +311,27 @@ def maximize_loglike(
                 method = _restore_method
                 model.constraint_intensity = 0.0
 
+        if method.lower() == 'trust-bhhh':
+            if not hasattr(model, 'fit_trust_region'):
+                raise NotImplementedError("the trust-bhhh method requires a NumbaModel")
+            current_ll, tolerance, iter_tr, steps_tr, message, n_evaluations = model.fit_trust_region(
+                ctol=options.get('ctol', 1e-5),
+                maxiter=options.get('maxiter', 100),
+                hessian=options.get('hessian', 'bhhh'),
+                callback=callback,
+                leave_out=leave_out,
+                keep_only=keep_only,
+                subsample=subsample,
+            )
+            raw_result = {
+                'loglike': current_ll,
+                'x': model.pvals,
+                'tolerance': tolerance,
+                'steps': steps_tr,
+                'message': message,
+                'n_evaluations': n_evaluations,
+            }
+
         if method.lower( )=='bhhh':
             try:
                 max_iter = options.get('maxiter' ,100)
@@ -298,7 +398,7 @@ def maximize_loglike(
                 )
                 raise
 
-        if method.lower() != 'bhhh':
+        if method.lower() not in ('bhhh', 'trust-bhhh'):
             try:
                 bounds = None
                 if isinstance(method ,str) and method.lower() in ('slsqp', 'l-bfgs-b', 'tnc', 'trust-constr'):
@@ -316,18 +416,26 @@ def maximize_loglike(
                     constraints = ()
 
                 args = getattr(model, '_null_slice', (0,-1,1))
+                # the objective and its gradient come from one pass over the data
+                objective = FusedObjective(
+                    model,
+                    args+(leave_out, keep_only, subsample), # start_case, stop_case, step_case, leave_out, keep_only, subsample
+                    bhhh=bhhh_hessian,
+                )
+                if bhhh_hessian and 'hess' not in kwargs:
+                    kwargs['hess'] = objective.hess
                 raw_result = minimize(
-                    model.neg_loglike,
+                    objective.fun,
                     model.pvals,
-                    args=args+(leave_out, keep_only, subsample), # start_case, stop_case, step_case, leave_out, keep_only, subsample
                     method=method,
-                    jac=model.neg_d_loglike,
+                    jac=objective.jac,
                     bounds=bounds,
                     callback=callback,
                     options=options,
                     constraints=constraints,
                     **kwargs
                 )
+                raw_result['n_evaluations'] = objective.n_evaluations
             except:
                 dashboard.update(
                     f'Iteration {iteration_number:03} [Exception] {iteration_number_tail}',
@@ -401,6 +509,400 @@ def maximize_loglike(
             setattr(model, 'constraint_sharpness', _initial_constraint_sharpness)
 
 
+def _numba_threads_are_safe():
+    """Whether numba parallel kernels can be launched from several threads at once."""
+    try:
+        import numba
+        return numba.threading_layer() != 'workqueue'
+    except (ImportError, ValueError):
+        # no parallel kernel has run yet, so the layer is unknown
+        return False
+
+
+def _draw_starts(model, starts, scale, seed):
+    """Get an array of starting values, one row per start."""
+    if not np.isscalar(starts):
+        rows = []
+        for x in starts:
+            if isinstance(x, (dict, pd.Series)):
+                model.set_values(model.pvals)
+                model.set_values(dict(x))
+                rows.append(model.pvals)
+            else:
+                rows.append(np.asarray(x, dtype=float))
+        return np.stack(rows)
+    rng = np.random.default_rng(seed)
+    pf = model.pf
+    center = pf['value'].to_numpy(dtype=float)
+    draws = center + rng.normal(scale=scale, size=(int(starts), len(center)))
+    draws = np.clip(draws, pf['minimum'].to_numpy(dtype=float), pf['maximum'].to_numpy(dtype=float))
+    holdfast = pf['holdfast'].to_numpy() != 0
+    draws[:, holdfast] = center[holdfast]
+    # the first start is always the current values
+    draws[0] = center
+    return draws
+
+
+def _run_start(model, x, kwargs):
+    model.set_values(x)
+    result = model.maximize_loglike(**kwargs)
+    result['x'] = pd.Series(model.pvals, index=model.pnames)
+    return result
+
+
+_START_WORKER_MODEL = None
+
+
+def _init_start_worker(model_pickle, shared_name):
+    global _START_WORKER_MODEL
+    _START_WORKER_MODEL = pickle.loads(model_pickle)
+    # the model is pickled without its data, which is attached from
+    # shared memory instead
+    _START_WORKER_MODEL.dataset = shared_name
+
+
+def _run_start_in_process(x, kwargs):
+    result = _run_start(_START_WORKER_MODEL, x, kwargs)
+    result.pop('dashboard', None)
+    return result
+
+
+def multi_start_estimate(
+        model,
+        starts=10,
+        scale=1.0,
+        seed=None,
+        prune_after=None,
+        prune_margin=None,
+        keep=None,
+        executor='process',
+        n_workers=None,
+        **kwargs,
+):
+    """
+    Maximize the log likelihood from several starting points.
+
+    Likelihoods of nested, cross-nested and latent class models are not
+    generally concave, so a single estimation can end at a local maximum.
+    This runs `maximize_loglike` from a number of different starting
+    values concurrently, all sharing one copy of the prepared data.
+
+    Parameters
+    ----------
+    model : AbstractChoiceModel
+    starts : int or Sequence
+        Either the number of random starts, or a sequence of starting
+        values, each given as an array of parameter values, or a dict or
+        Series mapping parameter names to values.  Random starts are
+        drawn around the current parameter values, and the first start
+        is always the current values themselves.
+    scale : float, default 1.0
+        The standard deviation of random starting values around the
+        current values.  Draws are clipped to the parameter bounds,
+        and holdfast parameters are not varied.
+    seed : int, optional
+        Seed for drawing random starts.
+    prune_after : int, optional
+        Run every start for only this many iterations first, and then
+        continue only the starts that are not pruned.  If not given,
+        every start is run to convergence.
+    prune_margin : float, optional
+        After `prune_after` iterations, prune starts whose log
+        likelihood trails the best one by more than this.
+    keep : int, optional
+        After `prune_after` iterations, continue at most this many of
+        the best starts.  If neither this nor `prune_margin` is given,
+        half the starts (rounded up) are continued.
+    executor : {'process', 'thread', None}, default 'process'
+        How to run starts concurrently.  With 'process', the prepared
+        data is published to shared memory once, and the model is sent
+        once to each worker process, which attaches to the shared data.
+        With 'thread', each start runs on a copy of the model that
+        shares the loaded arrays; for numba models this requires a
+        thread safe numba threading layer (tbb or omp).  Both require a
+        model with a prepared `dataset`, e.g. a NumbaModel using a
+        datatree.  With None, or for models that cannot share their
+        data (including models using DataFrames), starts are run one
+        after another on this model.
+    n_workers : int, optional
+        The number of concurrent workers.
+    **kwargs
+        Other arguments are passed to `maximize_loglike`.
+
+    Returns
+    -------
+    list[dictx]
+        Results of `maximize_loglike` for every start, best first.  Each
+        also gives the `start` number, the starting values as `x0`,
+        whether it was `pruned`, and a `history` of the iteration number
+        and log likelihood at the end of each stage.  The model is left
+        with the parameter values of the best result.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from ..util import dictx
+    model.unmangle()
+    x0 = _draw_starts(model, starts, scale, seed)
+    original_values = model.pvals
+    kwargs = dict(kwargs)
+    kwargs.setdefault('quiet', True)
+
+    if executor in ('process', 'thread'):
+        if not hasattr(model, 'share_dataset'):
+            executor = None
+        elif model.shared_data is None and model.dataset is None:
+            logger.debug(
+                "multi_start_estimate: the model has no prepared dataset to share, "
+                "running starts one after another"
+            )
+            executor = None
+    shared = None
+    pool = None
+    if executor == 'process':
+        if model.shared_data is not None:
+            shared_name = model.shared_data
+        else:
+            shared = model.share_dataset()
+            shared_name = shared.name
+        pool = ProcessPoolExecutor(
+            n_workers,
+            initializer=_init_start_worker,
+            initargs=(pickle.dumps(model), shared_name),
+        )
+        def submit(x, kw):
+            return pool.submit(_run_start_in_process, x, kw)
+    elif executor == 'thread':
+        model.loglike()
+        if not _numba_threads_are_safe():
+            n_workers = 1
+        pool = ThreadPoolExecutor(n_workers)
+        def submit(x, kw):
+            return pool.submit(_run_start, model.copy(share_data=True), x, dict(kw, return_dashboard=True))
+    elif executor is None:
+        class _Done:
+            def __init__(self, result):
+                self._result = result
+            def result(self):
+                return self._result
+        def submit(x, kw):
+            return _Done(_run_start(model, x, dict(kw, return_dashboard=True)))
+    else:
+        raise ValueError(f"unknown executor {executor!r}")
+
+    try:
+        results = {}
+        histories = {i: [] for i in range(len(x0))}
+        pending = list(range(len(x0)))
+        if prune_after:
+            stage_kwargs = dict(kwargs, maxiter=prune_after)
+            futures = {i: submit(x0[i], stage_kwargs) for i in pending}
+            for i, f in futures.items():
+                results[i] = f.result()
+                histories[i].append((results[i].get('iteration_number', 0), results[i].get('loglike', -np.inf)))
+            ranked = sorted(pending, key=lambda i: results[i].get('loglike', -np.inf), reverse=True)
+            best_ll = results[ranked[0]].get('loglike', -np.inf)
+            if keep is None and prune_margin is None:
+                keep = (len(ranked) + 1) // 2
+            if prune_margin is not None:
+                ranked = [i for i in ranked if results[i].get('loglike', -np.inf) >= best_ll - prune_margin]
+            if keep is not None:
+                ranked = ranked[:max(int(keep), 1)]
+            pending = ranked
+            starting = {i: results[i]['x'].to_numpy() for i in pending}
+        else:
+            starting = {i: x0[i] for i in pending}
+        futures = {}
+        for i in pending:
+            stage_kwargs = kwargs
+            if prune_after:
+                stage_kwargs = dict(kwargs, iteration_number=results[i].get('iteration_number', 0))
+            futures[i] = submit(starting[i], stage_kwargs)
+        for i, f in futures.items():
+            results[i] = f.result()
+            histories[i].append((results[i].get('iteration_number', 0), results[i].get('loglike', -np.inf)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if shared is not None:
+            shared.unlink()
+            # the model keeps its view of the data, which stays mapped
+            # in this process, but can no longer attach to it by name
+            model.shared_data = None
+
+    output = []
+    for i, result in results.items():
+        result = dictx(result)
+        result['start'] = i
+        result['x0'] = pd.Series(x0[i], index=model.pnames)
+        result['pruned'] = i not in futures
+        result['history'] = histories[i]
+        output.append(result)
+    output.sort(key=lambda r: r.get('loglike', -np.inf), reverse=True)
+    if output and 'x' in output[0]:
+        model.set_values(output[0]['x'].to_numpy())
+        model._most_recent_estimation_result = output[0].copy()
+    else:
+        model.set_values(original_values)
+    return output
+
+
+def cross_validate(
+        model,
+        cv=5,
+        warm_start=True,
+        executor='thread',
+        n_workers=None,
+        start_case=None,
+        stop_case=None,
+        step_case=None,
+        **kwargs,
+):
+    """
+    Compute a k-fold cross-validated log likelihood.
+
+    Case `c` is in fold ``c % cv``.  For each fold, the model is
+    estimated on the cases in the other folds, and the log likelihood
+    of the held out cases is computed at those estimates.
+
+    For models with data loaded as in-memory arrays (i.e. NumbaModel
+    without `chunk_size`), the held out cases are given zero weight
+    while estimating each fold.  With data prepared from a datatree or
+    dataset, the folds are estimated concurrently, each on a copy of the
+    model that shares the loaded arrays, and only the case weights differ
+    between copies.  With data from DataFrames, the folds run one after
+    another on the model itself, with the weights of the DataFrames
+    temporarily replaced.  Other models run the folds one after
+    another on the model itself, using `leave_out` and `keep_only`.
+
+    Parameters
+    ----------
+    model : AbstractChoiceModel
+    cv : int, default 5
+        The number of folds.
+    warm_start : bool, default True
+        First estimate the model on all the cases, and start the
+        estimation of every fold from those values.  Otherwise every
+        fold starts from the current parameter values.
+    executor : {'thread', None}, default 'thread'
+        Run the folds concurrently in a thread pool, or with None one
+        after another.  For numba models, folds only run concurrently
+        with a thread safe numba threading layer (tbb or omp).
+    n_workers : int, optional
+        The number of concurrent workers.
+    start_case, stop_case, step_case : int, optional
+        Only use the cases in this slice, both for estimation and for
+        the held out log likelihoods.  This is only available for
+        models with in-memory arrays.
+    **kwargs
+        Other arguments are passed to `maximize_loglike`.
+
+    Returns
+    -------
+    dictx
+        With the total held out log likelihood as `loglike`, the held
+        out log likelihood of each fold as `fold_loglike`, a DataFrame
+        of the estimated `parameters` for each fold, and the results of
+        `maximize_loglike` for each fold as `fold_results`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from ..util import dictx
+    kwargs = dict(kwargs)
+    kwargs.setdefault('quiet', True)
+    if warm_start:
+        model.maximize_loglike(**kwargs)
+    x0 = model.pvals
+    pnames = model.pnames
+    sliced = not (start_case is None and stop_case is None and step_case is None)
+
+    data_arrays = None
+    in_place = False
+    if hasattr(model, 'share_dataset'):
+        # numba models ignore `leave_out` and `keep_only`
+        model.loglike()
+        data_arrays = model._data_arrays
+        if data_arrays is None:
+            raise NotImplementedError(
+                "cross validation requires data held in memory, not streamed in chunks"
+            )
+        if model._dataset is None:
+            # arrays from DataFrames are not shared by copies of the
+            # model, and are rebuilt from the DataFrames when needed
+            in_place = True
+            executor = None
+
+    if data_arrays is None:
+        if sliced:
+            raise NotImplementedError("case slicing in cross validation requires data arrays in memory")
+
+        def run_fold(fold):
+            model.set_values(x0)
+            result = model.maximize_loglike(leave_out=fold, subsample=cv, **kwargs)
+            return model.pvals, model.loglike(keep_only=fold, subsample=cv), result
+
+        executor = None
+    else:
+        n_cases = data_arrays.wt.shape[0]
+        in_sample = np.zeros(n_cases, dtype=bool)
+        in_sample[slice(start_case, stop_case, step_case)] = True
+        fold_of = np.arange(n_cases) % cv
+
+        def run_fold(fold):
+            holdout = in_sample & (fold_of == fold)
+            weights = np.where(in_sample & ~holdout, data_arrays.wt, 0)
+            if in_place:
+                clone = model
+                dataframes = model.dataframes
+                original_weights = dataframes.data_wt
+                dataframes.data_wt = pd.DataFrame(
+                    weights.astype(np.float64), index=dataframes.caseindex, columns=['wt'],
+                )
+            else:
+                clone = model.copy(share_data=True)
+                clone._data_arrays = data_arrays._replace(wt=weights.astype(data_arrays.wt.dtype))
+            try:
+                if in_place:
+                    model.reflow_data_arrays()
+                clone.set_values(x0)
+                result = clone.maximize_loglike(**kwargs)
+            finally:
+                if in_place:
+                    dataframes.data_wt = original_weights
+                    model.reflow_data_arrays()
+                else:
+                    clone._data_arrays = data_arrays
+            return clone.pvals, clone.loglike_casewise()[holdout].sum(), result
+
+        if executor == 'thread' and not _numba_threads_are_safe():
+            n_workers = 1
+
+    most_recent_estimation_result = model._most_recent_estimation_result
+    if executor == 'thread':
+        with ThreadPoolExecutor(n_workers) as pool:
+            folds = list(pool.map(run_fold, range(cv)))
+    elif executor is None:
+        folds = [run_fold(fold) for fold in range(cv)]
+    else:
+        raise ValueError(f"unknown executor {executor!r}")
+    model.set_values(x0)
+    if in_place:
+        # the best log likelihood seen while estimating folds was for
+        # only some of the cases
+        model.clear_best_loglike()
+        model.loglike()
+        model._most_recent_estimation_result = most_recent_estimation_result
+
+    fold_loglike = pd.Series([f[1] for f in folds], index=pd.RangeIndex(cv, name='fold'))
+    return dictx(
+        loglike=fold_loglike.sum(),
+        fold_loglike=fold_loglike,
+        parameters=pd.DataFrame(
+            np.stack([f[0] for f in folds], axis=1),
+            index=pnames,
+            columns=fold_loglike.index,
+        ),
+        fold_results=[f[2] for f in folds],
+    )
+
+
 def propose_direction(bhhh, dloglike, freedoms):
     direction = np.zeros_like(dloglike)
     # try:
@@ -1,4 +1,5 @@
 from .model import NumbaModel as Model
+from .mixed import MixedNumbaModel as MixedModel
 from .. import DataFrames, P, X, PX, OMX, DBF, Reporter, NumberedCaption, read_metadata, examples, util, __version__
 from ..examples import example as _example
 from ..data_warehouse import example_file
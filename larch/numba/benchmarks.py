@@ -0,0 +1,304 @@
+"""
+Benchmarks for the numba model engine and its data loading.
+
+Run as a script to print the results::
+
+    python -m larch.numba.benchmarks
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+from ..roles import P, X, PX
+
+
+PRECISION_MODES = {
+    'float64': dict(float_dtype=np.float64),
+    'float32': dict(float_dtype=np.float32),
+    'mixed': dict(float_dtype=np.float32, accumulate_dtype=np.float64),
+}
+
+
+def mtc_model(**kwargs):
+    """
+    The MTC work mode choice MNL model, with data from `larch.data_warehouse`.
+
+    Parameters
+    ----------
+    **kwargs
+        Passed to the NumbaModel constructor.
+
+    Returns
+    -------
+    NumbaModel
+    """
+    from .model import NumbaModel
+    from ..data_warehouse import example_file
+    from ..dataset import Dataset, DataTree
+    df = pd.read_csv(example_file("MTCwork.csv.gz"), index_col=['casenum', 'altnum'])
+    tree = DataTree(main=Dataset.construct.from_idca(df, fill_missing=0))
+    m = NumbaModel(datatree=tree, **kwargs)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = '_avail_'
+    m.choice_ca_var = 'chose'
+    m.title = "MTC Example 1 (Simple MNL)"
+    return m
+
+
+def exampville_model(**kwargs):
+    """
+    The Exampville work tour nested logit mode choice model.
+
+    Parameters
+    ----------
+    **kwargs
+        Passed to the NumbaModel constructor.
+
+    Returns
+    -------
+    NumbaModel
+    """
+    from .model import NumbaModel
+    from ..examples import EXAMPVILLE
+    tree = EXAMPVILLE('datatree')
+    DA, SR, Walk, Bike, Transit = 1, 2, 3, 4, 5
+    m = NumbaModel(
+        alts={DA: 'DA', SR: 'SR', Walk: 'Walk', Bike: 'Bike', Transit: 'Transit'},
+        datatree=tree.query_cases('TOURPURP==1'),
+        **kwargs,
+    )
+    m.title = "Exampville Work Tour Mode Choice"
+    m.utility_co[DA] = (
+            + P.InVehTime * X("od.AUTO_TIME + do.AUTO_TIME")
+            + P.Cost * X("od.AUTO_COST + do.AUTO_COST")
+    )
+    m.utility_co[SR] = (
+            + P.ASC_SR
+            + P.InVehTime * X("od.AUTO_TIME + do.AUTO_TIME")
+            + P.Cost * X("od.AUTO_COST + do.AUTO_COST") * 0.5
+            + P("LogIncome:SR") * X("log(INCOME)")
+    )
+    m.utility_co[Walk] = (
+            + P.ASC_Walk
+            + P.NonMotorTime * X("od.WALK_TIME + do.WALK_TIME")
+            + P("LogIncome:Walk") * X("log(INCOME)")
+    )
+    m.utility_co[Bike] = (
+            + P.ASC_Bike
+            + P.NonMotorTime * X("od.BIKE_TIME + do.BIKE_TIME")
+            + P("LogIncome:Bike") * X("log(INCOME)")
+    )
+    m.utility_co[Transit] = (
+            + P.ASC_Transit
+            + P.InVehTime * X("od.TRANSIT_IVTT + do.TRANSIT_IVTT")
+            + P.OutVehTime * X("od.TRANSIT_OVTT + do.TRANSIT_OVTT")
+            + P.Cost * X("od.TRANSIT_FARE + do.TRANSIT_FARE")
+            + P("LogIncome:Transit") * X('log(INCOME)')
+    )
+    Car = m.graph.new_node(parameter='Mu:Car', children=[DA, SR], name='Car')
+    NonMotor = m.graph.new_node(parameter='Mu:NonMotor', children=[Walk, Bike], name='NonMotor')
+    Motor = m.graph.new_node(parameter='Mu:Motor', children=[Car, Transit], name='Motor')
+    m.choice_co_code = 'TOURMODE'
+    m.availability_co_vars = {
+        DA: 'AGE >= 16',
+        SR: '1',
+        Walk: 'WALK_TIME < 60',
+        Bike: 'BIKE_TIME < 60',
+        Transit: 'TRANSIT_FARE>0',
+    }
+    return m
+
+
+BENCHMARK_MODELS = {
+    'mtc': mtc_model,
+    'exampville': exampville_model,
+}
+
+
+def _time_per_call(func, repeat):
+    func()  # compile and warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def precision_benchmark(models=None, modes=None, repeat=10, cap=25):
+    """
+    Compare the throughput and estimates of the floating point precision modes.
+
+    Each model is built once per mode, its `loglike2_bhhh` evaluation
+    is timed at the null parameters, and then it is estimated with
+    SLSQP.  Estimates are compared against those from the first mode.
+
+    Parameters
+    ----------
+    models : Collection[str], optional
+        Keys of `BENCHMARK_MODELS` to run, defaults to all of them.
+    modes : Collection[str], optional
+        Keys of `PRECISION_MODES` to run, defaults to all of them.
+    repeat : int, default 10
+        Number of timed evaluations.
+    cap : float, default 25
+        Cap applied to parameter bounds before estimation.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by model and mode, with the time per evaluation, the
+        throughput in cases per second, the speedup relative to the
+        first mode, the final loglike, and the largest absolute
+        difference in the estimated parameters and loglike relative to
+        the first mode.
+    """
+    if models is None:
+        models = list(BENCHMARK_MODELS)
+    if modes is None:
+        modes = list(PRECISION_MODES)
+    rows = {}
+    for model_name in models:
+        reference = None
+        for mode in modes:
+            m = BENCHMARK_MODELS[model_name](**PRECISION_MODES[mode])
+            m.set_cap(cap)
+            seconds = _time_per_call(lambda: m.loglike2_bhhh('null'), repeat)
+            result = m.maximize_loglike(method='slsqp', quiet=True)
+            estimates = m.pf.value.copy()
+            if reference is None:
+                reference = (seconds, estimates, result.loglike)
+            rows[model_name, mode] = {
+                'seconds_per_eval': seconds,
+                'cases_per_second': m.n_cases / seconds,
+                'speedup': reference[0] / seconds,
+                'loglike': result.loglike,
+                'max_param_diff': np.abs(estimates - reference[1]).max(),
+                'loglike_diff': np.abs(result.loglike - reference[2]),
+            }
+    result = pd.DataFrame.from_dict(rows, orient='index')
+    result.index.names = ['model', 'mode']
+    return result
+
+
+def optimizer_benchmark(models=None, methods=('bhhh', 'trust-bhhh', 'slsqp'), cap=25):
+    """
+    Compare the number of passes over the data made by estimation methods.
+
+    Every model is estimated from the null parameters with each method,
+    counting the calls to the model's kernel runner, each of which is a
+    full pass over the data.
+
+    Parameters
+    ----------
+    models : Collection[str], optional
+        Keys of `BENCHMARK_MODELS` to run, defaults to all of them.
+    methods : Collection[str]
+        Methods for `maximize_loglike`.
+    cap : float, default 25
+        Cap applied to parameter bounds before estimation.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by model and method, with the number of data passes,
+        the elapsed time, and the final loglike.
+    """
+    if models is None:
+        models = list(BENCHMARK_MODELS)
+    rows = {}
+    for model_name in models:
+        for method in methods:
+            m = BENCHMARK_MODELS[model_name]()
+            m.set_cap(cap)
+            m.loglike('null')  # load data and compile
+            runner = m._loglike_runner
+            n_passes = 0
+
+            def counting_runner(*args, **kwargs):
+                nonlocal n_passes
+                n_passes += 1
+                return runner(*args, **kwargs)
+
+            m._loglike_runner = counting_runner
+            start = time.perf_counter()
+            result = m.maximize_loglike(method=method, quiet=True)
+            rows[model_name, method] = {
+                'data_passes': n_passes,
+                'seconds': time.perf_counter() - start,
+                'loglike': result.loglike,
+            }
+    result = pd.DataFrame.from_dict(rows, orient='index')
+    result.index.names = ['model', 'method']
+    return result
+
+
+def skim_lookup_benchmark(n=100_000, repeat=3, seed=0):
+    """
+    Compare batched and point-by-point skim lookups from an OMX file.
+
+    Random origin-destination pairs are looked up in every matrix of
+    the Exampville skims, both with the batched `rc_lookup` used by
+    `OMX.get_rc_dataframe`, and with direct point indexing of each
+    on-disk matrix as was done previously.
+
+    Parameters
+    ----------
+    n : int, default 100_000
+        Number of (row, col) pairs to look up.
+    repeat : int, default 3
+        Number of timed lookups for each method.
+    seed : int, default 0
+        Seed for drawing the pairs.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by method, with the time per lookup of all matrices,
+        the throughput in pairs per second, the speedup relative to
+        point indexing, and the largest absolute difference from the
+        point indexing values.
+    """
+    from ..omx import OMX, rc_lookup
+    from ..data_warehouse import example_file
+    skims = OMX(example_file("exampville_skims.omx"), mode='r')
+    try:
+        rng = np.random.default_rng(seed)
+        n_rows, n_cols = skims.shape
+        rows = rng.integers(0, n_rows, n)
+        cols = rng.integers(0, n_cols, n)
+        names = list(skims.data._v_children)
+        methods = {
+            'point': lambda: {k: skims[k][rows, cols] for k in names},
+            'batched': lambda: {k: rc_lookup(skims[k], rows, cols) for k in names},
+        }
+        reference = methods['point']()
+        results = {}
+        for method, func in methods.items():
+            seconds = _time_per_call(func, repeat)
+            values = func()
+            results[method] = {
+                'seconds': seconds,
+                'pairs_per_second': n / seconds,
+                'max_diff': max(
+                    float(np.abs(np.asarray(values[k], dtype=float) - np.asarray(reference[k], dtype=float)).max())
+                    for k in names
+                ),
+            }
+        result = pd.DataFrame.from_dict(results, orient='index')
+        result['speedup'] = result.loc['point', 'seconds'] / result['seconds']
+        result.index.name = 'method'
+        return result
+    finally:
+        skims.close()
+
+
+if __name__ == '__main__':
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(precision_benchmark())
+        print(optimizer_benchmark())
+        print(skim_lookup_benchmark())
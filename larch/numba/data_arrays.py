@@ -47,6 +47,25 @@ class DataArrays(NamedTuple):
     #         raise ValueError("alt_codes not defined")
 
 
+class SparseDataArrays(NamedTuple):
+    """
+    Model data for |idce| data, with choice and availability kept sparse.
+
+    The `ch`, `av`, `ce_data` and `ce_altidx` arrays all have one row
+    per case-alternative, and `ce_caseptr` has one more entry than there
+    are cases, so that the rows of case `c` are
+    ``ce_caseptr[c]:ce_caseptr[c+1]``.
+    """
+    ch: np.ndarray
+    av: np.ndarray
+    wt: np.ndarray
+    co: np.ndarray
+    ce_data: np.ndarray
+    ce_altidx: np.ndarray
+    ce_caseptr: np.ndarray
+    n_alts: int
+
+
 def to_dataset(dataframes):
     caseindex_name = _CASEID
     altindex_name = _ALTID
@@ -76,6 +95,10 @@ def prepare_data(
         float_dtype=None,
         cache_dir=None,
         flows=None,
+        data_cache=None,
+        data_cache_size=None,
+        sparse_ce=False,
+        previous=None,
 ):
     """
     Load data from a DataTree into a computationally-formatted Dataset.
@@ -89,6 +112,22 @@ def prepare_data(
         Directory to cache sharrow flows.
     flows : dict, optional
         Collection of previously prepared flows.
+    data_cache : Path-like, optional
+        Directory to cache the prepared arrays.  Entries are keyed by
+        the request and a fingerprint of the content of the source data,
+        and when a matching entry exists the data is memory-mapped from
+        it instead of being prepared again.
+    data_cache_size : int, optional
+        Size limit in bytes for `data_cache`, beyond which the least
+        recently used entries are evicted.  Defaults to 4 GiB.
+    sparse_ce : bool, default False
+        For |idce| data, keep the choice and availability data as
+        `ch_ce` and `av_ce` variables with one value per case-alternative
+        row, instead of expanding them to dense `ch` and `av` arrays.
+    previous : Dataset, optional
+        A model dataset previously prepared from this same `datasource`.
+        Any `co` and `ca` data columns already present in it are reused,
+        so that only newly requested expressions are evaluated.
 
     Returns
     -------
@@ -113,8 +152,10 @@ def prepare_data(
     model_dataset.dc.ALTID = datasource.dc.ALTID
 
     from .model import NumbaModel # avoid circular import
+    alt_features = ()
     if isinstance(request, NumbaModel):
         alts = request.graph.elemental_names()
+        alt_features = (alts,)
         alt_dim = model_dataset.dc.ALTID or _ALTID
         if model_dataset.dc.ALTID not in model_dataset.coords:
             model_dataset.coords[alt_dim] = DataArray(list(alts.keys()), dims=(alt_dim,))
@@ -127,9 +168,9 @@ def prepare_data(
 
     if isinstance(datasource, (DataTree,)):
         log.debug(f"adopting existing DataTree")
-        if not datasource.relationships_are_digitized:
-            datasource.digitize_relationships(inplace=True)
-        datatree = datasource
+        datatree = _subset_lazy_subspaces(datasource, request)
+        if not datatree.relationships_are_digitized:
+            datatree.digitize_relationships(inplace=True)
         datatree_co = datatree.idco_subtree()
     elif isinstance(datasource, Dataset):
         datatree = datasource.dc.as_tree()
@@ -142,39 +183,62 @@ def prepare_data(
         datatree.digitize_relationships(inplace=True)
         datatree_co = datatree.idco_subtree()
 
+    data_cache_key = None
+    if data_cache is not None:
+        from .data_cache import data_fingerprint, load_prepared
+        data_cache_key = flownamer(
+            'prepared',
+            request,
+            (data_fingerprint(datatree), np.dtype(float_dtype).name, sparse_ce, *alt_features),
+        )
+        cached_dataset = load_prepared(data_cache, data_cache_key)
+        if cached_dataset is not None:
+            return cached_dataset, flows
+
     if 'co' in request:
         log.debug(f"requested co data: {request['co']}")
-        model_dataset, flows['co'] = _prep_co(
-            model_dataset,
-            datatree_co,
-            request['co'],
-            tag='co',
-            dtype=float_dtype,
-            cache_dir=cache_dir,
-            flow=flows.get('co'),
-        )
-    if 'ca' in request:
-        log.debug(f"requested ca data: {request['ca']}")
-        casealt_dim = datatree.root_dataset.attrs.get(_CASEALT)
-        if casealt_dim is None:
-            model_dataset, flows['ca'] = _prep_ca(
+        prior_co, vars_co = _split_previous(previous, 'co', 'var_co', request['co'], float_dtype)
+        if vars_co:
+            model_dataset, flows['co'] = _prep_co(
                 model_dataset,
-                datatree,
-                request['ca'],
-                tag='ca',
+                datatree_co,
+                vars_co,
+                tag='co',
                 dtype=float_dtype,
                 cache_dir=cache_dir,
-                flow=flows.get('ca'),
+                flow=flows.get('co'),
             )
+        model_dataset = _extend_previous(model_dataset, prior_co, 'co', 'var_co')
+    if 'ca' in request:
+        log.debug(f"requested ca data: {request['ca']}")
+        casealt_dim = datatree.root_dataset.attrs.get(_CASEALT)
+        if casealt_dim is None:
+            prior_ca, vars_ca = _split_previous(previous, 'ca', 'var_ca', request['ca'], float_dtype)
+            if vars_ca:
+                model_dataset, flows['ca'] = _prep_ca(
+                    model_dataset,
+                    datatree,
+                    vars_ca,
+                    tag='ca',
+                    dtype=float_dtype,
+                    cache_dir=cache_dir,
+                    flow=flows.get('ca'),
+                )
+            model_dataset = _extend_previous(model_dataset, prior_ca, 'ca', 'var_ca')
         else:
-            model_dataset, flows['ce'] = _prep_ce(
-                model_dataset,
-                datatree,
-                request['ca'],
-                dtype=float_dtype,
-                cache_dir=cache_dir,
-                flow=flows.get('ce'),
-            )
+            prior_ce, vars_ce = _split_previous(previous, 'ce_data', 'var_ca', request['ca'], float_dtype)
+            if vars_ce:
+                model_dataset, flows['ce'] = _prep_ce(
+                    model_dataset,
+                    datatree,
+                    vars_ce,
+                    dtype=float_dtype,
+                    cache_dir=cache_dir,
+                    flow=flows.get('ce'),
+                )
+            else:
+                model_dataset = _attach_ce_indexes(model_dataset, datatree)
+            model_dataset = _extend_previous(model_dataset, prior_ce, 'ce_data', 'var_ca')
     if 'choice_ca' in request:
         log.debug(f"requested choice_ca data: {request['choice_ca']}")
         casealt_dim = datatree.root_dataset.attrs.get(_CASEALT)
@@ -204,27 +268,33 @@ def prepare_data(
                 flow=flows.get('choice_ce'),
                 attach_indexes=False,
             )
-            da_ch = DataArray(
-                ce_to_dense(
-                    model_dataset['choice_ce_data'].values,
-                    model_dataset[model_dataset.dc.ALTIDX].values,
-                    model_dataset[model_dataset.dc.CASEPTR].values,
-                    datatree.n_alts
-                ),
-                dims=[datatree.CASEID, datatree.ALTID],
-                coords={
-                    datatree.CASEID: model_dataset.coords[datatree.CASEID],
-                    datatree.ALTID: model_dataset.coords[datatree.ALTID],
-                },
-                name='ch',
-            )
-            model_dataset = model_dataset.drop_vars(['choice_ce_data'])
-            model_dataset['ch'] = da_ch
+            if sparse_ce:
+                model_dataset = model_dataset.rename_vars({'choice_ce_data': 'ch_ce'})
+            else:
+                da_ch = DataArray(
+                    ce_to_dense(
+                        model_dataset['choice_ce_data'].values,
+                        model_dataset[model_dataset.dc.ALTIDX].values,
+                        model_dataset[model_dataset.dc.CASEPTR].values,
+                        datatree.n_alts
+                    ),
+                    dims=[datatree.CASEID, datatree.ALTID],
+                    coords={
+                        datatree.CASEID: model_dataset.coords[datatree.CASEID],
+                        datatree.ALTID: model_dataset.coords[datatree.ALTID],
+                    },
+                    name='ch',
+                )
+                model_dataset = model_dataset.drop_vars(['choice_ce_data'])
+                model_dataset['ch'] = da_ch
     if 'choice_co_code' in request:
         log.debug(f"requested choice_co_code data: {request['choice_co_code']}")
-        choicecodes = datatree_co[request['choice_co_code']]
+        choicecodes = np.asarray(datatree_co[request['choice_co_code']].values).reshape(-1)
+        altcodes = model_dataset.coords[datatree.ALTID].values
+        # codes that are not alternatives map to -1, and are never chosen
+        choiceidx = pd.Index(altcodes).get_indexer(choicecodes)
         da_ch = DataArray(
-            float_dtype(0),
+            codes_to_dense(choiceidx, altcodes.size, np.dtype(float_dtype).type),
             dims=[datatree.CASEID, datatree.ALTID],
             coords={
                 datatree.CASEID: model_dataset.coords[datatree.CASEID],
@@ -232,24 +302,24 @@ def prepare_data(
             },
             name='ch',
         )
-        for i,a in enumerate(model_dataset.coords[datatree.ALTID]):
-            da_ch[:, i] = (choicecodes == a)
         model_dataset = model_dataset.merge(da_ch)
     if 'choice_co' in request:
         log.debug(f"requested choice_co_vars data: {request['choice_co']}")
-        da_ch = DataArray(
-            float_dtype(0),
-            dims=[datatree.CASEID, datatree.ALTID],
-            coords={
-                datatree.CASEID: model_dataset.coords[datatree.CASEID],
-                datatree.ALTID: model_dataset.coords[datatree.ALTID],
-            },
-            name='ch',
+        ch_co_expressions = {
+            a: request['choice_co'].get(a, '0')
+            for a in model_dataset.coords[datatree.ALTID].values
+        }
+        model_dataset, flows['choice_co'] = _prep_co(
+            model_dataset,
+            datatree_co,
+            ch_co_expressions,
+            tag='ch',
+            preserve_vars=False,
+            dtype=float_dtype,
+            dim_name=datatree.ALTID,
+            cache_dir=cache_dir,
+            flow=flows.get('choice_co'),
         )
-        for i,a in enumerate(model_dataset.dc.alts_mapping):
-            choice_expr = request['choice_co'][a]
-            da_ch[:, i] = datatree_co.dc.get_expr(choice_expr).values
-        model_dataset = model_dataset.merge(da_ch)
     if 'choice_any' in request:
         log.debug(f"requested choice_any data: {request['choice_any']}")
         raise NotImplementedError('choice_any')
@@ -294,6 +364,22 @@ def prepare_data(
                 cache_dir=cache_dir,
                 flow=flows.get('avail_ca'),
             )
+        elif sparse_ce:
+            # availability rows are left out entirely when all are available
+            if request['avail_ca'] not in {'1', 'True', '1.0'}:
+                model_dataset, flows['avail_ce'] = _prep_ce(
+                    model_dataset,
+                    datatree,
+                    request['avail_ca'],
+                    v_tag='avail_ca',
+                    s_tag='avail_ce',
+                    preserve_vars=False,
+                    dtype=np.int8,
+                    cache_dir=cache_dir,
+                    flow=flows.get('avail_ce'),
+                    attach_indexes=False,
+                )
+                model_dataset = model_dataset.rename_vars({'avail_ce_data': 'av_ce'})
         else:
             if request['avail_ca'] in {'1', 'True', '1.0'} and model_dataset.dc.CASEPTR is not None and model_dataset.dc.ALTIDX is not None:
                 da_av = DataArray(
@@ -359,8 +445,67 @@ def prepare_data(
         log.debug(f"requested avail_any data: {request['avail_any']}")
         raise NotImplementedError('avail_any')
 
+    if data_cache_key is not None:
+        from .data_cache import store_prepared, DEFAULT_CACHE_SIZE
+        store_prepared(
+            data_cache,
+            data_cache_key,
+            model_dataset,
+            max_size=data_cache_size or DEFAULT_CACHE_SIZE,
+        )
+
     return model_dataset, flows
 
+def _subset_lazy_subspaces(datatree, request):
+    """
+    Trim lazily loaded subspaces of a DataTree to the data a request uses.
+
+    Only the variables, and skim rows and columns, actually used by the
+    request are then loaded from subspaces other than the root.  A tree
+    with all its data already in memory is returned unchanged, so it is
+    digitized in place once.  The trimmed tree is cached on the source
+    tree, and is rebuilt when the request changes, or when any dataset
+    or variable of the source tree is replaced.
+
+    Parameters
+    ----------
+    datatree : DataTree
+    request : Mapping
+
+    Returns
+    -------
+    DataTree
+    """
+    lazy = any(
+        v.chunks is not None
+        for name, dataset in datatree.subspaces.items()
+        if name != datatree.root_node_name
+        for v in dataset.data_vars.values()
+    )
+    if not lazy:
+        return datatree
+    # the source objects are held in the cache, so their ids stay unique
+    sources = tuple(
+        (name, dataset, tuple(dataset.variables.values()))
+        for name, dataset in sorted(datatree.subspaces.items())
+    )
+    key = flownamer(
+        'subset_subspaces',
+        request,
+        (
+            *datatree._hash_features(),
+            *(id(dataset) for _, dataset, _ in sources),
+            *(id(v) for _, _, variables in sources for v in variables),
+        ),
+    )
+    cached = getattr(datatree, '_subset_subspaces_cache', None)
+    if cached is not None and cached[0] == key:
+        return cached[2]
+    trimmed = datatree.subset_subspaces(request)
+    datatree._subset_subspaces_cache = (key, sources, trimmed)
+    return trimmed
+
+
 def flownamer(tag, definition_spec, extra_hash_features=()):
     import hashlib, base64
     defs_hash = hashlib.md5()
@@ -373,6 +518,50 @@ def flownamer(tag, definition_spec, extra_hash_features=()):
     return "pipeline_"+(base64.b32encode(defs_hash.digest())).decode().replace("=","")
 
 
+def _split_previous(previous, name, dim, requested, dtype):
+    """
+    Find which requested data columns are already loaded in `previous`.
+
+    Returns
+    -------
+    prior : DataArray or None
+        The previously loaded columns that are requested again.
+    missing : list
+        The requested expressions that still need to be evaluated.
+    """
+    if isinstance(requested, str):
+        requested = [requested]
+    if previous is None or name not in previous or dim not in previous.indexes:
+        return None, requested
+    if isinstance(requested, dict):
+        # columns are named by key, so a previous column of the same
+        # name may hold a different expression
+        return None, requested
+    if previous[name].dtype != np.dtype(dtype):
+        return None, requested
+    loaded = previous.indexes[dim]
+    reused = [i for i in requested if i in loaded]
+    missing = [i for i in requested if i not in loaded]
+    if not reused:
+        return None, missing
+    logging.getLogger("Larch").debug(f"reusing {len(reused)} previously loaded {name} columns")
+    return previous[name].sel({dim: reused}), missing
+
+
+def _extend_previous(model_dataset, prior, name, dim):
+    """
+    Join previously loaded data columns with newly loaded ones.
+    """
+    if prior is None:
+        return model_dataset
+    if name in model_dataset:
+        combined = xr.concat([prior, model_dataset[name]], dim=dim)
+        model_dataset = model_dataset.drop_vars([name, dim])
+    else:
+        combined = prior
+    return model_dataset.merge(combined.rename(name))
+
+
 def _prep_ca(
         model_dataset,
         shared_data_ca,
@@ -497,29 +686,37 @@ def _prep_ce(
     model_dataset = model_dataset.merge(da)
 
     if attach_indexes:
-        altidx = datatree.root_dataset.coords[datatree.ALTIDX]
-        altidx = altidx.drop_vars(list(altidx.coords))
-        model_dataset[datatree.ALTIDX] = altidx
-        model_dataset.dc.ALTIDX = datatree.ALTIDX
-        caseptr = datatree.root_dataset[datatree.CASEPTR]
-        caseptr = caseptr.drop_vars(list(caseptr.coords))
-        model_dataset[datatree.CASEPTR] = caseptr
-        model_dataset.dc.CASEPTR = datatree.CASEPTR
-        model_dataset = model_dataset.assign_coords({
-            datatree.CASEID: DataArray(
-                datatree.caseids(),
-                dims=(datatree.CASEID),
-            ),
-            datatree.ALTID: DataArray(
-                datatree.altids(),
-                dims=(datatree.ALTID),
-            ),
-        })
+        model_dataset = _attach_ce_indexes(model_dataset, datatree)
     model_dataset.dc.CASEID = datatree.CASEID
     model_dataset.dc.ALTID = datatree.ALTID
     return model_dataset, flow
 
 
+def _attach_ce_indexes(model_dataset, datatree):
+    from ..dataset import DataArray
+    altidx = datatree.root_dataset.coords[datatree.ALTIDX]
+    altidx = altidx.drop_vars(list(altidx.coords))
+    model_dataset[datatree.ALTIDX] = altidx
+    model_dataset.dc.ALTIDX = datatree.ALTIDX
+    caseptr = datatree.root_dataset[datatree.CASEPTR]
+    caseptr = caseptr.drop_vars(list(caseptr.coords))
+    model_dataset[datatree.CASEPTR] = caseptr
+    model_dataset.dc.CASEPTR = datatree.CASEPTR
+    model_dataset = model_dataset.assign_coords({
+        datatree.CASEID: DataArray(
+            datatree.caseids(),
+            dims=(datatree.CASEID),
+        ),
+        datatree.ALTID: DataArray(
+            datatree.altids(),
+            dims=(datatree.ALTID),
+        ),
+    })
+    model_dataset.dc.CASEID = datatree.CASEID
+    model_dataset.dc.ALTID = datatree.ALTID
+    return model_dataset
+
+
 def _prep_co(
         model_dataset,
         shared_data_co,
@@ -605,3 +802,28 @@ def ce_bool_to_dense(ce_altidx, ce_caseptr, n_alts):
         a = ce_altidx[row]
         out[c,a,...] = 1
     return out
+
+
+@nb.njit
+def codes_to_dense(code_idx, n_alts, dtype):
+    """
+    Build a dense one-hot array from the alternative index of each case.
+
+    Parameters
+    ----------
+    code_idx : array of int, shape [n_cases]
+        Position of the chosen alternative for each case, or -1 if the
+        case has no valid choice.
+    n_alts : int
+    dtype : numpy scalar type
+
+    Returns
+    -------
+    array, shape [n_cases, n_alts]
+    """
+    out = np.zeros((code_idx.shape[0], n_alts), dtype=dtype)
+    for c in range(code_idx.shape[0]):
+        a = code_idx[c]
+        if a >= 0:
+            out[c, a] = 1
+    return out
@@ -0,0 +1,237 @@
+"""
+On-disk cache of prepared model data.
+
+Preparing data evaluates every variable the model requests against the
+source DataTree, which can take a long time for large surveys.  The
+results are stored here as raw ``.npy`` files, one per variable, in a
+directory named by a hash of the request and a fingerprint of the
+content of the source data, so that a later `prepare_data` call for the
+same specification on unchanged data can memory-map them instead.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+log = logging.getLogger("Larch")
+
+DEFAULT_CACHE_SIZE = 4 * 2**30
+
+_MANIFEST = "manifest.json"
+
+
+def _update_hash(h, arr):
+    arr = np.asarray(arr)
+    h.update(str(arr.dtype).encode("utf8"))
+    h.update(str(arr.shape).encode("utf8"))
+    if arr.dtype.kind == 'O':
+        arr = arr.astype(str)
+    h.update(memoryview(np.ascontiguousarray(arr)).cast('B'))
+
+
+def data_fingerprint(datatree):
+    """
+    Compute a hash of the content of every dataset in a DataTree.
+
+    Parameters
+    ----------
+    datatree : DataTree
+
+    Returns
+    -------
+    str
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for k in datatree._hash_features():
+        h.update(str(k).encode("utf8"))
+    for space_name in sorted(datatree.subspaces):
+        dataset = datatree.subspaces[space_name]
+        h.update(str(space_name).encode("utf8"))
+        for name in sorted(dataset.variables, key=str):
+            h.update(str(name).encode("utf8"))
+            h.update(str(dataset[name].dims).encode("utf8"))
+            _update_hash(h, dataset[name].values)
+    return h.hexdigest()
+
+
+def _variable_manifest(dataset):
+    """
+    Describe the variables and attributes of a Dataset for serialization.
+
+    This is the common format of the prepared data cache and of shared
+    memory datasets, which each add their own location information to
+    the description of every variable.
+
+    Parameters
+    ----------
+    dataset : Dataset
+
+    Returns
+    -------
+    arrays : dict[str, ndarray]
+        The values of every variable, as contiguous arrays.  Object
+        arrays are converted to strings.
+    variables : dict[str, dict]
+        The dims of every variable, whether it is a coordinate, and
+        whether it was converted from an object array.
+    attrs : dict
+        The attributes of the dataset that can be stored as JSON.
+    """
+    arrays = {}
+    variables = {}
+    for name in dataset.variables:
+        arr = np.asarray(dataset[name].values)
+        is_object = arr.dtype.kind == 'O'
+        if is_object:
+            arr = arr.astype(str)
+        arrays[str(name)] = np.ascontiguousarray(arr)
+        variables[str(name)] = dict(
+            dims=[str(d) for d in dataset[name].dims],
+            coord=name in dataset.coords,
+            object=is_object,
+        )
+    attrs = {}
+    for k, v in dataset.attrs.items():
+        try:
+            json.dumps(v)
+        except TypeError:
+            continue
+        attrs[k] = v
+    return arrays, variables, attrs
+
+
+def _dataset_from_manifest(manifest, load):
+    """
+    Rebuild a Dataset described by `_variable_manifest`.
+
+    Parameters
+    ----------
+    manifest : dict
+        With the `variables` and `attrs` of the dataset.
+    load : Callable[[str, dict], ndarray]
+        Get the stored array for a variable, given its name and its
+        description in the manifest.
+
+    Returns
+    -------
+    Dataset
+    """
+    from ..dataset import Dataset
+    coords = {}
+    data_vars = {}
+    for name, info in manifest['variables'].items():
+        arr = load(name, info)
+        if info['object']:
+            arr = arr.astype(object)
+        target = coords if info['coord'] else data_vars
+        target[name] = (tuple(info['dims']), arr)
+    return Dataset(data_vars=data_vars, coords=coords, attrs=manifest['attrs'])
+
+
+def _entry_size(path):
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+def load_prepared(cache_dir, key):
+    """
+    Load a prepared dataset from the cache.
+
+    Parameters
+    ----------
+    cache_dir : Path-like
+    key : str
+
+    Returns
+    -------
+    Dataset or None
+        The arrays are memory-mapped copy-on-write, so they can be
+        modified in memory without changing the cache.  None is returned
+        if there is no usable cache entry.
+    """
+    entry = Path(cache_dir) / key
+    try:
+        with open(entry / _MANIFEST, 'r') as f:
+            manifest = json.load(f)
+        dataset = _dataset_from_manifest(
+            manifest,
+            lambda name, info: np.load(entry / info['file'], mmap_mode=None if info['object'] else 'c'),
+        )
+    except (OSError, ValueError, KeyError) as err:
+        log.debug(f"unable to load prepared data from {entry}: {err!r}")
+        return None
+    os.utime(entry / _MANIFEST)
+    log.debug(f"loaded prepared data from {entry}")
+    return dataset
+
+
+def store_prepared(cache_dir, key, dataset, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Write a prepared dataset to the cache.
+
+    Parameters
+    ----------
+    cache_dir : Path-like
+    key : str
+    dataset : Dataset
+    max_size : int, default 4 GiB
+        The total size of the cache in bytes.  After writing, the least
+        recently used entries are evicted until the cache fits.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir / key
+    if entry.exists():
+        return
+    staging = cache_dir / f".{key}.{uuid.uuid4().hex}"
+    staging.mkdir()
+    try:
+        arrays, variables, attrs = _variable_manifest(dataset)
+        for n, (name, arr) in enumerate(arrays.items()):
+            filename = f"{n}.npy"
+            np.save(staging / filename, arr, allow_pickle=False)
+            variables[name]['file'] = filename
+        with open(staging / _MANIFEST, 'w') as f:
+            json.dump(dict(variables=variables, attrs=attrs, created=time.time()), f)
+        os.replace(staging, entry)
+    except OSError as err:
+        log.warning(f"unable to cache prepared data in {entry}: {err!r}")
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+    evict(cache_dir, max_size, keep=(key,))
+
+
+def evict(cache_dir, max_size=DEFAULT_CACHE_SIZE, keep=()):
+    """
+    Remove the least recently used cache entries until the cache fits.
+
+    Parameters
+    ----------
+    cache_dir : Path-like
+    max_size : int, default 4 GiB
+        The total size of the cache in bytes.
+    keep : Collection[str]
+        Keys that are never evicted.
+    """
+    cache_dir = Path(cache_dir)
+    entries = []
+    for path in cache_dir.iterdir():
+        manifest = path / _MANIFEST
+        if path.name.startswith('.') or not manifest.exists():
+            continue
+        entries.append((manifest.stat().st_mtime, path.name, _entry_size(path)))
+    total = sum(e[2] for e in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_size:
+            break
+        if name in keep:
+            continue
+        log.debug(f"evicting prepared data {name} from {cache_dir}")
+        shutil.rmtree(cache_dir / name, ignore_errors=True)
+        total -= size
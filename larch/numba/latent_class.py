@@ -0,0 +1,419 @@
+"""
+A fused numba kernel for latent class models.
+
+The class membership model and every class choice model are evaluated
+together, one case at a time, and the class-specific probabilities are
+mixed and reduced to the loglike, gradient and BHHH matrix inside the
+kernel.  Nothing of size n_cases * n_alts * n_classes is ever formed.
+"""
+
+import numpy as np
+from collections import namedtuple
+from numba import njit, prange, get_num_threads
+
+from .model import (
+    NumbaModel,
+    KernelArrays,
+    _numba_master_case,
+    _scatter_elemental_gradient,
+)
+
+
+LatentClassArrays = namedtuple(
+    'LatentClassArrays',
+    ['probability', 'loglike', 'd_loglike', 'bhhh'],
+)
+
+
+def case_index(
+        n_cases,
+        start_case=0,
+        stop_case=-1,
+        step_case=1,
+        leave_out=-1,
+        keep_only=-1,
+        subsample=-1,
+):
+    """
+    Positions of the cases selected by the usual slicing arguments.
+
+    Parameters
+    ----------
+    n_cases : int
+        The total number of cases in the data.
+    start_case, stop_case, step_case : int
+        The cases to include.  A `stop_case` of -1 (the default)
+        includes cases through the end of the data.
+    leave_out, keep_only, subsample : int, optional
+        Settings for cross validation calculations.
+        If `leave_out` and `subsample` are set, then case rows where
+        rownumber % subsample == leave_out are dropped. If `keep_only`
+        and `subsample` are set, then only case rows where
+        rownumber % subsample == keep_only are used.
+
+    Returns
+    -------
+    ndarray of int64
+    """
+    if start_case is None:
+        start_case = 0
+    if stop_case is None or stop_case == -1:
+        stop_case = n_cases
+    if step_case is None:
+        step_case = 1
+    if step_case <= 0:
+        raise IndexError("non-positive step_case")
+    index = np.arange(start_case, min(stop_case, n_cases), step_case, dtype=np.int64)
+    if subsample is not None and subsample > 1:
+        if leave_out is not None and leave_out >= 0:
+            index = index[index % subsample != leave_out]
+        if keep_only is not None and keep_only >= 0:
+            index = index[index % subsample == keep_only]
+    return index
+
+
+# dtypes of the integer kernel arrays, all the others are float64
+_KERNEL_DTYPES = {
+    'qca_param_slot': np.int32,
+    'qca_data_slot': np.int32,
+    'qscale_param_slot': np.int32,
+    'uca_param_slot': np.int32,
+    'uca_data_slot': np.int32,
+    'uco_alt_slot': np.int32,
+    'uco_param_slot': np.int32,
+    'uco_data_slot': np.int32,
+    'edge_slots': np.int32,
+    'mu_slot': np.int32,
+    'start_edges': np.int32,
+    'len_edges': np.int32,
+    'av': np.int8,
+    'ce_altidx': np.int32,
+    'ce_caseptr': np.int64,
+}
+
+
+def _uniform_arrays(model):
+    """
+    The kernel arrays of a NumbaModel, cast to a common set of types.
+
+    The arrays of all the class models are passed to the kernel in a
+    tuple, which numba can index at run time only when every class has
+    exactly the same array types.
+    """
+    arrays = model._kernel_arrays(allow_missing_ch=True)
+    result = {}
+    for name, a in arrays._asdict().items():
+        result[name] = np.ascontiguousarray(a, dtype=_KERNEL_DTYPES.get(name, np.float64))
+    return KernelArrays(**result)
+
+
+@njit(error_model='numpy', fastmath=True, cache=True, parallel=True, nogil=True)
+def _latent_class_reduce(
+        membership,      # tuple of the membership model arrays
+        classes,         # tuple of tuples of the class model arrays
+        holdfast_arr,    # int8 input shape=[n_params]
+        parameter_arr,   # float input shape=[n_params]
+        case_index,      # int input shape=[n_selected]
+        return_grad,     # bool input
+        return_bhhh,     # bool input
+        max_nodes,       # int input scalar
+        n_blocks,        # int input scalar
+        probability,     # float output shape=[n_selected or 0, n_alts]
+        casewise_loglike,    # float output shape=[n_selected or 0]
+        casewise_d_loglike,  # float output shape=[n_selected or 0, n_params]
+        bhhh,            # float output shape=[n_params, n_params]
+        d_loglike,       # float output shape=[n_params]
+        loglike,         # float output shape=[1]
+):
+    """
+    Evaluate a latent class model, reducing over cases in the kernel.
+
+    Each model's arrays are given as `KernelArrays`, the fixed arrays of
+    `_numba_master` followed by the casewise data arrays.  For each case,
+    the membership probabilities and the derivatives of their logs are
+    found once, and then each class model is evaluated for each chosen
+    alternative.  The mixed probability of alternative `a` is
+    p_a = sum_k pi_k * P_ka, and its derivative is
+    sum_k pi_k * P_ka * (dlog pi_k + dlog P_ka).
+    """
+    n_selected = case_index.shape[0]
+    n_classes = len(classes)
+    n_params = parameter_arr.shape[0]
+    n_alts = classes[0].ca.shape[1]
+    n_member_nodes = membership.ch.shape[1]
+    keep_probability = probability.shape[0] > 0
+    keep_casewise = casewise_loglike.shape[0] > 0
+    block_size = (n_selected + n_blocks - 1) // n_blocks
+
+    partial_bhhh = np.zeros((n_blocks, n_params, n_params))
+    partial_d_loglike = np.zeros((n_blocks, n_params))
+    partial_loglike = np.zeros(n_blocks)
+
+    for b in prange(n_blocks):
+        flags_probability = np.zeros(4, dtype=np.int8)
+        flags_probability[1] = 1
+        flags_gradient = np.zeros(4, dtype=np.int8)
+        flags_gradient[1] = 1
+        flags_gradient[2] = return_grad
+        ch_scratch = np.zeros(max_nodes)
+        wt_one = np.ones(1)
+        utility = np.zeros(max_nodes)
+        logprob = np.zeros(max_nodes)
+        node_probability = np.zeros(max_nodes)
+        dutility = np.zeros((0, n_params))
+        adjoint = np.zeros(max_nodes)
+        gradient = np.zeros(n_params)
+        case_bhhh = np.zeros((1, 1))
+        case_d_loglike = np.zeros(n_params)
+        case_loglike = np.zeros(1)
+        membership_probability = np.zeros(n_classes)
+        d_log_membership = np.zeros((n_classes, n_params))
+        d_mixed = np.zeros(n_params)
+        d_case = np.zeros(n_params)
+        case_stop = min((b + 1) * block_size, n_selected)
+
+        for i in range(b * block_size, case_stop):
+            c = case_index[i]
+
+            # class membership probabilities, and derivatives of their logs
+            ch_scratch[:] = 0.0
+            _numba_master_case(
+                membership.qca_scale, membership.qca_param_slot,
+                membership.qca_data_slot, membership.qscale_param_slot,
+                membership.uca_scale, membership.uca_param_slot, membership.uca_data_slot,
+                membership.uco_alt_slot, membership.uco_scale,
+                membership.uco_param_slot, membership.uco_data_slot,
+                membership.edge_slots,
+                membership.mu_slot, membership.start_edges, membership.len_edges,
+                holdfast_arr, parameter_arr,
+                ch_scratch[:n_member_nodes], membership.av[c], wt_one,
+                membership.co[c], membership.ca[c],
+                membership.ce_data, membership.ce_altidx, membership.ce_caseptr[c],
+                flags_probability, dutility, adjoint[:n_member_nodes], gradient,
+                utility[:n_member_nodes], logprob[:n_member_nodes],
+                node_probability[:n_member_nodes],
+                case_bhhh, case_d_loglike, case_loglike,
+            )
+            for k in range(n_classes):
+                membership_probability[k] = node_probability[k]
+            if return_grad:
+                for k in range(n_classes):
+                    adjoint[:] = 0.0
+                    for j in range(n_classes):
+                        adjoint[j] = -membership_probability[j]
+                    adjoint[k] += 1.0
+                    gradient[:] = 0.0
+                    _scatter_elemental_gradient(
+                        membership.qca_scale, membership.qca_param_slot,
+                        membership.qca_data_slot, membership.qscale_param_slot,
+                        membership.uca_scale, membership.uca_param_slot, membership.uca_data_slot,
+                        membership.uco_alt_slot, membership.uco_scale,
+                        membership.uco_param_slot, membership.uco_data_slot,
+                        holdfast_arr, parameter_arr,
+                        membership.av[c], membership.co[c], membership.ca[c],
+                        membership.ce_data, membership.ce_altidx, membership.ce_caseptr[c],
+                        adjoint[:n_member_nodes], gradient,
+                    )
+                    d_log_membership[k, :] = gradient
+
+            if keep_probability:
+                for k in range(n_classes):
+                    cls = classes[k]
+                    n_nodes = cls.ch.shape[1]
+                    ch_scratch[:] = 0.0
+                    _numba_master_case(
+                        cls.qca_scale, cls.qca_param_slot,
+                        cls.qca_data_slot, cls.qscale_param_slot,
+                        cls.uca_scale, cls.uca_param_slot, cls.uca_data_slot,
+                        cls.uco_alt_slot, cls.uco_scale,
+                        cls.uco_param_slot, cls.uco_data_slot,
+                        cls.edge_slots,
+                        cls.mu_slot, cls.start_edges, cls.len_edges,
+                        holdfast_arr, parameter_arr,
+                        ch_scratch[:n_nodes], cls.av[c], wt_one,
+                        cls.co[c], cls.ca[c],
+                        cls.ce_data, cls.ce_altidx, cls.ce_caseptr[c],
+                        flags_probability, dutility, adjoint[:n_nodes], gradient,
+                        utility[:n_nodes], logprob[:n_nodes], node_probability[:n_nodes],
+                        case_bhhh, case_d_loglike, case_loglike,
+                    )
+                    for a in range(n_alts):
+                        probability[i, a] += membership_probability[k] * node_probability[a]
+
+            # mixed probability and gradient of each chosen alternative
+            array_ch = classes[0].ch[c]
+            weight = classes[0].wt[c]
+            this_loglike = 0.0
+            d_case[:] = 0.0
+            for a in range(n_alts):
+                if array_ch[a] == 0:
+                    continue
+                mixed = 0.0
+                d_mixed[:] = 0.0
+                for k in range(n_classes):
+                    cls = classes[k]
+                    n_nodes = cls.ch.shape[1]
+                    ch_scratch[:] = 0.0
+                    ch_scratch[a] = 1.0
+                    _numba_master_case(
+                        cls.qca_scale, cls.qca_param_slot,
+                        cls.qca_data_slot, cls.qscale_param_slot,
+                        cls.uca_scale, cls.uca_param_slot, cls.uca_data_slot,
+                        cls.uco_alt_slot, cls.uco_scale,
+                        cls.uco_param_slot, cls.uco_data_slot,
+                        cls.edge_slots,
+                        cls.mu_slot, cls.start_edges, cls.len_edges,
+                        holdfast_arr, parameter_arr,
+                        ch_scratch[:n_nodes], cls.av[c], wt_one,
+                        cls.co[c], cls.ca[c],
+                        cls.ce_data, cls.ce_altidx, cls.ce_caseptr[c],
+                        flags_gradient, dutility, adjoint[:n_nodes], gradient,
+                        utility[:n_nodes], logprob[:n_nodes], node_probability[:n_nodes],
+                        case_bhhh, case_d_loglike, case_loglike,
+                    )
+                    term = membership_probability[k] * node_probability[a]
+                    mixed += term
+                    if return_grad:
+                        for p in range(n_params):
+                            d_mixed[p] += term * (d_log_membership[k, p] + case_d_loglike[p])
+                if not mixed > 0:
+                    this_loglike += -np.inf
+                    continue
+                ch_weight = array_ch[a] * weight
+                this_loglike += np.log(mixed) * ch_weight
+                if return_grad:
+                    for p in range(n_params):
+                        d_mixed[p] /= mixed
+                        d_case[p] += d_mixed[p] * ch_weight
+                    if return_bhhh:
+                        for p in range(n_params):
+                            _temp = d_mixed[p] * ch_weight
+                            if _temp:
+                                for q in range(n_params):
+                                    partial_bhhh[b, p, q] += _temp * d_mixed[q]
+
+            partial_loglike[b] += this_loglike
+            if return_grad:
+                partial_d_loglike[b, :] += d_case
+            if keep_casewise:
+                casewise_loglike[i] = this_loglike
+                if return_grad:
+                    casewise_d_loglike[i, :] = d_case
+
+    loglike[0] = 0.0
+    d_loglike[:] = 0.0
+    bhhh[:, :] = 0.0
+    for b in range(n_blocks):
+        loglike[0] += partial_loglike[b]
+        d_loglike[:] += partial_d_loglike[b]
+        bhhh[:, :] += partial_bhhh[b]
+
+
+def latent_class_arrays(membership, classes):
+    """
+    Collect the kernel arrays of the models of a latent class model.
+
+    Parameters
+    ----------
+    membership : NumbaModel
+        The class membership model.
+    classes : Sequence[NumbaModel]
+        The class choice models, in the same order as the alternatives
+        of the membership model.
+
+    Returns
+    -------
+    membership_arrays : KernelArrays
+    class_arrays : tuple[KernelArrays]
+    """
+    for m in (membership, *classes):
+        if not isinstance(m, NumbaModel):
+            raise TypeError(f"latent class kernel requires NumbaModel, not {type(m)}")
+    if not membership.is_mnl():
+        raise ValueError("the class membership model must be MNL")
+    class_arrays = tuple(_uniform_arrays(m) for m in classes)
+    n_alts = {a.ca.shape[1] for a in class_arrays}
+    if len(n_alts) != 1:
+        raise ValueError("all class models must have the same alternatives")
+    return _uniform_arrays(membership), class_arrays
+
+
+def latent_class_evaluate(
+        membership,
+        classes,
+        holdfast,
+        pvals,
+        case_index,
+        return_gradient=False,
+        return_bhhh=False,
+        return_probability=False,
+        return_casewise=False,
+        arrays=None,
+):
+    """
+    Evaluate a latent class model built from NumbaModels.
+
+    Parameters
+    ----------
+    membership : NumbaModel
+        The class membership model.
+    classes : Sequence[NumbaModel]
+        The class choice models, in the same order as the alternatives
+        of the membership model.
+    holdfast, pvals : array-like
+        The holdfast flags and values of the parameters, on the
+        parameter frame shared by all the models.
+    case_index : array-like of int
+        Positions of the cases to include, see `case_index`.
+    return_gradient, return_bhhh, return_probability, return_casewise : bool
+        Which results to compute.
+    arrays : tuple, optional
+        The result of `latent_class_arrays`, if it is already available.
+
+    Returns
+    -------
+    LatentClassArrays
+        The loglike and gradient are casewise when `return_casewise`
+        is set, and totals otherwise.  The probability is empty unless
+        `return_probability` is set.
+    """
+    if arrays is None:
+        arrays = latent_class_arrays(membership, classes)
+    membership_arrays, class_arrays = arrays
+    case_index = np.ascontiguousarray(case_index, dtype=np.int64)
+    n_selected = case_index.shape[0]
+    n_params = len(pvals)
+    n_alts = class_arrays[0].ca.shape[1]
+    max_nodes = max(a.ch.shape[1] for a in (membership_arrays, *class_arrays))
+    return_gradient = return_gradient or return_bhhh
+    probability = np.zeros((n_selected if return_probability else 0, n_alts))
+    casewise_loglike = np.zeros(n_selected if return_casewise else 0)
+    casewise_d_loglike = np.zeros((n_selected if return_casewise else 0, n_params))
+    bhhh = np.zeros((n_params, n_params))
+    d_loglike = np.zeros(n_params)
+    loglike = np.zeros(1)
+    n_blocks = max(1, min(get_num_threads(), n_selected))
+    with np.errstate(divide='ignore', over='ignore'):
+        _latent_class_reduce(
+            membership_arrays,
+            class_arrays,
+            np.ascontiguousarray(holdfast, dtype=np.int8),
+            np.ascontiguousarray(pvals, dtype=np.float64),
+            case_index,
+            return_gradient,
+            return_bhhh,
+            max_nodes,
+            n_blocks,
+            probability,
+            casewise_loglike,
+            casewise_d_loglike,
+            bhhh,
+            d_loglike,
+            loglike,
+        )
+    return LatentClassArrays(
+        probability=probability,
+        loglike=casewise_loglike if return_casewise else loglike[0],
+        d_loglike=casewise_d_loglike if return_casewise else d_loglike,
+        bhhh=bhhh,
+    )
@@ -0,0 +1,644 @@
+"""
+Mixed logit models with panel random coefficients.
+
+The simulated likelihood of each panel group (decision maker) is the
+average over draws of the product of the probabilities of the group's
+observed choices, with the random parameters held fixed for all choices
+within a group for any one draw.
+"""
+
+import numpy as np
+import pandas as pd
+from numba import njit, prange, get_num_threads
+
+from ..exceptions import MissingDataError
+from .model import NumbaModel, WorkArrays, FixedArrays, _numba_master_case
+
+
+NORMAL = 0
+LOGNORMAL = 1
+UNIFORM = 2
+TRIANGULAR = 3
+
+
+class Mixture:
+    """
+    A random parameter specification.
+
+    Parameters
+    ----------
+    mean : str
+        Name of the parameter that appears in the utility functions.
+        Its value becomes the location of the distribution.
+    std : str
+        Name of the parameter giving the spread of the distribution.
+        It is added to the model's parameters if needed.
+    """
+
+    distribution = None
+
+    def __init__(self, mean, std):
+        self.mean = str(mean)
+        self.std = str(std)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.mean!r}, {self.std!r})"
+
+    def standardize(self, uniform_draws):
+        """Transform draws on (0,1) into standardized draws."""
+        from scipy.special import ndtri
+        return ndtri(uniform_draws)
+
+
+class Normal(Mixture):
+    """A normally distributed parameter, mean + std * z."""
+
+    distribution = NORMAL
+
+
+class LogNormal(Mixture):
+    """A log-normally distributed parameter, exp(mean + std * z)."""
+
+    distribution = LOGNORMAL
+
+
+class Uniform(Mixture):
+    """A uniformly distributed parameter on mean +/- std."""
+
+    distribution = UNIFORM
+
+    def standardize(self, uniform_draws):
+        return 2.0 * uniform_draws - 1.0
+
+
+class Triangular(Mixture):
+    """A triangular distributed parameter on mean +/- std."""
+
+    distribution = TRIANGULAR
+
+    def standardize(self, uniform_draws):
+        return np.where(
+            uniform_draws < 0.5,
+            np.sqrt(2.0 * uniform_draws) - 1.0,
+            1.0 - np.sqrt(2.0 * (1.0 - uniform_draws)),
+        )
+
+
+def _primes(n):
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton(n, base, skip=10):
+    """
+    A Halton sequence.
+
+    Parameters
+    ----------
+    n : int
+        Length of the sequence.
+    base : int
+        A prime number base.
+    skip : int, default 10
+        Number of initial values of the sequence to discard.
+
+    Returns
+    -------
+    ndarray
+    """
+    index = np.arange(skip + 1, skip + n + 1, dtype=np.int64)
+    result = np.zeros(n)
+    f = 1.0
+    while np.any(index > 0):
+        f /= base
+        result += f * (index % base)
+        index //= base
+    return result
+
+
+def halton_draws(n_groups, n_draws, n_dims, skip=10, seed=None):
+    """
+    Uniform Halton draws, with a different prime base for each dimension.
+
+    Consecutive runs of `n_draws` values from each sequence are assigned
+    to each group.  If a `seed` is given, each dimension is shifted by a
+    random amount, modulo 1.
+
+    Returns
+    -------
+    ndarray
+        Shape [n_groups, n_draws, n_dims].
+    """
+    draws = np.zeros((n_groups, n_draws, n_dims))
+    shift = np.random.default_rng(seed).random(n_dims) if seed is not None else np.zeros(n_dims)
+    for d, base in enumerate(_primes(n_dims)):
+        seq = (halton(n_groups * n_draws, base, skip=skip) + shift[d]) % 1.0
+        draws[:, :, d] = seq.reshape(n_groups, n_draws)
+    return draws
+
+
+def mlhs_draws(n_groups, n_draws, n_dims, seed=None):
+    """
+    Uniform modified Latin hypercube sampling draws.
+
+    For each group and dimension, the draws are one randomly placed
+    point in each of `n_draws` equal intervals, in random order.
+
+    Returns
+    -------
+    ndarray
+        Shape [n_groups, n_draws, n_dims].
+    """
+    rng = np.random.default_rng(seed)
+    draws = np.zeros((n_groups, n_draws, n_dims))
+    base = np.arange(n_draws)
+    for g in range(n_groups):
+        for d in range(n_dims):
+            draws[g, :, d] = (rng.permutation(base) + rng.random()) / n_draws
+    return draws
+
+
+@njit(error_model='numpy', fastmath=True, cache=True, parallel=True, nogil=True)
+def _mixed_panel_reduce(
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input shape=[1]
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        edgeslots,     # int input shape=[edges, 4]
+        mu_slots,      # int input shape=[nests]
+        start_slots,   # int input shape=[nests]
+        len_slots,     # int input shape=[nests]
+        holdfast_arr,  # int8 input shape=[n_params]
+        parameter_arr, # float input shape=[n_params]
+        array_ch,      # float input shape=[n_cases, nodes]
+        array_av,      # int8 input shape=[n_cases, nodes]
+        array_wt,      # float input shape=[n_cases]
+        array_co,      # float input shape=[n_cases, n_co_vars]
+        array_ca,      # float input shape=[n_cases, n_alts, n_ca_vars]
+        array_ce_data,     # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # int input shape=[n_casealts]
+        array_ce_ptr,      # int input shape=[n_cases, 2]
+        case_rows,     # int input shape=[n_selected], data rows sorted by group
+        case_out,      # int input shape=[n_selected], output row of each case
+        group_ptr,     # int input shape=[n_groups + 1]
+        mean_slots,    # int input shape=[n_mix]
+        std_slots,     # int input shape=[n_mix]
+        distribution,  # int8 input shape=[n_mix]
+        draws,         # float input shape=[n_groups, n_draws, n_mix]
+        return_grad,   # bool input
+        return_bhhh,   # bool input
+        d_penalty,     # float input shape=[n_params] or [0]
+        n_blocks,      # int input scalar
+        probability,         # float output shape=[n_selected or 0, nodes]
+        casewise_d_loglike,  # float output shape=[n_groups or 0, n_params]
+        casewise_loglike,    # float output shape=[n_groups or 0]
+        bhhh,                # float output shape=[n_params, n_params]
+        d_loglike,           # float output shape=[n_params]
+        loglike,             # float output shape=[1]
+):
+    """
+    Simulate the panel loglike, gradient and BHHH of a mixed logit model.
+
+    For each group and draw, the random parameters are set in a copy of
+    the parameter array, and every case in the group is evaluated by
+    `_numba_master_case`.  The group likelihood is the mean over draws
+    of the product of case probabilities, computed on the log scale.
+    Derivatives with respect to the random parameters flow back to their
+    mean and std parameters through the draws.
+    """
+    n_groups = group_ptr.shape[0] - 1
+    n_draws = draws.shape[1]
+    n_mix = mean_slots.shape[0]
+    n_nodes = array_ch.shape[1]
+    n_params = parameter_arr.shape[0]
+    keep_probability = probability.shape[0] > 0
+    keep_casewise = casewise_loglike.shape[0] > 0
+    use_penalty = d_penalty.shape[0] > 0
+    block_size = (n_groups + n_blocks - 1) // n_blocks
+
+    partial_bhhh = np.zeros((n_blocks, n_params, n_params), dtype=bhhh.dtype)
+    partial_d_loglike = np.zeros((n_blocks, n_params), dtype=d_loglike.dtype)
+    partial_loglike = np.zeros(n_blocks, dtype=loglike.dtype)
+
+    for b in prange(n_blocks):
+        flags = np.zeros(4, dtype=np.int8)
+        flags[1] = keep_probability
+        flags[2] = return_grad
+        # derivatives are needed for the random parameters even when
+        # their means are held fast, to reach their std parameters
+        holdfast = holdfast_arr.copy()
+        for j in range(n_mix):
+            holdfast[mean_slots[j]] = 0
+        beta = np.zeros(n_params)
+        d_beta_d_mean = np.zeros(n_mix)
+        d_beta_d_std = np.zeros(n_mix)
+        wt_one = np.ones(1)
+        utility = np.zeros(n_nodes)
+        logprob = np.zeros(n_nodes)
+        node_probability = np.zeros(n_nodes)
+        dutility = np.zeros((0, n_params))
+        adjoint = np.zeros(n_nodes)
+        gradient = np.zeros(n_params)
+        case_bhhh = np.zeros((1, 1))
+        case_d_loglike = np.zeros(n_params)
+        case_loglike = np.zeros(1)
+        draw_loglike = np.zeros(n_draws)
+        draw_d_loglike = np.zeros((n_draws, n_params))
+        group_d_loglike = np.zeros(n_params)
+        group_stop = min((b + 1) * block_size, n_groups)
+
+        for g in range(b * block_size, group_stop):
+            first = group_ptr[g]
+            last = group_ptr[g + 1]
+            for r in range(n_draws):
+                beta[:] = parameter_arr
+                for j in range(n_mix):
+                    z = draws[g, r, j]
+                    x = parameter_arr[mean_slots[j]] + parameter_arr[std_slots[j]] * z
+                    if distribution[j] == 1:
+                        x = np.exp(x)
+                        d_beta_d_mean[j] = x
+                        d_beta_d_std[j] = x * z
+                    else:
+                        d_beta_d_mean[j] = 1.0
+                        d_beta_d_std[j] = z
+                    beta[mean_slots[j]] = x
+                draw_loglike[r] = 0.0
+                draw_d_loglike[r, :] = 0.0
+                for i in range(first, last):
+                    c = case_rows[i]
+                    _numba_master_case(
+                        model_q_ca_param_scale,
+                        model_q_ca_param,
+                        model_q_ca_data,
+                        model_q_scale_param,
+                        model_utility_ca_param_scale,
+                        model_utility_ca_param,
+                        model_utility_ca_data,
+                        model_utility_co_alt,
+                        model_utility_co_param_scale,
+                        model_utility_co_param,
+                        model_utility_co_data,
+                        edgeslots,
+                        mu_slots,
+                        start_slots,
+                        len_slots,
+                        holdfast,
+                        beta,
+                        array_ch[c],
+                        array_av[c],
+                        wt_one,
+                        array_co[c],
+                        array_ca[c],
+                        array_ce_data,
+                        array_ce_indices,
+                        array_ce_ptr[c],
+                        flags,
+                        dutility,
+                        adjoint,
+                        gradient,
+                        utility,
+                        logprob,
+                        node_probability,
+                        case_bhhh,
+                        case_d_loglike,
+                        case_loglike,
+                    )
+                    draw_loglike[r] += case_loglike[0]
+                    if return_grad:
+                        draw_d_loglike[r, :] += case_d_loglike
+                    if keep_probability:
+                        for n in range(n_nodes):
+                            probability[case_out[i], n] += node_probability[n] / n_draws
+                if return_grad:
+                    for j in range(n_mix):
+                        d_beta = draw_d_loglike[r, mean_slots[j]]
+                        draw_d_loglike[r, mean_slots[j]] = d_beta * d_beta_d_mean[j]
+                        draw_d_loglike[r, std_slots[j]] += d_beta * d_beta_d_std[j]
+                    for j in range(n_mix):
+                        if holdfast_arr[mean_slots[j]]:
+                            draw_d_loglike[r, mean_slots[j]] = 0.0
+                        if holdfast_arr[std_slots[j]]:
+                            draw_d_loglike[r, std_slots[j]] = 0.0
+
+            # log of the mean of the group likelihood over draws
+            shift = draw_loglike.max()
+            if not np.isfinite(shift):
+                group_loglike = shift
+                group_d_loglike[:] = 0.0
+            else:
+                total = 0.0
+                for r in range(n_draws):
+                    draw_loglike[r] = np.exp(draw_loglike[r] - shift)
+                    total += draw_loglike[r]
+                group_loglike = shift + np.log(total / n_draws)
+                group_d_loglike[:] = 0.0
+                if return_grad:
+                    for r in range(n_draws):
+                        share = draw_loglike[r] / total
+                        for p in range(n_params):
+                            group_d_loglike[p] += share * draw_d_loglike[r, p]
+            if use_penalty:
+                for p in range(n_params):
+                    group_d_loglike[p] += d_penalty[p]
+
+            weight = array_wt[case_rows[first]]
+            partial_loglike[b] += group_loglike * weight
+            if keep_casewise:
+                casewise_loglike[g] = group_loglike * weight
+            if return_grad:
+                for p in range(n_params):
+                    partial_d_loglike[b, p] += group_d_loglike[p] * weight
+                if keep_casewise:
+                    for p in range(n_params):
+                        casewise_d_loglike[g, p] = group_d_loglike[p] * weight
+                if return_bhhh:
+                    for p in range(n_params):
+                        _temp = group_d_loglike[p] * weight
+                        if _temp:
+                            for q in range(n_params):
+                                partial_bhhh[b, p, q] += _temp * group_d_loglike[q]
+
+    loglike[0] = 0.0
+    d_loglike[:] = 0.0
+    bhhh[:, :] = 0.0
+    for b in range(n_blocks):
+        loglike[0] += partial_loglike[b]
+        d_loglike[:] += partial_d_loglike[b]
+        bhhh[:, :] += partial_bhhh[b]
+
+
+class MixedNumbaModel(NumbaModel):
+    """
+    A mixed logit model with panel random coefficients.
+
+    Parameters
+    ----------
+    mixtures : Iterable[Mixture], optional
+        The random parameters.  Without any, this is the same as a
+        NumbaModel.
+    n_draws : int, default 100
+        Number of simulation draws for each panel group.
+    draws : {'halton', 'mlhs'}, default 'halton'
+        How to generate the draws.
+    seed : int, optional
+        Seed for the random components of the draws.  For Halton draws
+        this applies a random shift, for MLHS it is required for
+        reproducible draws.
+    groupid : str or array-like, optional
+        The panel group of each case, as an idco variable name or as
+        an array of group ids.  If not given, groups are taken from the
+        GROUPID and INGROUP dimensions of the model's dataset, if it has
+        them, and otherwise each case is its own group.
+    **kwargs
+        Passed to NumbaModel.
+
+    Notes
+    -----
+    The casewise loglike and gradient are given for each panel group,
+    not for each case, and the BHHH matrix is formed from the group
+    gradients.  The probability is the simulated unconditional
+    probability of each case, averaged over draws.  Utility and logsum
+    results are evaluated with the random parameters at their means.
+    """
+
+    def __init__(
+            self,
+            *args,
+            mixtures=(),
+            n_draws=100,
+            draws='halton',
+            seed=None,
+            groupid=None,
+            **kwargs,
+    ):
+        self._mixtures = list(mixtures)
+        self._n_draws = n_draws
+        self._draw_method = draws
+        self._seed = seed
+        self._groupid = groupid
+        self._draws = None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def mixtures(self):
+        """list[Mixture] : The random parameters."""
+        return self._mixtures
+
+    @mixtures.setter
+    def mixtures(self, x):
+        self._mixtures = list(x)
+        self._draws = None
+        self.mangle()
+
+    @property
+    def _has_analytic_d2_loglike(self):
+        # the analytic kernel knows nothing of the mixtures, so the
+        # Hessian is found by finite differences of the simulated gradient
+        if self._mixtures:
+            return False
+        return super()._has_analytic_d2_loglike
+
+    @property
+    def n_draws(self):
+        """int : Number of simulation draws for each panel group."""
+        return self._n_draws
+
+    @n_draws.setter
+    def n_draws(self, x):
+        self._n_draws = int(x)
+        self._draws = None
+
+    @property
+    def groupid(self):
+        """str or array-like : The panel group of each case."""
+        return self._groupid
+
+    @groupid.setter
+    def groupid(self, x):
+        self._groupid = x
+        self._draws = None
+
+    def mangle(self, *args, **kwargs):
+        super().mangle(*args, **kwargs)
+        self._draws = None
+
+    def _scan_logsums_ensure_names(self):
+        super()._scan_logsums_ensure_names()
+        self._ensure_names(
+            [m.std for m in self._mixtures],
+            nullvalue=0, initvalue=0.1,
+        )
+
+    def panel_groups(self):
+        """
+        The panel group of each case.
+
+        Returns
+        -------
+        ndarray of int
+            Group numbers, counting from zero, for every case.
+        """
+        n_cases = self.n_cases
+        groupid = self._groupid
+        if groupid is None:
+            dataset = self.dataset
+            if dataset is not None and dataset.dc.GROUPID is not None and dataset.dc.INGROUP is not None:
+                n_ingroup = dataset.dims[dataset.dc.INGROUP]
+                return np.arange(n_cases) // n_ingroup
+            return np.arange(n_cases)
+        if isinstance(groupid, str):
+            if self.dataset is not None and groupid in self.dataset:
+                groupid = self.dataset[groupid].values
+            elif self.dataframes is not None and self.dataframes.data_co is not None:
+                groupid = self.dataframes.data_co[groupid].values
+            else:
+                raise MissingDataError(f"cannot find panel groupid {groupid!r}")
+        groupid = np.asarray(groupid)
+        if groupid.shape != (n_cases,):
+            raise ValueError(f"groupid must give one group for each of {n_cases} cases")
+        return pd.factorize(groupid)[0]
+
+    def _get_draws(self, n_groups):
+        n_mix = len(self._mixtures)
+        if self._draws is None or self._draws.shape != (n_groups, self._n_draws, n_mix):
+            if self._draw_method == 'halton':
+                uniform = halton_draws(n_groups, self._n_draws, n_mix, seed=self._seed)
+            elif self._draw_method == 'mlhs':
+                uniform = mlhs_draws(n_groups, self._n_draws, n_mix, seed=self._seed)
+            else:
+                raise ValueError(f"unknown draws method {self._draw_method!r}")
+            draws = np.zeros_like(uniform)
+            for j, mixture in enumerate(self._mixtures):
+                draws[:, :, j] = mixture.standardize(uniform[:, :, j])
+            self._draws = draws
+        return self._draws
+
+    def _loglike_runner(
+            self,
+            x=None,
+            only_utility=0,
+            return_gradient=False,
+            return_probability=False,
+            return_bhhh=False,
+            start_case=None,
+            stop_case=None,
+            step_case=None,
+            return_casewise=False,
+    ):
+        if only_utility or not self._mixtures:
+            return super()._loglike_runner(
+                x,
+                only_utility=only_utility,
+                return_gradient=return_gradient,
+                return_probability=return_probability,
+                return_bhhh=return_bhhh,
+                start_case=start_case,
+                stop_case=stop_case,
+                step_case=step_case,
+                return_casewise=return_casewise,
+            )
+        if x is not None:
+            self.set_values(x)
+        arrays = self._kernel_arrays(allow_missing_ch=return_probability)
+        pf = self.pf
+        holdfast = pf.holdfast.to_numpy().astype(np.int8)
+        pvals = self.pvals.astype(np.float64)
+
+        # selected cases, sorted so each group is contiguous
+        selected = np.arange(self.n_cases)[slice(start_case, stop_case, step_case)]
+        groups = self.panel_groups()
+        group_codes, group_of_case = np.unique(groups[selected], return_inverse=True)
+        case_out = np.argsort(group_of_case, kind='stable')
+        case_rows = selected[case_out]
+        group_ptr = np.zeros(len(group_codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(group_of_case, minlength=len(group_codes)), out=group_ptr[1:])
+        n_groups = len(group_codes)
+        draws = self._get_draws(groups.max() + 1)[group_codes]
+
+        mean_slots = np.asarray([pf.index.get_loc(m.mean) for m in self._mixtures], dtype=np.int64)
+        std_slots = np.asarray([pf.index.get_loc(m.std) for m in self._mixtures], dtype=np.int64)
+        distribution = np.asarray([m.distribution for m in self._mixtures], dtype=np.int8)
+
+        if self.constraint_intensity:
+            penalty, d_penalty, dpenalty_binding = self.constraint_penalty()
+            d_penalty = np.asarray(d_penalty, dtype=np.float64)
+        else:
+            penalty, d_penalty = 0.0, np.zeros(0)
+
+        n_nodes = arrays.ch.shape[1]
+        n_fixed = len(FixedArrays._fields)
+        n_params = len(pvals)
+        probability = np.zeros((len(selected) if return_probability else 0, n_nodes))
+        casewise_d_loglike = np.zeros((n_groups if return_casewise else 0, n_params))
+        casewise_loglike = np.zeros(n_groups if return_casewise else 0)
+        bhhh = np.zeros((1, n_params, n_params))
+        d_loglike = np.zeros((1, n_params))
+        loglike = np.zeros(1)
+        n_blocks = max(1, min(get_num_threads(), n_groups))
+        with np.errstate(divide='ignore', over='ignore'):
+            _mixed_panel_reduce(
+                *arrays[:n_fixed],
+                holdfast,
+                pvals,
+                *arrays[n_fixed:],
+                np.ascontiguousarray(case_rows, dtype=np.int64),
+                np.ascontiguousarray(case_out, dtype=np.int64),
+                group_ptr,
+                mean_slots,
+                std_slots,
+                distribution,
+                np.ascontiguousarray(draws),
+                return_gradient or return_bhhh,
+                return_bhhh,
+                d_penalty,
+                n_blocks,
+                probability,
+                casewise_d_loglike,
+                casewise_loglike,
+                bhhh[0],
+                d_loglike[0],
+                loglike,
+            )
+        if penalty:
+            loglike += penalty * n_groups
+            casewise_loglike += penalty
+        return WorkArrays(
+            utility=np.zeros((0, n_nodes)),
+            logprob=np.zeros((0, n_nodes)),
+            probability=probability,
+            bhhh=bhhh,
+            d_loglike=casewise_d_loglike if return_casewise else d_loglike,
+            loglike=casewise_loglike if return_casewise else loglike,
+        ), penalty
+
+    def __getstate__(self):
+        state = dict(
+            mixtures=self._mixtures,
+            n_draws=self._n_draws,
+            draws=self._draw_method,
+            seed=self._seed,
+            groupid=self._groupid,
+        )
+        return super().__getstate__(), state
+
+    def __setstate__(self, state):
+        self._mixtures = state[1]['mixtures']
+        self._n_draws = state[1]['n_draws']
+        self._draw_method = state[1]['draws']
+        self._seed = state[1]['seed']
+        self._groupid = state[1]['groupid']
+        self._draws = None
+        super().__setstate__(state[0])
@@ -2,7 +2,7 @@ import logging
 
 import numpy as np
 import pandas as pd
-from numba import guvectorize, njit
+from numba import guvectorize, njit, prange, get_num_threads
 from numba import int8 as i8
 from numba import int32 as i32
 from numba import int64 as i64
@@ -17,6 +17,7 @@ from ..dataframes import DataFrames
 from ..dataset import Dataset, DataTree, DataArray
 from collections import namedtuple
 from .data_arrays import DataArrays
+from .streaming import chunk_bounds, load_chunk, prefetched
 
 
 import warnings
@@ -62,8 +63,10 @@ def utility_from_data_co(
         array_av,                      # int8 input shape=[n_alts]
         data_co,                       # float input shape=[n_co_vars]
         utility_elem,                  # float output shape=[n_alts]
-        dutility_elem,                 # float output shape=[n_alts, n_params]
+        dutility_elem,                 # float output shape=[n_alts or 0, n_params]
 ):
+    # a dutility_elem with no rows skips the derivatives
+    write_grad = dutility_elem.shape[0] > 0
     for i in range(model_utility_co_alt.shape[0]):
         altindex = model_utility_co_alt[i]
         param_value = parameter_arr[model_utility_co_param[i]]
@@ -71,12 +74,12 @@ def utility_from_data_co(
         if array_av[altindex]:
             if model_utility_co_data[i] == -1:
                 utility_elem[altindex] += param_value * model_utility_co_param_scale[i]
-                if not param_holdfast:
+                if write_grad and not param_holdfast:
                     dutility_elem[altindex, model_utility_co_param[i]] += model_utility_co_param_scale[i]
             else:
                 _temp = data_co[model_utility_co_data[i]] * model_utility_co_param_scale[i]
                 utility_elem[altindex] += _temp * param_value
-                if not param_holdfast:
+                if write_grad and not param_holdfast:
                     dutility_elem[altindex, model_utility_co_param[i]] += _temp
 
 
@@ -95,9 +98,11 @@ def quantity_from_data_ca(
         array_ce_indices,               # int input shape=[n_casealts]
         array_ce_ptr,                   # int input shape=[2]
         utility_elem,                   # float output shape=[n_alts]
-        dutility_elem,                  # float output shape=[n_alts, n_params]
+        dutility_elem,                  # float output shape=[n_alts or 0, n_params]
 ):
     n_alts = array_ca.shape[0]
+    # a dutility_elem with no rows skips the derivatives
+    write_grad = dutility_elem.shape[0] > 0
 
     if model_q_scale_param[0] >= 0:
         scale_param_value = parameter_arr[model_q_scale_param[0]]
@@ -121,16 +126,17 @@ def quantity_from_data_ca(
                             * np.exp(parameter_arr[model_q_ca_param[i]])
                     )
                     utility_elem[j] += _temp
-                    if not holdfast_arr[model_q_ca_param[i]]:
+                    if write_grad and not holdfast_arr[model_q_ca_param[i]]:
                         dutility_elem[j, model_q_ca_param[i]] += _temp * scale_param_value
 
-                for i in range(model_q_ca_param.shape[0]):
-                    if not holdfast_arr[model_q_ca_param[i]]:
-                        dutility_elem[j, model_q_ca_param[i]] /= utility_elem[j]
+                if write_grad:
+                    for i in range(model_q_ca_param.shape[0]):
+                        if not holdfast_arr[model_q_ca_param[i]]:
+                            dutility_elem[j, model_q_ca_param[i]] /= utility_elem[j]
 
                 _tempsize = np.log(utility_elem[j])
                 utility_elem[j] = _tempsize * scale_param_value
-                if (model_q_scale_param[0] >= 0) and not scale_param_holdfast:
+                if write_grad and (model_q_scale_param[0] >= 0) and not scale_param_holdfast:
                     dutility_elem[j, model_q_scale_param[0]] += _tempsize
 
             j += 1
@@ -157,16 +163,17 @@ def quantity_from_data_ca(
                             * np.exp(parameter_arr[model_q_ca_param[i]])
                         )
                         utility_elem[j] += _temp
-                        if not holdfast_arr[model_q_ca_param[i]]:
+                        if write_grad and not holdfast_arr[model_q_ca_param[i]]:
                             dutility_elem[j, model_q_ca_param[i]] += _temp * scale_param_value
 
-                    for i in range(model_q_ca_param.shape[0]):
-                        if not holdfast_arr[model_q_ca_param[i]]:
-                            dutility_elem[j, model_q_ca_param[i]] /= utility_elem[j]
+                    if write_grad:
+                        for i in range(model_q_ca_param.shape[0]):
+                            if not holdfast_arr[model_q_ca_param[i]]:
+                                dutility_elem[j, model_q_ca_param[i]] /= utility_elem[j]
 
                     _tempsize = np.log(utility_elem[j])
                     utility_elem[j] = _tempsize * scale_param_value
-                    if (model_q_scale_param[0] >= 0) and not scale_param_holdfast:
+                    if write_grad and (model_q_scale_param[0] >= 0) and not scale_param_holdfast:
                         dutility_elem[j, model_q_scale_param[0]] += _tempsize
 
             else:
@@ -186,9 +193,11 @@ def utility_from_data_ca(
         array_ce_indices,               # int input shape=[n_casealts]
         array_ce_ptr,                   # int input shape=[2]
         utility_elem,                   # float output shape=[n_alts]
-        dutility_elem,                  # float output shape=[n_alts, n_params]
+        dutility_elem,                  # float output shape=[n_alts or 0, n_params]
 ):
     n_alts = array_ca.shape[0]
+    # a dutility_elem with no rows skips the derivatives
+    write_grad = dutility_elem.shape[0] > 0
 
     if array_ce_data.shape[0] > 0:
         j = 0
@@ -202,7 +211,7 @@ def utility_from_data_ca(
                 _temp = array_ce_data[row, model_utility_ca_data[i]]
                 _temp *= model_utility_ca_param_scale[i]
                 utility_elem[j] += _temp * parameter_arr[model_utility_ca_param[i]]
-                if not holdfast_arr[model_utility_ca_param[i]]:
+                if write_grad and not holdfast_arr[model_utility_ca_param[i]]:
                     dutility_elem[j, model_utility_ca_param[i]] += _temp
             j += 1
         while n_alts > j:
@@ -224,7 +233,7 @@ def utility_from_data_ca(
                         _temp = array_ca[j, model_utility_ca_data[i]]
                     _temp *= model_utility_ca_param_scale[i]
                     utility_elem[j] += _temp * parameter_arr[model_utility_ca_param[i]]
-                    if not holdfast_arr[model_utility_ca_param[i]]:
+                    if write_grad and not holdfast_arr[model_utility_ca_param[i]]:
                         dutility_elem[j, model_utility_ca_param[i]] += _temp
             else:
                 utility_elem[j] = -np.inf
@@ -260,6 +269,43 @@ def _type_signatures(sig):
         _type_signature(sig, precision=64),
     ]
 
+@njit(cache=True)
+def _edge_alpha(allocslot, parameter_arr):
+    """
+    The allocation parameter of one edge.
+
+    A non-negative `allocslot` is the slot of the parameter holding the
+    allocation, and a negative one is minus the number of parents of the
+    child, which are allocated equally.  The default of -1 is an
+    ordinary (single parent) edge, with an allocation of one.
+    """
+    if allocslot >= 0:
+        return parameter_arr[allocslot]
+    return 1.0 / (-allocslot)
+
+
+@njit(cache=True)
+def _is_cross_nested(edgeslots):
+    for s in range(edgeslots.shape[0]):
+        if edgeslots[s, 3] != -1:
+            return True
+    return False
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _edge_conditional_probability(alpha, mu_up, utility_dn, utility_up):
+    """
+    The probability of the child of an edge conditional on its parent.
+    """
+    if not alpha > 0 or utility_dn == -np.inf or utility_up == -np.inf:
+        return 0.0
+    if mu_up:
+        return np.exp((np.log(alpha) + utility_dn - utility_up) / mu_up)
+    if utility_dn >= utility_up:
+        return 1.0
+    return 0.0
+
+
 @njit(error_model='numpy', fastmath=True, cache=True)
 def _numba_utility_to_loglike(
         n_alts,
@@ -313,36 +359,35 @@ def _numba_utility_to_loglike(
                     edge = start_slots[up_nest] + n
                     dn = dnslots[edge]
                     if utility[dn] > -np.inf:
-                        z = utility[dn] / mu_up
+                        if allocslot[edge] == -1:
+                            z = utility[dn] / mu_up
+                        else:
+                            alpha = _edge_alpha(allocslot[edge], parameter_arr)
+                            if not alpha > 0:
+                                continue
+                            z = (np.log(alpha) + utility[dn]) / mu_up
                         if z > shifter:
                             shifter = z
-                            shifter_position = dn
-                        # TODO alphas
-                        # if alpha[edge] > 0:
-                        #     z = (logalpha[edge] + utility[child]) / mu[parent]
-                        #     if z > shifter:
-                        #         shifter = z
-                        #         shifter_position = child
+                            shifter_position = edge
                 for n in range(n_children_for_parent):
                     edge = start_slots[up_nest] + n
                     dn = dnslots[edge]
                     if utility[dn] > -np.inf:
-                        if shifter_position == dn:
+                        if shifter_position == edge:
                             utility[up] += 1
-                        else:
+                        elif allocslot[edge] == -1:
                             utility[up] += np.exp((utility[dn] / mu_up) - shifter)
-                        # if alpha[edge] > 0:
-                        #     if shifter_position == child:
-                        #         utility[parent] += 1
-                        #     else:
-                        #         z = ((logalpha[edge] + utility[child]) / mu[parent]) - shifter
-                        #         utility[parent] += exp(z)
+                        else:
+                            alpha = _edge_alpha(allocslot[edge], parameter_arr)
+                            if alpha > 0:
+                                z = (np.log(alpha) + utility[dn]) / mu_up
+                                utility[up] += np.exp(z - shifter)
                 utility[up] = (np.log(utility[up]) + shifter) * mu_up
             else: # mu_up is zero
                 for n in range(n_children_for_parent):
                     edge = start_slots[up_nest] + n
                     dn = dnslots[edge]
-                    if utility[dn] > utility[up]:
+                    if utility[dn] > utility[up] and _edge_alpha(allocslot[edge], parameter_arr) > 0:
                         utility[up] = utility[dn]
     else:
         for s in range(upslots.size):
@@ -373,6 +418,40 @@ def _numba_utility_to_loglike(
     if only_utility == 2:
         return
 
+    if _is_cross_nested(edgeslots):
+        # With more than one parent per node the log probability of an
+        # alternative is not a sum over a single path, so the probability
+        # is pushed down every edge and logprob holds the log of the
+        # total (not conditional) probability of each node.  The gradient
+        # is only available from `_numba_sparse_d_loglike_cnl`.
+        probability[:] = 0.0
+        probability[-1] = 1.0
+        for s in range(upslots.size-1, -1, -1):
+            dn = dnslots[s]
+            up = upslots[s]
+            if not array_av[dn] or probability[up] == 0:
+                continue
+            if mu_slots[up - n_alts] < 0:
+                mu_up = 1.0
+            else:
+                mu_up = parameter_arr[mu_slots[up - n_alts]]
+            probability[dn] += probability[up] * _edge_conditional_probability(
+                _edge_alpha(allocslot[s], parameter_arr), mu_up, utility[dn], utility[up],
+            )
+        for i in range(logprob.size):
+            if probability[i] > 0:
+                logprob[i] = np.log(probability[i])
+            else:
+                logprob[i] = -np.inf
+        for a in range(n_alts):
+            if array_ch[a]:
+                loglike[0] += logprob[a] * array_ch[a] * array_wt[0]
+        if (return_grad or return_bhhh) and dutility.shape[0] > 0:
+            d_loglike[:] = 0.0
+            if return_bhhh:
+                bhhh[:] = 0.0
+        return
+
     for s in range(upslots.size):
         dn = dnslots[s]
         up = upslots[s]
@@ -405,7 +484,9 @@ def _numba_utility_to_loglike(
             else:
                 probability[dn] = 0.0
 
-        if return_grad or return_bhhh:
+        # with a dutility that has no rows, the gradient is left to
+        # the sparse path in `_numba_sparse_d_loglike`
+        if (return_grad or return_bhhh) and dutility.shape[0] > 0:
 
             d_loglike[:] = 0.0
 
@@ -499,6 +580,400 @@ def _numba_utility_to_loglike(
                         bhhh += np.outer(dLL_temp,dLL_temp) * this_ch * array_wt[0]
 
 
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _scatter_elemental_gradient(
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input scalar
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        holdfast_arr,                  # int8 input shape=[n_params]
+        parameter_arr,                 # float input shape=[n_params]
+        array_av,                      # int8 input shape=[nodes]
+        array_co,                      # float input shape=[n_co_vars]
+        array_ca,                      # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,                 # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,              # int input shape=[n_casealts]
+        array_ce_ptr,                  # int input shape=[2]
+        adjoint,                       # float input shape=[nodes]
+        gradient,                      # float output shape=[n_params]
+):
+    """
+    Add sum_a adjoint[a] * dV_a to the gradient, for elemental alternatives.
+
+    Each utility term touches only its own parameter, so this walks the
+    same slot arrays used to compute the utility, and never forms the
+    dense [n_alts, n_params] derivative array.
+    """
+    n_alts = array_ca.shape[0]
+    n_q = model_q_ca_param.shape[0]
+    q_scale_slot = model_q_scale_param[0]
+    if q_scale_slot >= 0:
+        scale_param_value = parameter_arr[q_scale_slot]
+    else:
+        scale_param_value = 1.0
+
+    for i in range(model_utility_co_alt.shape[0]):
+        a = model_utility_co_alt[i]
+        p = model_utility_co_param[i]
+        if not array_av[a] or adjoint[a] == 0 or holdfast_arr[p]:
+            continue
+        if model_utility_co_data[i] == -1:
+            gradient[p] += adjoint[a] * model_utility_co_param_scale[i]
+        else:
+            gradient[p] += adjoint[a] * array_co[model_utility_co_data[i]] * model_utility_co_param_scale[i]
+
+    use_ce = array_ce_data.shape[0] > 0
+    if use_ce:
+        row_start, row_stop = array_ce_ptr[0], array_ce_ptr[1]
+    else:
+        row_start, row_stop = 0, n_alts
+    for row in range(row_start, row_stop):
+        if use_ce:
+            a = array_ce_indices[row]
+        else:
+            a = row
+            if not array_av[a]:
+                continue
+        adj = adjoint[a]
+        if adj == 0:
+            continue
+        for i in range(model_utility_ca_param.shape[0]):
+            p = model_utility_ca_param[i]
+            if holdfast_arr[p]:
+                continue
+            if use_ce:
+                _temp = array_ce_data[row, model_utility_ca_data[i]]
+            else:
+                _temp = array_ca[a, model_utility_ca_data[i]]
+            gradient[p] += adj * _temp * model_utility_ca_param_scale[i]
+        if n_q:
+            q_row = row if use_ce else -1
+            total = 0.0
+            for i in range(n_q):
+                total += _quantity_term(
+                    i, a, q_row, model_q_ca_param_scale, model_q_ca_param,
+                    model_q_ca_data, parameter_arr, array_ca, array_ce_data,
+                )
+            if not total > 0:
+                continue
+            for i in range(n_q):
+                p = model_q_ca_param[i]
+                if not holdfast_arr[p]:
+                    gradient[p] += adj * scale_param_value * _quantity_term(
+                        i, a, q_row, model_q_ca_param_scale, model_q_ca_param,
+                        model_q_ca_data, parameter_arr, array_ca, array_ce_data,
+                    ) / total
+            if q_scale_slot >= 0 and not holdfast_arr[q_scale_slot]:
+                gradient[q_scale_slot] += adj * np.log(total)
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _numba_sparse_d_loglike(
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input scalar
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        edgeslots,     # int input shape=[edges, 4]
+        mu_slots,      # int input shape=[nests]
+        start_slots,   # int input shape=[nests]
+        len_slots,     # int input shape=[nests]
+        holdfast_arr,  # int8 input shape=[n_params]
+        parameter_arr, # float input shape=[n_params]
+        array_ch,      # float input shape=[nodes]
+        array_av,      # int8 input shape=[nodes]
+        array_wt,      # float input shape=[]
+        array_co,      # float input shape=[n_co_vars]
+        array_ca,      # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,     # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # int input shape=[n_casealts]
+        array_ce_ptr,      # int input shape=[2]
+        return_bhhh,   # bool input
+        utility,                  # float input shape=[nodes]
+        conditional_probability,  # float input shape=[nodes]
+        probability,              # float input shape=[nodes]
+        adjoint,       # float scratch shape=[nodes]
+        gradient,      # float scratch shape=[n_params]
+        bhhh,          # float output shape=[n_params, n_params]
+        d_loglike,     # float output shape=[n_params]
+):
+    """
+    Compute the gradient and BHHH of one case without dense dutility.
+
+    For each chosen alternative, the derivative of its log probability
+    with respect to every node utility (the adjoint) is found with one
+    pass down the nesting tree, and then mapped onto the parameters.
+    Only the mu parameters of nests need the nest utilities; elemental
+    parameters are reached through `_scatter_elemental_gradient`.
+    """
+    n_alts = array_ca.shape[0]
+    upslots = edgeslots[:, 0]
+    dnslots = edgeslots[:, 1]
+    n_params = parameter_arr.size
+
+    d_loglike[:] = 0.0
+    if return_bhhh:
+        bhhh[:, :] = 0.0
+
+    for a in range(n_alts):
+        this_ch = array_ch[a]
+        if this_ch == 0 or not probability[a] > 0:
+            continue
+        adjoint[:] = 0.0
+        gradient[:] = 0.0
+
+        # explicit derivatives of log P(a), along the path up to the root
+        current = a
+        for s in range(upslots.size):
+            if dnslots[s] != current:
+                continue
+            up = upslots[s]
+            mu_slot = mu_slots[up - n_alts]
+            if mu_slot < 0:
+                mu_up = 1.0
+            else:
+                mu_up = parameter_arr[mu_slot]
+            if mu_up:
+                adjoint[current] += 1.0 / mu_up
+                adjoint[up] -= 1.0 / mu_up
+                if mu_slot >= 0:
+                    gradient[mu_slot] += (utility[up] - utility[current]) / mu_up ** 2
+            current = up
+
+        # push the adjoint down the tree, parents before children
+        for s in range(upslots.size - 1, -1, -1):
+            dn = dnslots[s]
+            if array_av[dn]:
+                adjoint[dn] += adjoint[upslots[s]] * conditional_probability[dn]
+
+        # logsum derivatives with respect to each nest's own mu
+        for up in range(n_alts, utility.size):
+            up_nest = up - n_alts
+            mu_slot = mu_slots[up_nest]
+            if mu_slot < 0 or adjoint[up] == 0:
+                continue
+            mu_up = parameter_arr[mu_slot]
+            if not mu_up:
+                continue
+            _temp = utility[up]
+            for n in range(len_slots[up_nest]):
+                dn = dnslots[start_slots[up_nest] + n]
+                if array_av[dn]:
+                    _temp -= conditional_probability[dn] * utility[dn]
+            gradient[mu_slot] += adjoint[up] * _temp / mu_up
+
+        _scatter_elemental_gradient(
+            model_q_ca_param_scale,
+            model_q_ca_param,
+            model_q_ca_data,
+            model_q_scale_param,
+            model_utility_ca_param_scale,
+            model_utility_ca_param,
+            model_utility_ca_data,
+            model_utility_co_alt,
+            model_utility_co_param_scale,
+            model_utility_co_param,
+            model_utility_co_data,
+            holdfast_arr,
+            parameter_arr,
+            array_av,
+            array_co,
+            array_ca,
+            array_ce_data,
+            array_ce_indices,
+            array_ce_ptr,
+            adjoint,
+            gradient,
+        )
+
+        weight = this_ch * array_wt[0]
+        for i in range(n_params):
+            d_loglike[i] += gradient[i] * weight
+        if return_bhhh:
+            for i in range(n_params):
+                _temp = gradient[i] * weight
+                if _temp:
+                    for j in range(n_params):
+                        bhhh[i, j] += _temp * gradient[j]
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _numba_sparse_d_loglike_cnl(
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input scalar
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        edgeslots,     # int input shape=[edges, 4]
+        mu_slots,      # int input shape=[nests]
+        start_slots,   # int input shape=[nests]
+        len_slots,     # int input shape=[nests]
+        holdfast_arr,  # int8 input shape=[n_params]
+        parameter_arr, # float input shape=[n_params]
+        array_ch,      # float input shape=[nodes]
+        array_av,      # int8 input shape=[nodes]
+        array_wt,      # float input shape=[]
+        array_co,      # float input shape=[n_co_vars]
+        array_ca,      # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,     # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # int input shape=[n_casealts]
+        array_ce_ptr,      # int input shape=[2]
+        return_bhhh,   # bool input
+        utility,       # float input shape=[nodes]
+        probability,   # float input shape=[nodes]
+        adjoint,       # float scratch shape=[nodes]
+        d_probability, # float scratch shape=[nodes]
+        gradient,      # float scratch shape=[n_params]
+        bhhh,          # float output shape=[n_params, n_params]
+        d_loglike,     # float output shape=[n_params]
+):
+    """
+    Compute the gradient and BHHH of one cross-nested case.
+
+    This is the counterpart of `_numba_sparse_d_loglike` for networks
+    where nodes can have more than one parent.  The derivative of the log
+    probability of each chosen alternative is first carried back up
+    through every edge of the probability calculation, which gives the
+    explicit derivatives for the mu and allocation parameters and the
+    adjoint of each node utility, and then the adjoint is pushed back
+    down through the logsums, parents before children.
+    """
+    n_alts = array_ca.shape[0]
+    upslots = edgeslots[:, 0]
+    dnslots = edgeslots[:, 1]
+    allocslot = edgeslots[:, 3]
+    n_params = parameter_arr.size
+
+    d_loglike[:] = 0.0
+    if return_bhhh:
+        bhhh[:, :] = 0.0
+
+    for a in range(n_alts):
+        this_ch = array_ch[a]
+        if this_ch == 0 or not probability[a] > 0:
+            continue
+        adjoint[:] = 0.0
+        d_probability[:] = 0.0
+        gradient[:] = 0.0
+        d_probability[a] = 1.0 / probability[a]
+
+        # back through the probabilities, children before parents
+        for s in range(upslots.size):
+            dn = dnslots[s]
+            if d_probability[dn] == 0 or not array_av[dn]:
+                continue
+            up = upslots[s]
+            mu_slot = mu_slots[up - n_alts]
+            if mu_slot < 0:
+                mu_up = 1.0
+            else:
+                mu_up = parameter_arr[mu_slot]
+            alpha = _edge_alpha(allocslot[s], parameter_arr)
+            cond_prob = _edge_conditional_probability(alpha, mu_up, utility[dn], utility[up])
+            if cond_prob == 0:
+                continue
+            d_probability[up] += d_probability[dn] * cond_prob
+            if not mu_up:
+                continue
+            _temp = d_probability[dn] * probability[up] * cond_prob / mu_up
+            adjoint[dn] += _temp
+            adjoint[up] -= _temp
+            if mu_slot >= 0:
+                gradient[mu_slot] -= _temp * (np.log(alpha) + utility[dn] - utility[up]) / mu_up
+            if allocslot[s] >= 0:
+                gradient[allocslot[s]] += _temp / alpha
+
+        # push the adjoint down through the logsums, parents before children
+        for s in range(upslots.size - 1, -1, -1):
+            dn = dnslots[s]
+            up = upslots[s]
+            if adjoint[up] == 0 or not array_av[dn]:
+                continue
+            mu_slot = mu_slots[up - n_alts]
+            if mu_slot < 0:
+                mu_up = 1.0
+            else:
+                mu_up = parameter_arr[mu_slot]
+            alpha = _edge_alpha(allocslot[s], parameter_arr)
+            cond_prob = _edge_conditional_probability(alpha, mu_up, utility[dn], utility[up])
+            adjoint[dn] += adjoint[up] * cond_prob
+            if allocslot[s] >= 0 and mu_up and cond_prob:
+                gradient[allocslot[s]] += adjoint[up] * cond_prob / alpha
+
+        # logsum derivatives with respect to each nest's own mu
+        for up in range(n_alts, utility.size):
+            up_nest = up - n_alts
+            mu_slot = mu_slots[up_nest]
+            if mu_slot < 0 or adjoint[up] == 0:
+                continue
+            mu_up = parameter_arr[mu_slot]
+            if not mu_up:
+                continue
+            _temp = utility[up]
+            for n in range(len_slots[up_nest]):
+                edge = start_slots[up_nest] + n
+                dn = dnslots[edge]
+                if array_av[dn]:
+                    alpha = _edge_alpha(allocslot[edge], parameter_arr)
+                    cond_prob = _edge_conditional_probability(alpha, mu_up, utility[dn], utility[up])
+                    if cond_prob:
+                        _temp -= cond_prob * (np.log(alpha) + utility[dn])
+            gradient[mu_slot] += adjoint[up] * _temp / mu_up
+
+        _scatter_elemental_gradient(
+            model_q_ca_param_scale,
+            model_q_ca_param,
+            model_q_ca_data,
+            model_q_scale_param,
+            model_utility_ca_param_scale,
+            model_utility_ca_param,
+            model_utility_ca_data,
+            model_utility_co_alt,
+            model_utility_co_param_scale,
+            model_utility_co_param,
+            model_utility_co_data,
+            holdfast_arr,
+            parameter_arr,
+            array_av,
+            array_co,
+            array_ca,
+            array_ce_data,
+            array_ce_indices,
+            array_ce_ptr,
+            adjoint,
+            gradient,
+        )
+
+        weight = this_ch * array_wt[0]
+        for i in range(n_params):
+            d_loglike[i] += gradient[i] * weight
+        if return_bhhh:
+            for i in range(n_params):
+                _temp = gradient[i] * weight
+                if _temp:
+                    for j in range(n_params):
+                        bhhh[i, j] += _temp * gradient[j]
+
+
 _master_shape_signature = (
     '(qca),(qca),(qca),(), '
     '(uca),(uca),(uca), '
@@ -513,7 +988,96 @@ _master_shape_signature = (
 )
 
 
-def _numba_master(
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _numba_elemental_utility(
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input scalar
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        holdfast_arr,      # int8 input shape=[n_params]
+        parameter_arr,     # float input shape=[n_params]
+        array_av,          # int8 input shape=[nodes]
+        array_co,          # float input shape=[n_co_vars]
+        array_ca,          # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,     # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # int input shape=[n_casealts]
+        array_ce_ptr,      # int input shape=[2]
+        only_utility,      # int8 input
+        dutility,          # float scratch shape=[nodes or 0, n_params]
+        utility,           # float output shape=[nodes]
+):
+    """
+    Compute the utility of the elemental alternatives of one case from data.
+
+    All node utilities are reset first, so nest utilities are left at
+    zero, ready for the logsums.
+    """
+    n_alts = array_ca.shape[0]
+    utility[:] = 0.0
+    dutility[:, :] = 0.0
+
+    quantity_from_data_ca(
+        model_q_ca_param_scale,  # float input shape=[n_q_ca_features]
+        model_q_ca_param,        # int input shape=[n_q_ca_features]
+        model_q_ca_data,         # int input shape=[n_q_ca_features]
+        model_q_scale_param,     # int input scalar
+        parameter_arr,           # float input shape=[n_params]
+        holdfast_arr,            # float input shape=[n_params]
+        array_av,                # int8 input shape=[n_nodes]
+        array_ca,                # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,           # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,        # int input shape=[n_casealts]
+        array_ce_ptr,            # int input shape=[2]
+        utility[:n_alts],        # float output shape=[n_alts]
+        dutility[:n_alts],
+    )
+
+    if only_utility == 3:
+        if model_q_scale_param[0] >= 0:
+            scale_param_value = parameter_arr[model_q_scale_param[0]]
+        else:
+            scale_param_value = 1.0
+        utility[:n_alts] = np.exp(utility[:n_alts] / scale_param_value)
+        return
+
+    utility_from_data_ca(
+        model_utility_ca_param_scale,  # int input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        parameter_arr,                 # float input shape=[n_params]
+        holdfast_arr,                  # float input shape=[n_params]
+        array_av,                      # int8 input shape=[n_nodes]
+        array_ca,                      # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,                 # float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,              # int input shape=[n_casealts]
+        array_ce_ptr,                  # int input shape=[2]
+        utility[:n_alts],              # float output shape=[n_alts]
+        dutility[:n_alts],
+    )
+
+    utility_from_data_co(
+        model_utility_co_alt,          # int input shape=[n_co_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        parameter_arr,                 # float input shape=[n_params]
+        holdfast_arr,                  # float input shape=[n_params]
+        array_av,                      # int8 input shape=[n_nodes]
+        array_co,                      # float input shape=[n_co_vars]
+        utility[:n_alts],              # float output shape=[n_alts]
+        dutility[:n_alts],
+    )
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _numba_master_case(
         model_q_ca_param_scale,  # [0] float input shape=[n_q_ca_features]
         model_q_ca_param,        # [1] int input shape=[n_q_ca_features]
         model_q_ca_data,         # [2] int input shape=[n_q_ca_features]
@@ -553,6 +1117,10 @@ def _numba_master(
         # return_grad,         # [21] bool input
         # return_bhhh,         # [22] bool input
 
+        dutility,      # float scratch shape=[nodes or 0, n_params]
+        adjoint,       # float scratch shape=[nodes]
+        gradient,      # float scratch shape=[n_params]
+
         utility,       # [23] float output shape=[nodes]
         logprob,       # [24] float output shape=[nodes]
         probability,   # [25] float output shape=[nodes]
@@ -560,6 +1128,21 @@ def _numba_master(
         d_loglike,     # [27] float output shape=[n_params]
         loglike,       # [28] float output shape=[]
 ):
+    """
+    Evaluate one case.
+
+    When `dutility` has a row for every node, the gradient and BHHH are
+    found by forward propagation of the dense derivatives of every
+    node utility.  When it has no rows, they are instead found by
+    `_numba_sparse_d_loglike`, which only visits the parameters that
+    actually appear in each utility function, using the `adjoint` and
+    `gradient` scratch arrays.  No arrays are allocated here.
+
+    An `only_utility` flag of 4 signals that `utility` still holds the
+    elemental utilities of this case from a previous evaluation, and that
+    none of the parameters they depend on have changed since, so only
+    the nesting structure is recomputed.
+    """
     n_alts = array_ca.shape[0]
 
     # assert edgeslots.shape[1] == 4
@@ -574,62 +1157,37 @@ def _numba_master(
     # return_grad = return_flags[2]           # bool input
     # return_bhhh = return_flags[3]           # bool input
 
-    utility[:] = 0.0
-    dutility = np.zeros((utility.size, parameter_arr.size), dtype=utility.dtype)
-
-    quantity_from_data_ca(
-        model_q_ca_param_scale,  # float input shape=[n_q_ca_features]
-        model_q_ca_param,        # int input shape=[n_q_ca_features]
-        model_q_ca_data,         # int input shape=[n_q_ca_features]
-        model_q_scale_param,     # int input scalar
-        parameter_arr,           # float input shape=[n_params]
-        holdfast_arr,            # float input shape=[n_params]
-        array_av,                # int8 input shape=[n_nodes]
-        array_ca,                # float input shape=[n_alts, n_ca_vars]
-        array_ce_data,           # float input shape=[n_casealts, n_ca_vars]
-        array_ce_indices,        # int input shape=[n_casealts]
-        array_ce_ptr,            # int input shape=[2]
-        utility[:n_alts],        # float output shape=[n_alts]
-        dutility[:n_alts],
-    )
-
-    if only_utility == 3:
-        if model_q_scale_param[0] >= 0:
-            scale_param_value = parameter_arr[model_q_scale_param[0]]
-        else:
-            scale_param_value = 1.0
-        utility[:n_alts] = np.exp(utility[:n_alts] / scale_param_value)
-        return
-
-    utility_from_data_ca(
-        model_utility_ca_param_scale,  # int input shape=[n_u_ca_features]
-        model_utility_ca_param,        # int input shape=[n_u_ca_features]
-        model_utility_ca_data,         # int input shape=[n_u_ca_features]
-        parameter_arr,                 # float input shape=[n_params]
-        holdfast_arr,                  # float input shape=[n_params]
-        array_av,                      # int8 input shape=[n_nodes]
-        array_ca,                      # float input shape=[n_alts, n_ca_vars]
-        array_ce_data,                 # float input shape=[n_casealts, n_ca_vars]
-        array_ce_indices,              # int input shape=[n_casealts]
-        array_ce_ptr,                  # int input shape=[2]
-        utility[:n_alts],              # float output shape=[n_alts]
-        dutility[:n_alts],
-    )
-
-    utility_from_data_co(
-        model_utility_co_alt,          # int input shape=[n_co_features]
-        model_utility_co_param_scale,  # float input shape=[n_co_features]
-        model_utility_co_param,        # int input shape=[n_co_features]
-        model_utility_co_data,         # int input shape=[n_co_features]
-        parameter_arr,                 # float input shape=[n_params]
-        holdfast_arr,                  # float input shape=[n_params]
-        array_av,                      # int8 input shape=[n_nodes]
-        array_co,                      # float input shape=[n_co_vars]
-        utility[:n_alts],              # float output shape=[n_alts]
-        dutility[:n_alts],
-    )
-
-    if only_utility == 1: return
+    if only_utility == 4 and dutility.shape[0] == 0:
+        # the elemental utilities already in `utility` are reused, as
+        # only parameters of the nesting structure have changed
+        utility[n_alts:] = 0.0
+    else:
+        _numba_elemental_utility(
+            model_q_ca_param_scale,
+            model_q_ca_param,
+            model_q_ca_data,
+            model_q_scale_param,
+            model_utility_ca_param_scale,
+            model_utility_ca_param,
+            model_utility_ca_data,
+            model_utility_co_alt,
+            model_utility_co_param_scale,
+            model_utility_co_param,
+            model_utility_co_data,
+            holdfast_arr,
+            parameter_arr,
+            array_av,
+            array_co,
+            array_ca,
+            array_ce_data,
+            array_ce_indices,
+            array_ce_ptr,
+            only_utility,
+            dutility,
+            utility,
+        )
+        if only_utility == 1 or only_utility == 3:
+            return
 
     _numba_utility_to_loglike(
         n_alts,
@@ -652,18 +1210,729 @@ def _numba_master(
         loglike,        # float output shape=[]
     )
 
+    if (return_flags[2] or return_flags[3]) and dutility.shape[0] == 0 and _is_cross_nested(edgeslots):
+        # logprob serves as scratch here, and is restored afterwards
+        _numba_sparse_d_loglike_cnl(
+            model_q_ca_param_scale,
+            model_q_ca_param,
+            model_q_ca_data,
+            model_q_scale_param,
+            model_utility_ca_param_scale,
+            model_utility_ca_param,
+            model_utility_ca_data,
+            model_utility_co_alt,
+            model_utility_co_param_scale,
+            model_utility_co_param,
+            model_utility_co_data,
+            edgeslots,
+            mu_slots,
+            start_slots,
+            len_slots,
+            holdfast_arr,
+            parameter_arr,
+            array_ch,
+            array_av,
+            array_wt,
+            array_co,
+            array_ca,
+            array_ce_data,
+            array_ce_indices,
+            array_ce_ptr,
+            return_flags[3],
+            utility,
+            probability,
+            adjoint,
+            logprob,
+            gradient,
+            bhhh,
+            d_loglike,
+        )
+        for i in range(logprob.size):
+            if probability[i] > 0:
+                logprob[i] = np.log(probability[i])
+            else:
+                logprob[i] = -np.inf
+    elif (return_flags[2] or return_flags[3]) and dutility.shape[0] == 0:
+        # logprob now holds the conditional probability of each node
+        _numba_sparse_d_loglike(
+            model_q_ca_param_scale,
+            model_q_ca_param,
+            model_q_ca_data,
+            model_q_scale_param,
+            model_utility_ca_param_scale,
+            model_utility_ca_param,
+            model_utility_ca_data,
+            model_utility_co_alt,
+            model_utility_co_param_scale,
+            model_utility_co_param,
+            model_utility_co_data,
+            edgeslots,
+            mu_slots,
+            start_slots,
+            len_slots,
+            holdfast_arr,
+            parameter_arr,
+            array_ch,
+            array_av,
+            array_wt,
+            array_co,
+            array_ca,
+            array_ce_data,
+            array_ce_indices,
+            array_ce_ptr,
+            return_flags[3],
+            utility,
+            logprob,
+            probability,
+            adjoint,
+            gradient,
+            bhhh,
+            d_loglike,
+        )
+
+
+def _numba_master(
+        model_q_ca_param_scale,  # [0] float input shape=[n_q_ca_features]
+        model_q_ca_param,        # [1] int input shape=[n_q_ca_features]
+        model_q_ca_data,         # [2] int input shape=[n_q_ca_features]
+        model_q_scale_param,     # [3] int input scalar
+
+        model_utility_ca_param_scale,  # [4] float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # [5] int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # [6] int input shape=[n_u_ca_features]
+
+        model_utility_co_alt,          # [ 7] int input shape=[n_co_features]
+        model_utility_co_param_scale,  # [ 8] float input shape=[n_co_features]
+        model_utility_co_param,        # [ 9] int input shape=[n_co_features]
+        model_utility_co_data,         # [10] int input shape=[n_co_features]
+
+        edgeslots,     # [11] int input shape=[edges, 4]
+
+        mu_slots,      # [12] int input shape=[nests]
+        start_slots,   # [13] int input shape=[nests]
+        len_slots,     # [14] int input shape=[nests]
+
+        holdfast_arr,  # [15] int8 input shape=[n_params]
+        parameter_arr, # [16] float input shape=[n_params]
+
+        array_ch,      # [17] float input shape=[nodes]
+        array_av,      # [18] int8 input shape=[nodes]
+        array_wt,      # [19] float input shape=[]
+        array_co,      # [20] float input shape=[n_co_vars]
+        array_ca,      # [21] float input shape=[n_alts, n_ca_vars]
+
+        array_ce_data,     # [22] float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # [23] int input shape=[n_casealts]
+        array_ce_ptr,      # [24] int input shape=[2]
+
+        return_flags,
+        # only_utility,        # [19] int8 input
+        # return_probability,  # [20] bool input
+        # return_grad,         # [21] bool input
+        # return_bhhh,         # [22] bool input
+
+        utility,       # [23] float output shape=[nodes]
+        logprob,       # [24] float output shape=[nodes]
+        probability,   # [25] float output shape=[nodes]
+        bhhh,          # [26] float output shape=[n_params, n_params]
+        d_loglike,     # [27] float output shape=[n_params]
+        loglike,       # [28] float output shape=[]
+):
+    n_params = parameter_arr.size
+    _numba_master_case(
+        model_q_ca_param_scale,
+        model_q_ca_param,
+        model_q_ca_data,
+        model_q_scale_param,
+        model_utility_ca_param_scale,
+        model_utility_ca_param,
+        model_utility_ca_data,
+        model_utility_co_alt,
+        model_utility_co_param_scale,
+        model_utility_co_param,
+        model_utility_co_data,
+        edgeslots,
+        mu_slots,
+        start_slots,
+        len_slots,
+        holdfast_arr,
+        parameter_arr,
+        array_ch,
+        array_av,
+        array_wt,
+        array_co,
+        array_ca,
+        array_ce_data,
+        array_ce_indices,
+        array_ce_ptr,
+        return_flags,
+        np.zeros((0, n_params), dtype=d_loglike.dtype),
+        np.zeros(utility.size, dtype=d_loglike.dtype),
+        np.zeros(n_params, dtype=d_loglike.dtype),
+        utility,
+        logprob,
+        probability,
+        bhhh,
+        d_loglike,
+        loglike,
+    )
+
+
+_numba_master_vectorized = guvectorize(
+    _type_signatures("fiii fii ifii I iii bf fbffF Fij b fffFff"),
+    _master_shape_signature,
+    nopython=True,
+    fastmath=True,
+    target='parallel',
+    cache=True,
+)(
+    _numba_master,
+)
+
+
+@njit(error_model='numpy', fastmath=True, cache=True, parallel=True, nogil=True)
+def _numba_master_reduce(
+        model_q_ca_param_scale,  # [0] float input shape=[n_q_ca_features]
+        model_q_ca_param,        # [1] int input shape=[n_q_ca_features]
+        model_q_ca_data,         # [2] int input shape=[n_q_ca_features]
+        model_q_scale_param,     # [3] int input scalar
+
+        model_utility_ca_param_scale,  # [4] float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # [5] int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # [6] int input shape=[n_u_ca_features]
+
+        model_utility_co_alt,          # [ 7] int input shape=[n_co_features]
+        model_utility_co_param_scale,  # [ 8] float input shape=[n_co_features]
+        model_utility_co_param,        # [ 9] int input shape=[n_co_features]
+        model_utility_co_data,         # [10] int input shape=[n_co_features]
+
+        edgeslots,     # [11] int input shape=[edges, 4]
+
+        mu_slots,      # [12] int input shape=[nests]
+        start_slots,   # [13] int input shape=[nests]
+        len_slots,     # [14] int input shape=[nests]
+
+        holdfast_arr,  # [15] int8 input shape=[n_params]
+        parameter_arr, # [16] float input shape=[n_params]
+
+        array_ch,      # [17] float input shape=[n_cases, nodes]
+        array_av,      # [18] int8 input shape=[n_cases, nodes]
+        array_wt,      # [19] float input shape=[n_cases]
+        array_co,      # [20] float input shape=[n_cases, n_co_vars]
+        array_ca,      # [21] float input shape=[n_cases, n_alts, n_ca_vars]
+
+        array_ce_data,     # [22] float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # [23] int input shape=[n_casealts]
+        array_ce_ptr,      # [24] int input shape=[n_cases, 2]
+
+        return_flags,  # [25] int8 input shape=[4]
+        d_penalty,     # [26] float input shape=[n_params] or [0]
+        n_blocks,      # [27] int input scalar
+
+        utility,             # float output shape=[n_cases or 0, nodes]
+        logprob,             # float output shape=[n_cases or 0, nodes]
+        probability,         # float output shape=[n_cases or 0, nodes]
+        casewise_d_loglike,  # float output shape=[n_cases or 0, n_params]
+        casewise_loglike,    # float output shape=[n_cases or 0]
+        bhhh,                # float output shape=[n_params, n_params]
+        d_loglike,           # float output shape=[n_params]
+        loglike,             # float output shape=[1]
+):
+    """
+    Evaluate all cases, reducing loglike, gradient and BHHH in the kernel.
+
+    Cases are split into `n_blocks` contiguous blocks which are processed
+    in parallel, each accumulating into its own partial sums, so the peak
+    memory is O(n_blocks * n_params**2) instead of O(n_cases * n_params**2).
+    Casewise node arrays and casewise loglike values are written only when
+    the corresponding output arrays have a non-zero leading dimension.
+    The loglike, gradient and BHHH are accumulated in the dtype of their
+    output arrays, which may be wider than the dtype of the data.
+    """
+    n_cases = array_ch.shape[0]
+    n_nodes = array_ch.shape[1]
+    n_params = parameter_arr.shape[0]
+    return_grad = return_flags[2]
+    return_bhhh = return_flags[3]
+    keep_nodes = utility.shape[0] > 0
+    keep_casewise = casewise_loglike.shape[0] > 0
+    use_penalty = d_penalty.shape[0] > 0
+    block_size = (n_cases + n_blocks - 1) // n_blocks
+
+    partial_bhhh = np.zeros((n_blocks, n_params, n_params), dtype=bhhh.dtype)
+    partial_d_loglike = np.zeros((n_blocks, n_params), dtype=d_loglike.dtype)
+    partial_loglike = np.zeros(n_blocks, dtype=loglike.dtype)
+
+    for b in prange(n_blocks):
+        utility_scratch = np.zeros(n_nodes, dtype=utility.dtype)
+        logprob_scratch = np.zeros(n_nodes, dtype=logprob.dtype)
+        probability_scratch = np.zeros(n_nodes, dtype=probability.dtype)
+        case_bhhh = np.zeros((n_params, n_params), dtype=bhhh.dtype)
+        case_d_loglike = np.zeros(n_params, dtype=d_loglike.dtype)
+        case_loglike = np.zeros(1, dtype=loglike.dtype)
+        case_dutility = np.zeros((0, n_params), dtype=d_loglike.dtype)
+        case_adjoint = np.zeros(n_nodes, dtype=d_loglike.dtype)
+        case_gradient = np.zeros(n_params, dtype=d_loglike.dtype)
+        case_stop = min((b + 1) * block_size, n_cases)
+        for c in range(b * block_size, case_stop):
+            if keep_nodes:
+                u = utility[c]
+                lp = logprob[c]
+                pr = probability[c]
+            else:
+                u = utility_scratch
+                lp = logprob_scratch
+                pr = probability_scratch
+            _numba_master_case(
+                model_q_ca_param_scale,
+                model_q_ca_param,
+                model_q_ca_data,
+                model_q_scale_param,
+                model_utility_ca_param_scale,
+                model_utility_ca_param,
+                model_utility_ca_data,
+                model_utility_co_alt,
+                model_utility_co_param_scale,
+                model_utility_co_param,
+                model_utility_co_data,
+                edgeslots,
+                mu_slots,
+                start_slots,
+                len_slots,
+                holdfast_arr,
+                parameter_arr,
+                array_ch[c],
+                array_av[c],
+                array_wt[c:c + 1],
+                array_co[c],
+                array_ca[c],
+                array_ce_data,
+                array_ce_indices,
+                array_ce_ptr[c],
+                return_flags,
+                case_dutility,
+                case_adjoint,
+                case_gradient,
+                u,
+                lp,
+                pr,
+                case_bhhh,
+                case_d_loglike,
+                case_loglike,
+            )
+            partial_loglike[b] += case_loglike[0]
+            if keep_casewise:
+                casewise_loglike[c] = case_loglike[0]
+            if return_grad or return_bhhh:
+                if keep_casewise:
+                    casewise_d_loglike[c, :] = case_d_loglike
+                partial_d_loglike[b, :] += case_d_loglike
+                if return_bhhh:
+                    if use_penalty:
+                        # match the casewise outer product of the penalized gradient
+                        for i in range(n_params):
+                            g_i = case_d_loglike[i] + d_penalty[i]
+                            for j in range(n_params):
+                                partial_bhhh[b, i, j] += g_i * (case_d_loglike[j] + d_penalty[j])
+                    else:
+                        partial_bhhh[b, :, :] += case_bhhh
+
+    loglike[0] = 0.0
+    d_loglike[:] = 0.0
+    bhhh[:, :] = 0.0
+    for b in range(n_blocks):
+        loglike[0] += partial_loglike[b]
+        d_loglike[:] += partial_d_loglike[b]
+        bhhh[:, :] += partial_bhhh[b]
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _quantity_term(
+        i,                              # int input scalar
+        alt_index,                      # int input scalar
+        row,                            # int input scalar, ce row or -1
+        model_q_ca_param_scale,         # float input shape=[n_q_ca_features]
+        model_q_ca_param,               # int input shape=[n_q_ca_features]
+        model_q_ca_data,                # int input shape=[n_q_ca_features]
+        parameter_arr,                  # float input shape=[n_params]
+        array_ca,                       # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,                  # float input shape=[n_casealts, n_ca_vars]
+):
+    if row >= 0:
+        x = array_ce_data[row, model_q_ca_data[i]]
+    else:
+        x = array_ca[alt_index, model_q_ca_data[i]]
+    return x * model_q_ca_param_scale[i] * np.exp(parameter_arr[model_q_ca_param[i]])
+
 
+@njit(error_model='numpy', fastmath=True, cache=True)
+def quantity_d2_from_data_ca(
+        alt_index,                      # int input scalar
+        row,                            # int input scalar, ce row or -1
+        model_q_ca_param_scale,         # float input shape=[n_q_ca_features]
+        model_q_ca_param,               # int input shape=[n_q_ca_features]
+        model_q_ca_data,                # int input shape=[n_q_ca_features]
+        model_q_scale_param,            # int input scalar
+        parameter_arr,                  # float input shape=[n_params]
+        array_ca,                       # float input shape=[n_alts, n_ca_vars]
+        array_ce_data,                  # float input shape=[n_casealts, n_ca_vars]
+        d2utility_elem,                 # float output shape=[n_params, n_params]
+):
+    # second derivative of theta * log(sum_i x_i * scale_i * exp(gamma_i))
+    d2utility_elem[:, :] = 0.0
+    n_q = model_q_ca_param.shape[0]
+    if model_q_scale_param[0] >= 0:
+        scale_param_value = parameter_arr[model_q_scale_param[0]]
+    else:
+        scale_param_value = 1.0
+    total = 0.0
+    for i in range(n_q):
+        total += _quantity_term(
+            i, alt_index, row, model_q_ca_param_scale, model_q_ca_param,
+            model_q_ca_data, parameter_arr, array_ca, array_ce_data,
+        )
+    if not total > 0:
+        return
+    for a in range(n_q):
+        share_a = _quantity_term(
+            a, alt_index, row, model_q_ca_param_scale, model_q_ca_param,
+            model_q_ca_data, parameter_arr, array_ca, array_ce_data,
+        ) / total
+        pa = model_q_ca_param[a]
+        d2utility_elem[pa, pa] += scale_param_value * share_a
+        for b in range(n_q):
+            share_b = _quantity_term(
+                b, alt_index, row, model_q_ca_param_scale, model_q_ca_param,
+                model_q_ca_data, parameter_arr, array_ca, array_ce_data,
+            ) / total
+            d2utility_elem[pa, model_q_ca_param[b]] -= scale_param_value * share_a * share_b
+        if model_q_scale_param[0] >= 0:
+            d2utility_elem[model_q_scale_param[0], pa] += share_a
+            d2utility_elem[pa, model_q_scale_param[0]] += share_a
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _numba_utility_to_d2_loglike(
+        n_alts,
+        edgeslots,     # int input shape=[edges, 4]
+        mu_slots,      # int input shape=[nests]
+        start_slots,   # int input shape=[nests]
+        len_slots,     # int input shape=[nests]
+        parameter_arr, # float input shape=[n_params]
+        array_ch,      # float input shape=[nodes]
+        array_wt,      # float input shape=[]
+        utility,       # float input shape=[nodes]
+        dutility,      # float input shape=[nodes, n_params], complete for nests
+        d2utility,     # float scratch shape=[nests, n_params, n_params]
+        d2_alt,        # float scratch shape=[n_alts or 0, n_params, n_params]
+        dz,            # float scratch shape=[n_params]
+        dz_bar,        # float scratch shape=[n_params]
+        d2_loglike,    # float output shape=[n_params, n_params], accumulated
+):
+    """
+    Accumulate the analytic Hessian of the log likelihood for one case.
+
+    For each nest with mu `m`, the logsum `V = m * log(sum_k exp(V_k / m))`
+    has second derivative `m * d2L + dL e_m' + e_m dL'`, where `dL` and
+    `d2L` are the mean and the mean plus covariance (under the conditional
+    probabilities) of the derivatives of `V_k / m`.  The loglike is the
+    sum over chosen edges of `(V_dn - V_up) / m_up`, differentiated twice
+    the same way.  Elemental utilities are linear in the parameters unless
+    `d2_alt` holds their quantity term second derivatives.
+    """
+    upslots = edgeslots[:, 0]
+    dnslots = edgeslots[:, 1]
+    n_params = parameter_arr.size
+    has_d2_alt = d2_alt.shape[0] > 0
+
+    # second derivative of nest utility, children before parents
+    for up in range(n_alts, utility.size):
+        up_nest = up - n_alts
+        d2_up = d2utility[up_nest]
+        d2_up[:, :] = 0.0
+        mu_slot = mu_slots[up_nest]
+        if mu_slot < 0:
+            mu_up = 1.0
+        else:
+            mu_up = parameter_arr[mu_slot]
+        if not mu_up or not utility[up] > -np.inf:
+            continue
+        dz_bar[:] = 0.0
+        for n in range(len_slots[up_nest]):
+            dn = dnslots[start_slots[up_nest] + n]
+            if utility[dn] > -np.inf:
+                cond_prob = np.exp((utility[dn] - utility[up]) / mu_up)
+                for p in range(n_params):
+                    dz_bar[p] += cond_prob * dutility[dn, p] / mu_up
+                if mu_slot >= 0:
+                    dz_bar[mu_slot] -= cond_prob * utility[dn] / mu_up ** 2
+        for n in range(len_slots[up_nest]):
+            dn = dnslots[start_slots[up_nest] + n]
+            if not utility[dn] > -np.inf:
+                continue
+            cond_prob = np.exp((utility[dn] - utility[up]) / mu_up)
+            for p in range(n_params):
+                dz[p] = dutility[dn, p] / mu_up
+            if mu_slot >= 0:
+                dz[mu_slot] -= utility[dn] / mu_up ** 2
+            if dn >= n_alts:
+                d2_up += d2utility[dn - n_alts] * (cond_prob / mu_up)
+            elif has_d2_alt:
+                d2_up += d2_alt[dn] * (cond_prob / mu_up)
+            if mu_slot >= 0:
+                for p in range(n_params):
+                    _temp = cond_prob * dutility[dn, p] / mu_up ** 2
+                    d2_up[p, mu_slot] -= _temp
+                    d2_up[mu_slot, p] -= _temp
+                d2_up[mu_slot, mu_slot] += 2 * cond_prob * utility[dn] / mu_up ** 3
+            for p in range(n_params):
+                _temp = cond_prob * (dz[p] - dz_bar[p])
+                if _temp:
+                    for r in range(n_params):
+                        d2_up[p, r] += _temp * (dz[r] - dz_bar[r])
+        d2_up *= mu_up
+        if mu_slot >= 0:
+            for p in range(n_params):
+                d2_up[p, mu_slot] += dz_bar[p]
+                d2_up[mu_slot, p] += dz_bar[p]
+
+    # second derivative of loglike
+    for s in range(upslots.size):
+        dn = dnslots[s]
+        if not array_ch[dn] or not utility[dn] > -np.inf:
+            continue
+        up = upslots[s]
+        mu_slot = mu_slots[up - n_alts]
+        if mu_slot < 0:
+            mu_up = 1.0
+        else:
+            mu_up = parameter_arr[mu_slot]
+        if not mu_up:
+            continue
+        w = array_ch[dn] * array_wt[0]
+        if dn >= n_alts:
+            d2_loglike += d2utility[dn - n_alts] * (w / mu_up)
+        elif has_d2_alt:
+            d2_loglike += d2_alt[dn] * (w / mu_up)
+        d2_loglike -= d2utility[up - n_alts] * (w / mu_up)
+        if mu_slot >= 0:
+            for p in range(n_params):
+                _temp = w * (dutility[dn, p] - dutility[up, p]) / mu_up ** 2
+                d2_loglike[p, mu_slot] -= _temp
+                d2_loglike[mu_slot, p] -= _temp
+            d2_loglike[mu_slot, mu_slot] += 2 * w * (utility[dn] - utility[up]) / mu_up ** 3
+
+
+@njit(error_model='numpy', fastmath=True, cache=True, parallel=True, nogil=True)
+def _numba_master_d2_reduce(
+        model_q_ca_param_scale,  # [0] float input shape=[n_q_ca_features]
+        model_q_ca_param,        # [1] int input shape=[n_q_ca_features]
+        model_q_ca_data,         # [2] int input shape=[n_q_ca_features]
+        model_q_scale_param,     # [3] int input scalar
+
+        model_utility_ca_param_scale,  # [4] float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # [5] int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # [6] int input shape=[n_u_ca_features]
+
+        model_utility_co_alt,          # [ 7] int input shape=[n_co_features]
+        model_utility_co_param_scale,  # [ 8] float input shape=[n_co_features]
+        model_utility_co_param,        # [ 9] int input shape=[n_co_features]
+        model_utility_co_data,         # [10] int input shape=[n_co_features]
+
+        edgeslots,     # [11] int input shape=[edges, 4]
+
+        mu_slots,      # [12] int input shape=[nests]
+        start_slots,   # [13] int input shape=[nests]
+        len_slots,     # [14] int input shape=[nests]
+
+        holdfast_arr,  # [15] int8 input shape=[n_params]
+        parameter_arr, # [16] float input shape=[n_params]
+
+        array_ch,      # [17] float input shape=[n_cases, nodes]
+        array_av,      # [18] int8 input shape=[n_cases, nodes]
+        array_wt,      # [19] float input shape=[n_cases]
+        array_co,      # [20] float input shape=[n_cases, n_co_vars]
+        array_ca,      # [21] float input shape=[n_cases, n_alts, n_ca_vars]
+
+        array_ce_data,     # [22] float input shape=[n_casealts, n_ca_vars]
+        array_ce_indices,  # [23] int input shape=[n_casealts]
+        array_ce_ptr,      # [24] int input shape=[n_cases, 2]
+
+        n_blocks,      # [25] int input scalar
+
+        d2_loglike,    # float output shape=[n_params, n_params]
+        d_loglike,     # float output shape=[n_params]
+        loglike,       # float output shape=[1]
+):
+    """
+    Evaluate the analytic Hessian of the log likelihood over all cases.
+
+    Each case is evaluated once: utilities and their first derivatives come
+    from the same routines used by `_numba_master`, and the second
+    derivatives are accumulated from them by `_numba_utility_to_d2_loglike`.
+    Cases are split into `n_blocks` blocks processed in parallel, each with
+    its own partial sums.
+    """
+    n_cases = array_ch.shape[0]
+    n_nodes = array_ch.shape[1]
+    n_alts = array_ca.shape[1]
+    n_nests = n_nodes - n_alts
+    n_params = parameter_arr.shape[0]
+    has_quantity = model_q_ca_param.shape[0] > 0
+    use_ce = array_ce_data.shape[0] > 0
+    block_size = (n_cases + n_blocks - 1) // n_blocks
+    return_flags = np.zeros(4, dtype=np.int8)
+    return_flags[2] = 1  # return_grad, which completes dutility for nests
+
+    partial_d2_loglike = np.zeros((n_blocks, n_params, n_params), dtype=d2_loglike.dtype)
+    partial_d_loglike = np.zeros((n_blocks, n_params), dtype=d_loglike.dtype)
+    partial_loglike = np.zeros(n_blocks, dtype=loglike.dtype)
+
+    for b in prange(n_blocks):
+        utility = np.zeros(n_nodes, dtype=parameter_arr.dtype)
+        logprob = np.zeros(n_nodes, dtype=parameter_arr.dtype)
+        probability = np.zeros(n_nodes, dtype=parameter_arr.dtype)
+        dutility = np.zeros((n_nodes, n_params), dtype=parameter_arr.dtype)
+        d2utility = np.zeros((n_nests, n_params, n_params), dtype=d2_loglike.dtype)
+        if has_quantity:
+            d2_alt = np.zeros((n_alts, n_params, n_params), dtype=d2_loglike.dtype)
+        else:
+            d2_alt = np.zeros((0, n_params, n_params), dtype=d2_loglike.dtype)
+        alt_row = np.full(n_alts, -1, dtype=np.int64)
+        dz = np.zeros(n_params, dtype=d2_loglike.dtype)
+        dz_bar = np.zeros(n_params, dtype=d2_loglike.dtype)
+        case_bhhh = np.zeros((n_params, n_params), dtype=d_loglike.dtype)
+        case_d_loglike = np.zeros(n_params, dtype=d_loglike.dtype)
+        case_loglike = np.zeros(1, dtype=loglike.dtype)
+        case_stop = min((b + 1) * block_size, n_cases)
+        for c in range(b * block_size, case_stop):
+            utility[:] = 0.0
+            dutility[:, :] = 0.0
+            quantity_from_data_ca(
+                model_q_ca_param_scale,
+                model_q_ca_param,
+                model_q_ca_data,
+                model_q_scale_param,
+                parameter_arr,
+                holdfast_arr,
+                array_av[c],
+                array_ca[c],
+                array_ce_data,
+                array_ce_indices,
+                array_ce_ptr[c],
+                utility[:n_alts],
+                dutility[:n_alts],
+            )
+            utility_from_data_ca(
+                model_utility_ca_param_scale,
+                model_utility_ca_param,
+                model_utility_ca_data,
+                parameter_arr,
+                holdfast_arr,
+                array_av[c],
+                array_ca[c],
+                array_ce_data,
+                array_ce_indices,
+                array_ce_ptr[c],
+                utility[:n_alts],
+                dutility[:n_alts],
+            )
+            utility_from_data_co(
+                model_utility_co_alt,
+                model_utility_co_param_scale,
+                model_utility_co_param,
+                model_utility_co_data,
+                parameter_arr,
+                holdfast_arr,
+                array_av[c],
+                array_co[c],
+                utility[:n_alts],
+                dutility[:n_alts],
+            )
+            _numba_utility_to_loglike(
+                n_alts,
+                edgeslots,
+                mu_slots,
+                start_slots,
+                len_slots,
+                holdfast_arr,
+                parameter_arr,
+                array_ch[c],
+                array_av[c],
+                array_wt[c:c + 1],
+                return_flags,
+                dutility,
+                utility,
+                logprob,
+                probability,
+                case_bhhh,
+                case_d_loglike,
+                case_loglike,
+            )
+            if has_quantity:
+                if use_ce:
+                    alt_row[:] = -1
+                    for row in range(array_ce_ptr[c, 0], array_ce_ptr[c, 1]):
+                        alt_row[array_ce_indices[row]] = row
+                for j in range(n_alts):
+                    if use_ce and alt_row[j] < 0:
+                        d2_alt[j, :, :] = 0.0
+                        continue
+                    quantity_d2_from_data_ca(
+                        j,
+                        alt_row[j],
+                        model_q_ca_param_scale,
+                        model_q_ca_param,
+                        model_q_ca_data,
+                        model_q_scale_param,
+                        parameter_arr,
+                        array_ca[c],
+                        array_ce_data,
+                        d2_alt[j],
+                    )
+            _numba_utility_to_d2_loglike(
+                n_alts,
+                edgeslots,
+                mu_slots,
+                start_slots,
+                len_slots,
+                parameter_arr,
+                array_ch[c],
+                array_wt[c:c + 1],
+                utility,
+                dutility,
+                d2utility,
+                d2_alt,
+                dz,
+                dz_bar,
+                partial_d2_loglike[b],
+            )
+            partial_loglike[b] += case_loglike[0]
+            partial_d_loglike[b, :] += case_d_loglike
 
-_numba_master_vectorized = guvectorize(
-    _type_signatures("fiii fii ifii I iii bf fbffF Fij b fffFff"),
-    _master_shape_signature,
-    nopython=True,
-    fastmath=True,
-    target='parallel',
-    cache=True,
-)(
-    _numba_master,
-)
+    loglike[0] = 0.0
+    d_loglike[:] = 0.0
+    d2_loglike[:, :] = 0.0
+    for b in range(n_blocks):
+        loglike[0] += partial_loglike[b]
+        d_loglike[:] += partial_d_loglike[b]
+        d2_loglike[:, :] += partial_d2_loglike[b]
+
+
+def _casewise_ce_ptr(args):
+    """
+    Give each case its own ce pointer row, for the njit reduction kernels.
+
+    DataFrames provide a single placeholder pointer shared by all cases,
+    which the guvectorized kernel broadcasts but the njit kernels cannot.
+    Likewise, a quantity scale parameter slot given as a scalar is made
+    into a one element array.
+    """
+    args = list(args)
+    args[3] = np.atleast_1d(np.asarray(args[3], dtype=np.int32))
+    if args[24].ndim == 1:
+        args[24] = np.zeros((args[17].shape[0], 2), dtype=np.int32)
+    return args
 
 
 @njit(cache=True)
@@ -895,11 +2164,35 @@ FixedArrays = namedtuple(
 )
 
 
+KernelArrays = namedtuple(
+    'KernelArrays',
+    FixedArrays._fields + DataArrays._fields,
+)
+KernelArrays.__doc__ = """
+The fixed and data arrays of a model, as given to other kernels.
+
+The fields are those of `FixedArrays` followed by those of `DataArrays`,
+i.e. the arguments of `_numba_master` without the holdfast and parameter
+arrays.
+"""
+
+
 class NumbaModel(_BaseModel):
 
     _null_slice = (None, None, None)
 
-    def __init__(self, *args, float_dtype=np.float64, datatree=None, **kwargs):
+    def __init__(
+            self,
+            *args,
+            float_dtype=np.float64,
+            datatree=None,
+            reduce_in_kernel=False,
+            chunk_size=None,
+            accumulate_dtype=None,
+            data_cache=None,
+            sparse_ce=False,
+            **kwargs,
+    ):
         for a in args:
             if datatree is None and isinstance(a, (DataTree, Dataset)):
                 datatree = a
@@ -909,13 +2202,26 @@ class NumbaModel(_BaseModel):
         self._data_arrays = None
         self.work_arrays = None
         self.float_dtype = float_dtype
+        self.accumulate_dtype = accumulate_dtype
+        self.reduce_in_kernel = reduce_in_kernel
+        self.chunk_size = chunk_size
         self.constraint_intensity = 0.0
         self.constraint_sharpness = 0.0
         self._constraint_funcs = None
+        self.reuse_utility = True
+        self._utility_cache = None
+        self.data_cache = data_cache
+        self.sparse_ce = sparse_ce
+        self.ce_work_arrays = None
+        self.shared_data = None
         self.datatree = datatree
 
     def mangle(self, *args, **kwargs):
         super().mangle(*args, **kwargs)
+        if getattr(self, '_dataset', None) is not None and getattr(self, '_dataset_origin', None) is not None:
+            # keep the loaded data around, so that reflowing after a change
+            # to the model specification only needs to load new terms
+            self._previous_dataset = (self._dataset_origin, self._dataset)
         self._dataset = None
         self._fixed_arrays = None
         self._data_arrays = None
@@ -1016,17 +2322,54 @@ class NumbaModel(_BaseModel):
         datatree = self.datatree
         if datatree is not None:
             from .data_arrays import prepare_data
+            origin = (datatree, np.dtype(self.float_dtype), self._sparse_ce_active)
+            previous = getattr(self, '_previous_dataset', None)
+            if previous is not None:
+                prev_origin, previous = previous
+                if prev_origin[0] is not datatree or prev_origin[1:] != origin[1:]:
+                    previous = None
+            self._previous_dataset = None
             self.dataset, self.dataflows = prepare_data(
                 datasource=datatree,
                 request=self,
                 float_dtype=self.float_dtype,
                 cache_dir=datatree.cache_dir,
                 flows=getattr(self, 'dataflows', None),
+                data_cache=getattr(self, 'data_cache', None),
+                sparse_ce=self._sparse_ce_active,
+                previous=previous,
             )
-            self._data_arrays = self.dataset.dc.to_arrays(
-                self.graph,
-                float_dtype=self.float_dtype,
-            )
+            self._dataset_origin = origin
+            if self.chunk_size:
+                # streamed from the dataset one chunk at a time
+                self._data_arrays = None
+            elif self._sparse_ce_active:
+                self._data_arrays = self.dataset.dc.to_sparse_arrays(
+                    float_dtype=self.float_dtype,
+                )
+            else:
+                self._data_arrays = self.dataset.dc.to_arrays(
+                    self.graph,
+                    float_dtype=self.float_dtype,
+                )
+            if self.work_arrays is not None:
+                self._rebuild_work_arrays()
+
+        elif getattr(self, 'shared_data', None) is not None:
+            from .shared_data import attach_dataset
+            self._dataset = attach_dataset(self.shared_data)
+            self._dataset_origin = None
+            if self.chunk_size:
+                self._data_arrays = None
+            elif self._sparse_ce_active:
+                self._data_arrays = self._dataset.dc.to_sparse_arrays(
+                    float_dtype=self.float_dtype,
+                )
+            else:
+                self._data_arrays = self._dataset.dc.to_arrays(
+                    self.graph,
+                    float_dtype=self.float_dtype,
+                )
             if self.work_arrays is not None:
                 self._rebuild_work_arrays()
 
@@ -1081,13 +2424,22 @@ class NumbaModel(_BaseModel):
             n_nodes = len(self.graph)
         if n_params is None:
             n_params = len(self._frame)
+        # when reducing in the kernel, only the totals of the gradient
+        # and BHHH matrix are stored, not the casewise values
+        n_cases_params = 1 if self._reduces_in_kernel else n_cases
+        if self.chunk_size or self._sparse_ce_active:
+            # streamed chunks and sparse idce data allocate their own
+            # casewise arrays on demand
+            n_cases = 0
         _need_to_rebuild_work_arrays = True
         if self.work_arrays is not None:
             if (
                     (self.work_arrays.utility.shape[0] == n_cases)
                     and (self.work_arrays.utility.shape[1] == n_nodes)
+                    and (self.work_arrays.d_loglike.shape[0] == n_cases_params)
                     and (self.work_arrays.d_loglike.shape[1] == n_params)
                     and (self.work_arrays.utility.dtype == self.float_dtype)
+                    and (self.work_arrays.d_loglike.dtype == self.accumulate_dtype)
             ):
                 _need_to_rebuild_work_arrays = False
         if _need_to_rebuild_work_arrays:
@@ -1096,9 +2448,9 @@ class NumbaModel(_BaseModel):
                 utility=np.zeros([n_cases, n_nodes], dtype=self.float_dtype),
                 logprob=np.zeros([n_cases, n_nodes], dtype=self.float_dtype),
                 probability=np.zeros([n_cases, n_nodes], dtype=self.float_dtype),
-                bhhh=np.zeros([n_cases, n_params, n_params], dtype=self.float_dtype),
-                d_loglike=np.zeros([n_cases, n_params], dtype=self.float_dtype),
-                loglike=np.zeros([n_cases], dtype=self.float_dtype),
+                bhhh=np.zeros([n_cases_params, n_params, n_params], dtype=self.accumulate_dtype),
+                d_loglike=np.zeros([n_cases_params, n_params], dtype=self.accumulate_dtype),
+                loglike=np.zeros([n_cases], dtype=self.accumulate_dtype),
             )
 
     def _rebuild_fixed_arrays(self):
@@ -1138,7 +2490,7 @@ class NumbaModel(_BaseModel):
                 model_utility_co_param,
                 model_utility_co_data,
 
-                np.stack(self.graph.edge_slot_arrays()).T,
+                self._edge_slot_arrays(),
                 node_slot_arrays[0][n_alts:],
                 node_slot_arrays[1][n_alts:],
                 node_slot_arrays[2][n_alts:],
@@ -1147,6 +2499,33 @@ class NumbaModel(_BaseModel):
             self._fixed_arrays = None
 
 
+    def _edge_slot_arrays(self):
+        """
+        Build the [edges, 4] array of edge slots for the numba kernels.
+
+        For cross-nested networks, the allocation of a node with more than
+        one parent is given by the parameter named in the 'alpha' attribute
+        of each incoming edge (e.g. ``m.graph.edges[nest, alt]['alpha'] =
+        'alpha_nest_alt'``), or is split equally across the parents when no
+        such attribute is given.
+        """
+        g = self.graph
+        alpha_locator = {}
+        for up, dn, alpha in g.edges(data='alpha'):
+            if alpha is not None:
+                alpha_locator[up, dn] = self.get_slot_x(str(alpha))
+            elif g.in_degree(dn) > 1:
+                alpha_locator[up, dn] = -g.in_degree(dn)
+        return np.stack(g.edge_slot_arrays(alpha_locator)).T
+
+    @property
+    def is_cross_nested(self):
+        """bool : Whether any node in the nesting graph has allocated edges."""
+        self.unmangle()
+        if self._fixed_arrays is None:
+            return False
+        return bool((self._fixed_arrays.edge_slots[:, 3] != -1).any())
+
     def unmangle(self, force=False):
         super().unmangle(force=force)
         if self._dataset is None or force:
@@ -1159,6 +2538,7 @@ class NumbaModel(_BaseModel):
 
     def _scan_logsums_ensure_names(self):
         nameset = set()
+        g = None
         try:
             g = self._graph
         except ValueError:
@@ -1175,6 +2555,11 @@ class NumbaModel(_BaseModel):
         if self.logsum_parameter is not None:
             nameset.add(str(self.logsum_parameter))
         self._ensure_names(nameset, nullvalue=1, initvalue=1, min=0.001, max=1)
+        if g is not None:
+            for up, dn, alpha in g.edges(data='alpha'):
+                if alpha is not None:
+                    share = 1.0 / g.in_degree(dn)
+                    self._ensure_names([str(alpha)], nullvalue=share, initvalue=share, min=0, max=1)
 
     def _ensure_names(self, names, **kwargs):
         from ..model.parameter_frame import _empty_parameter_frame
@@ -1196,11 +2581,12 @@ class NumbaModel(_BaseModel):
             allow_missing_ch=False,
             allow_missing_av=False,
             caseslice=None,
+            include_data=True,
     ):
         if caseslice is None:
             caseslice = slice(caseslice)
         missing_ch, missing_av = False, False
-        if self._dataframes is None and self.datatree is None:
+        if self._dataframes is None and self.datatree is None and self.shared_data is None:
             raise MissingDataError('dataframes and datatree are both not set, maybe you need to call `load_data` first?')
         if self._dataframes is not None and not self._dataframes.is_computational_ready(activate=True):
             raise ValueError('DataFrames is not computational-ready')
@@ -1229,10 +2615,27 @@ class NumbaModel(_BaseModel):
                 else:
                     raise MissingDataError('model.dataframes does not define data_av')
         elif self.dataset is not None:
-            if 'ch' not in self.dataset and not allow_missing_ch:
+            if 'ch' not in self.dataset and 'ch_ce' not in self.dataset and not allow_missing_ch:
                 raise MissingDataError('model.dataset does not include `ch`')
         if self.work_arrays is None:
             self._rebuild_work_arrays(on_missing_data='raise')
+        if not include_data:
+            return (
+                *self._fixed_arrays,
+                self._frame.holdfast.to_numpy(),
+                self.pvals.astype(self.float_dtype), # float input shape=[n_params]
+            )
+        if self._data_arrays is None and self._dataset is not None:
+            if self.chunk_size:
+                # silently loading every case would defeat streaming
+                raise ValueError(
+                    "this computation needs the data for all cases in memory, "
+                    "and is not available when chunk_size is set"
+                )
+            self._data_arrays = self._dataset.dc.to_arrays(
+                self.graph,
+                float_dtype=self.float_dtype,
+            )
         return (
             *self._fixed_arrays,
             self._frame.holdfast.to_numpy(),
@@ -1240,6 +2643,28 @@ class NumbaModel(_BaseModel):
             *self._data_arrays.cs[caseslice], # TODO fix when not using named tuple
         )
 
+    def _kernel_arrays(self, allow_missing_ch=False):
+        """
+        The fixed and data arrays of this model, for use in other kernels.
+
+        Parameters
+        ----------
+        allow_missing_ch : bool, default False
+            Use zeros for the choices if there are no choice data.
+
+        Returns
+        -------
+        KernelArrays
+            The arguments of `_numba_master` up to but not including
+            the return flags, omitting the holdfast and parameter arrays,
+            with a ce pointer row for every case.
+        """
+        args = _casewise_ce_ptr(self.__prepare_for_compute(
+            allow_missing_ch=allow_missing_ch,
+        ))
+        n_fixed = len(FixedArrays._fields)
+        return KernelArrays(*args[:n_fixed], *args[n_fixed + 2:])
+
     def constraint_violation(
             self,
             on_violation='raise',
@@ -1301,6 +2726,24 @@ class NumbaModel(_BaseModel):
         from .optimization import fit_bhhh
         return fit_bhhh(self, *args, **kwargs)
 
+    def fit_trust_region(self, *args, **kwargs):
+        from .optimization import fit_trust_region
+        return fit_trust_region(self, *args, **kwargs)
+
+    def minibatch_estimate(self, *args, **kwargs):
+        """
+        Estimate with mini-batch Adam steps, finishing with full-batch steps.
+
+        See `larch.numba.optimization.minibatch_estimate` for the
+        parameters.
+
+        Returns
+        -------
+        dictx
+        """
+        from .optimization import minibatch_estimate
+        return minibatch_estimate(self, *args, **kwargs)
+
     def constraint_penalty(self, x=None):
         if x is not None:
             self.set_values(x)
@@ -1334,13 +2777,41 @@ class NumbaModel(_BaseModel):
         args = self.__prepare_for_compute(
             x,
             allow_missing_ch=False,
+            include_data=not self.chunk_size,
         )
-        args_flags = args + (np.asarray([
+        return_flags = np.asarray([
             0,     # only_utility
             False, # return_probability
             True,  # return_gradient
             True,  # return_bhhh
-        ], dtype=np.int8),)
+        ], dtype=np.int8)
+        args_flags = args + (return_flags,)
+        if self._reduces_in_kernel:
+            with np.errstate(divide='ignore', over='ignore', ):
+                if self.constraint_intensity:
+                    penalty, dpenalty, dpenalty_binding = self.constraint_penalty()
+                else:
+                    penalty, dpenalty_binding = 0.0, None
+                if self.chunk_size:
+                    result_arrays = self._streamed_runner(
+                        args,
+                        return_flags,
+                        penalty=penalty,
+                        d_penalty=dpenalty_binding,
+                    )
+                else:
+                    result_arrays = self._reduced_runner(
+                        args_flags,
+                        penalty=penalty,
+                        d_penalty=dpenalty_binding,
+                    )
+            bhhh = result_arrays.bhhh.sum(0)
+            dloglike = result_arrays.d_loglike.sum(0)
+            freedoms = (self.pf.holdfast == 0).to_numpy()
+            from .optimization import propose_direction
+            direction = propose_direction(bhhh, dloglike, freedoms)
+            tolerance = np.dot(direction, dloglike) - self.n_cases
+            return tolerance
         with np.errstate(divide='ignore', over='ignore', ):
             _numba_master_vectorized(
                 *args_flags,
@@ -1369,27 +2840,81 @@ class NumbaModel(_BaseModel):
             start_case=None,
             stop_case=None,
             step_case=None,
+            return_casewise=False,
     ):
         caseslice = slice(start_case, stop_case, step_case)
+        if self._sparse_ce_active:
+            return self._sparse_ce_runner(
+                x,
+                only_utility=only_utility,
+                return_gradient=return_gradient,
+                return_probability=return_probability,
+                return_bhhh=return_bhhh,
+                caseslice=caseslice,
+                return_casewise=return_casewise,
+            )
         args = self.__prepare_for_compute(
             x,
             allow_missing_ch=return_probability or (only_utility>0),
             caseslice=caseslice,
+            include_data=not self.chunk_size,
         )
-        args_flags = args + (np.asarray([
+        return_flags = np.asarray([
             only_utility,
             return_probability,
             return_gradient,
             return_bhhh,
-        ], dtype=np.int8),)
+        ], dtype=np.int8)
+        args_flags = args + (return_flags,)
+        reuse = self._can_reuse_utility(args, only_utility, caseslice)
+        self._utility_cache = None
         try:
             with np.errstate(divide='ignore', over='ignore', ):
+                if self.chunk_size:
+                    if self.constraint_intensity:
+                        penalty, dpenalty, dpenalty_binding = self.constraint_penalty()
+                    else:
+                        penalty, dpenalty = 0.0, None
+                    result_arrays = self._streamed_runner(
+                        args,
+                        return_flags,
+                        caseslice=caseslice,
+                        keep_nodes=return_probability or (only_utility > 0),
+                        keep_casewise=return_casewise,
+                        penalty=penalty,
+                        d_penalty=dpenalty,
+                    )
+                    return result_arrays, penalty
+                if self._reduces_in_kernel:
+                    if self.constraint_intensity:
+                        penalty, dpenalty, dpenalty_binding = self.constraint_penalty()
+                    else:
+                        penalty, dpenalty = 0.0, None
+                    result_arrays = self._reduced_runner(
+                        args_flags,
+                        keep_nodes=return_probability or (only_utility > 0),
+                        keep_casewise=return_casewise,
+                        penalty=penalty,
+                        d_penalty=dpenalty,
+                    )
+                    return result_arrays, penalty
+                if reuse:
+                    return_flags[0] = 4
                 try:
                     result_arrays = WorkArrays(*_numba_master_vectorized(
                         *args_flags,
                         out=tuple(self.work_arrays.cs[caseslice]),
                     ))
+                    if only_utility != 3:
+                        self._utility_cache = (
+                            self._data_arrays,
+                            self.work_arrays.utility,
+                            (start_case, stop_case, step_case),
+                            np.array(args[15], copy=True),
+                            np.array(args[16], copy=True),
+                        )
                 except ValueError:
+                    return_flags[0] = only_utility
                     result_arrays = WorkArrays(*_numba_master_vectorized(
                         *args_flags,
                         #out=tuple(self.work_arrays.cs[caseslice]),
@@ -1431,6 +2956,364 @@ class NumbaModel(_BaseModel):
                 raise
         return result_arrays, penalty
 
+    def _sparse_ce_runner(
+            self,
+            x=None,
+            only_utility=0,
+            return_gradient=False,
+            return_probability=False,
+            return_bhhh=False,
+            caseslice=None,
+            return_casewise=False,
+    ):
+        """
+        Evaluate the model on sparse |idce| data.
+
+        The loglike, gradient and BHHH are reduced in the kernel.  Utility
+        and probability are computed per case-alternative row and kept in
+        `ce_work_arrays`; they are only expanded to the usual dense
+        [cases, nodes] arrays when node values are requested, with nest
+        values left at zero.
+        """
+        from .sparse_ce import (
+            CEWorkArrays, _numba_sparse_ce_reduce, co_features_by_alt, ce_to_dense_nodes,
+        )
+        args = self.__prepare_for_compute(
+            x,
+            allow_missing_ch=return_probability or (only_utility > 0),
+            include_data=False,
+        )
+        data = self._data_arrays
+        n_cases = data.ce_caseptr.shape[0] - 1
+        cases = np.arange(n_cases)[caseslice if caseslice is not None else slice(None)]
+        n_params = args[16].shape[0]
+        n_nodes = len(self.graph)
+        dtype = self.float_dtype
+        acc_dtype = self.accumulate_dtype
+        keep_nodes = return_probability or (only_utility > 0)
+        return_flags = np.asarray([
+            only_utility,
+            return_probability,
+            return_gradient,
+            return_bhhh,
+        ], dtype=np.int8)
+        n_rows = data.ce_altidx.shape[0] if keep_nodes else 0
+        utility_ce = np.zeros(n_rows, dtype=dtype)
+        probability_ce = np.zeros(n_rows, dtype=dtype)
+        if return_casewise:
+            casewise_d_loglike = np.zeros((cases.size, n_params), dtype=acc_dtype)
+            casewise_loglike = np.zeros(cases.size, dtype=acc_dtype)
+        else:
+            casewise_d_loglike = np.zeros((0, n_params), dtype=acc_dtype)
+            casewise_loglike = np.zeros(0, dtype=acc_dtype)
+        if self.constraint_intensity:
+            penalty, dpenalty, dpenalty_binding = self.constraint_penalty()
+            d_penalty = np.asarray(dpenalty, dtype=acc_dtype)
+        else:
+            penalty, d_penalty = 0.0, np.zeros(0, dtype=acc_dtype)
+        co_order, co_alt_ptr = co_features_by_alt(args[7], data.n_alts)
+        bhhh = np.zeros((1, n_params, n_params), dtype=acc_dtype)
+        d_loglike = np.zeros((1, n_params), dtype=acc_dtype)
+        loglike = np.zeros(1, dtype=acc_dtype)
+        n_blocks = max(1, min(get_num_threads(), cases.size))
+        with np.errstate(divide='ignore', over='ignore', ):
+            _numba_sparse_ce_reduce(
+                *args[:3],
+                np.atleast_1d(np.asarray(args[3], dtype=np.int32)),
+                *args[4:17],
+                data.ch,
+                data.av,
+                data.wt,
+                data.co,
+                data.ce_data,
+                data.ce_altidx,
+                data.ce_caseptr,
+                return_flags,
+                co_order,
+                co_alt_ptr,
+                cases,
+                data.n_alts,
+                d_penalty,
+                n_blocks,
+                utility_ce,
+                probability_ce,
+                casewise_d_loglike,
+                casewise_loglike,
+                bhhh[0],
+                d_loglike[0],
+                loglike,
+            )
+        if penalty:
+            loglike += penalty * cases.size
+            casewise_loglike += penalty
+        if d_penalty.size:
+            d_loglike += d_penalty * cases.size
+            casewise_d_loglike += np.expand_dims(d_penalty, 0)
+        if keep_nodes:
+            self.ce_work_arrays = CEWorkArrays(utility_ce, probability_ce)
+            utility = ce_to_dense_nodes(
+                utility_ce, data.ce_altidx, data.ce_caseptr, cases, n_nodes, -np.inf,
+            )
+            utility[:, data.n_alts:] = 0.0
+            probability = ce_to_dense_nodes(
+                probability_ce, data.ce_altidx, data.ce_caseptr, cases, n_nodes, 0.0,
+            )
+        else:
+            utility = np.zeros((0, n_nodes), dtype=dtype)
+            probability = np.zeros((0, n_nodes), dtype=dtype)
+        result_arrays = WorkArrays(
+            utility=utility,
+            logprob=np.zeros((0, n_nodes), dtype=dtype),
+            probability=probability,
+            bhhh=bhhh,
+            d_loglike=casewise_d_loglike if return_casewise else d_loglike,
+            loglike=casewise_loglike if return_casewise else loglike,
+        )
+        return result_arrays, penalty
+
+    @property
+    def _sparse_ce_active(self):
+        return bool(getattr(self, 'sparse_ce', False)) and (
+            self.datatree is not None or getattr(self, 'shared_data', None) is not None
+        )
+
+    def _nesting_only_slots(self):
+        """
+        Find the parameters that only appear in the nesting structure.
+
+        Returns
+        -------
+        ndarray of bool
+            True for the mu and allocation parameters, unless they are
+            also used in the utility or quantity functions.
+        """
+        fixed = self._fixed_arrays
+        mask = np.zeros(len(self._frame), dtype=bool)
+        nesting = np.concatenate([fixed.mu_slot, fixed.edge_slots[:, 3]])
+        mask[nesting[nesting >= 0]] = True
+        for used in (
+                fixed.qca_param_slot,
+                fixed.qscale_param_slot,
+                fixed.uca_param_slot,
+                fixed.uco_param_slot,
+        ):
+            used = np.atleast_1d(used)
+            mask[used[used >= 0]] = False
+        return mask
+
+    def _can_reuse_utility(self, args, only_utility, caseslice):
+        """
+        Check if the elemental utilities from the last evaluation are still valid.
+
+        They are when the last evaluation wrote them into the work arrays
+        for the same cases of the same data, and since then no parameters
+        have changed other than those in `_nesting_only_slots`.  In that
+        case the kernel can skip computing utilities from the data.
+        """
+        cache = getattr(self, '_utility_cache', None)
+        if (
+                not getattr(self, 'reuse_utility', True)
+                or cache is None
+                or only_utility != 0
+                or self.chunk_size
+                or self._reduces_in_kernel
+        ):
+            return False
+        data_arrays, utility, cases, holdfast, pvals = cache
+        if (
+                data_arrays is not self._data_arrays
+                or self.work_arrays is None
+                or utility is not self.work_arrays.utility
+                or cases != (caseslice.start, caseslice.stop, caseslice.step)
+                or pvals.shape != args[16].shape
+                or not np.array_equal(holdfast, args[15])
+        ):
+            return False
+        changed = pvals != args[16]
+        return not (changed & ~self._nesting_only_slots()).any()
+
+    def _reduced_runner(
+            self,
+            args_flags,
+            keep_nodes=False,
+            keep_casewise=False,
+            penalty=0.0,
+            d_penalty=None,
+            use_work_arrays=True,
+    ):
+        """
+        Evaluate the model with loglike, gradient and BHHH reduced in the kernel.
+
+        Parameters
+        ----------
+        args_flags : tuple
+            The input arrays for `_numba_master`, already sliced to the
+            cases that are to be included.
+        keep_nodes : bool, default False
+            Write the casewise utility, logprob and probability arrays.
+        keep_casewise : bool, default False
+            Write the casewise loglike and gradient arrays.
+        penalty : float, default 0.0
+            A constraint penalty added to the loglike of every case.
+        d_penalty : array-like, optional
+            The derivative of the constraint penalty, added to the gradient
+            of every case, including in the casewise outer products that
+            form the BHHH matrix.
+        use_work_arrays : bool, default True
+            Write the casewise arrays into the model's `work_arrays`,
+            instead of newly allocated arrays.
+
+        Returns
+        -------
+        WorkArrays
+            The `bhhh` array has a single row holding the total over all
+            cases, as do the `d_loglike` and `loglike` arrays unless
+            `keep_casewise` is set.  The node arrays are empty unless
+            `keep_nodes` is set.
+        """
+        args_flags = _casewise_ce_ptr(args_flags)
+        n_cases, n_nodes = args_flags[17].shape
+        n_params = args_flags[16].shape[0]
+        dtype = self.float_dtype
+        acc_dtype = self.accumulate_dtype
+        if keep_nodes and use_work_arrays:
+            utility = self.work_arrays.utility[:n_cases]
+            logprob = self.work_arrays.logprob[:n_cases]
+            probability = self.work_arrays.probability[:n_cases]
+        elif keep_nodes:
+            utility = np.zeros((n_cases, n_nodes), dtype=dtype)
+            logprob = np.zeros((n_cases, n_nodes), dtype=dtype)
+            probability = np.zeros((n_cases, n_nodes), dtype=dtype)
+        else:
+            utility = np.zeros((0, n_nodes), dtype=dtype)
+            logprob = np.zeros((0, n_nodes), dtype=dtype)
+            probability = np.zeros((0, n_nodes), dtype=dtype)
+        if keep_casewise:
+            casewise_d_loglike = np.zeros((n_cases, n_params), dtype=acc_dtype)
+            if use_work_arrays:
+                casewise_loglike = self.work_arrays.loglike[:n_cases]
+            else:
+                casewise_loglike = np.zeros(n_cases, dtype=acc_dtype)
+        else:
+            casewise_d_loglike = np.zeros((0, n_params), dtype=acc_dtype)
+            casewise_loglike = np.zeros(0, dtype=acc_dtype)
+        if d_penalty is None:
+            d_penalty = np.zeros(0, dtype=acc_dtype)
+        else:
+            d_penalty = np.asarray(d_penalty, dtype=acc_dtype)
+        bhhh = np.zeros((1, n_params, n_params), dtype=acc_dtype)
+        d_loglike = np.zeros((1, n_params), dtype=acc_dtype)
+        loglike = np.zeros(1, dtype=acc_dtype)
+        n_blocks = max(1, min(get_num_threads(), n_cases))
+        _numba_master_reduce(
+            *args_flags,
+            d_penalty,
+            n_blocks,
+            utility,
+            logprob,
+            probability,
+            casewise_d_loglike,
+            casewise_loglike,
+            bhhh[0],
+            d_loglike[0],
+            loglike,
+        )
+        if penalty:
+            loglike += penalty * n_cases
+            casewise_loglike += penalty
+        if d_penalty.size:
+            d_loglike += d_penalty * n_cases
+            casewise_d_loglike += np.expand_dims(d_penalty, 0)
+        return WorkArrays(
+            utility=utility,
+            logprob=logprob,
+            probability=probability,
+            bhhh=bhhh,
+            d_loglike=casewise_d_loglike if keep_casewise else d_loglike,
+            loglike=casewise_loglike if keep_casewise else loglike,
+        )
+
+    def _iter_chunks(self, caseslice=None):
+        """
+        Iterate over chunks of `chunk_size` cases, prefetching the next one.
+
+        Data is taken from the model's `dataset` when there is one, so
+        that lazy or memory-mapped variables are only read one chunk at a
+        time, and otherwise from the data arrays loaded from `dataframes`.
+
+        Yields
+        ------
+        DataArrays
+        """
+        if self._dataset is not None:
+            source = self._dataset
+        elif self._data_arrays is not None:
+            source = self._data_arrays
+        else:
+            raise MissingDataError('no data are set')
+        graph = self.graph
+        float_dtype = self.float_dtype
+        loaders = [
+            lambda lo=lo, hi=hi, step=step: load_chunk(
+                source, lo, hi, step, graph=graph, float_dtype=float_dtype,
+            )
+            for lo, hi, step in chunk_bounds(self.n_cases, self.chunk_size, caseslice)
+        ]
+        yield from prefetched(loaders)
+
+    def _streamed_runner(
+            self,
+            args,
+            return_flags,
+            caseslice=None,
+            keep_nodes=False,
+            keep_casewise=False,
+            penalty=0.0,
+            d_penalty=None,
+    ):
+        """
+        Evaluate the model chunk by chunk, accumulating the totals.
+
+        Parameters
+        ----------
+        args : tuple
+            The fixed arrays, holdfast and parameter values, without data.
+        return_flags : array-like
+            The return flags for `_numba_master`.
+        caseslice : slice, optional
+            The cases to include.
+        keep_nodes, keep_casewise, penalty, d_penalty
+            See `_reduced_runner`.
+
+        Returns
+        -------
+        WorkArrays
+            As for `_reduced_runner`, with casewise arrays concatenated
+            across chunks.
+        """
+        chunks = []
+        for data_arrays in self._iter_chunks(caseslice):
+            chunks.append(self._reduced_runner(
+                (*args, *data_arrays, return_flags),
+                keep_nodes=keep_nodes,
+                keep_casewise=keep_casewise,
+                penalty=penalty,
+                d_penalty=d_penalty,
+                use_work_arrays=False,
+            ))
+        if not chunks:
+            raise MissingDataError('no cases are selected')
+        combine_casewise = lambda name: np.concatenate([getattr(c, name) for c in chunks])
+        combine_total = lambda name: np.sum([getattr(c, name) for c in chunks], axis=0)
+        return WorkArrays(
+            utility=combine_casewise('utility'),
+            logprob=combine_casewise('logprob'),
+            probability=combine_casewise('probability'),
+            bhhh=combine_total('bhhh'),
+            d_loglike=combine_casewise('d_loglike') if keep_casewise else combine_total('d_loglike'),
+            loglike=combine_casewise('loglike') if keep_casewise else combine_total('loglike'),
+        )
+
     @property
     def weight_normalization(self):
         try:
@@ -1514,6 +3397,7 @@ class NumbaModel(_BaseModel):
             start_case=start_case,
             stop_case=stop_case,
             step_case=step_case,
+            return_casewise=True,
         )
         return result_arrays.loglike * self.weight_normalization
 
@@ -1530,6 +3414,7 @@ class NumbaModel(_BaseModel):
             stop_case=stop_case,
             step_case=step_case,
             return_gradient=True,
+            return_casewise=True,
         )
         return result_arrays.d_loglike * self.weight_normalization
 
@@ -1767,6 +3652,7 @@ class NumbaModel(_BaseModel):
             persist=0,
             leave_out=-1, keep_only=-1, subsample=-1,
     ):
+        from ..model.persist_flags import PERSIST_LOGLIKE_CASEWISE, PERSIST_D_LOGLIKE_CASEWISE
         result_arrays, penalty = self._loglike_runner(
             x,
             start_case=start_case,
@@ -1774,13 +3660,13 @@ class NumbaModel(_BaseModel):
             step_case=step_case,
             return_gradient=True,
             return_bhhh=True,
+            return_casewise=bool(persist & (PERSIST_LOGLIKE_CASEWISE | PERSIST_D_LOGLIKE_CASEWISE)),
         )
         result = dictx(
             ll=result_arrays.loglike.sum() * self.weight_normalization,
             dll=result_arrays.d_loglike.sum(0) * self.weight_normalization,
             bhhh=result_arrays.bhhh.sum(0) * self.weight_normalization,
         )
-        from ..model.persist_flags import PERSIST_LOGLIKE_CASEWISE, PERSIST_D_LOGLIKE_CASEWISE
         if persist & PERSIST_LOGLIKE_CASEWISE:
             result['ll_casewise'] = result_arrays.loglike * self.weight_normalization
         if persist & PERSIST_D_LOGLIKE_CASEWISE:
@@ -1795,6 +3681,11 @@ class NumbaModel(_BaseModel):
         result['penalty'] = penalty
         return result
 
+    @property
+    def _has_analytic_d2_loglike(self):
+        """bool : Whether `d2_loglike` is analytic, not finite difference."""
+        return not (self.constraint_intensity or self.is_cross_nested or self._sparse_ce_active)
+
     def d2_loglike(
             self,
             x=None,
@@ -1806,15 +3697,68 @@ class NumbaModel(_BaseModel):
             keep_only=-1,
             subsample=-1,
     ):
-        return super().d2_loglike(
-            x=x,
-            start_case=start_case,
-            stop_case=stop_case,
-            step_case=step_case,
-            leave_out=leave_out,
-            keep_only=keep_only,
-            subsample=subsample,
-        )
+        """
+        Compute the second derivative of log likelihood with respect to the parameters.
+
+        For multinomial and nested logit models the Hessian is computed
+        analytically, in a single pass over the cases.  When constraint
+        penalties are active, the finite difference approximation from
+        the parent class is used instead, so that the penalty curvature
+        is included; the same is done for cross-nested models.
+
+        Parameters
+        ----------
+        x : {'null', 'init', 'best', array-like, dict, scalar}, optional
+            Values for the parameters.  See :ref:`set_values` for details.
+        start_case, stop_case, step_case : int, optional
+            The cases to include in the computation, processed as usual
+            for Python slicing.
+
+        Returns
+        -------
+        ndarray
+            The second derivatives, with zeros in the rows and columns of
+            holdfast parameters.
+        """
+        if not self._has_analytic_d2_loglike:
+            return super().d2_loglike(
+                x=x,
+                start_case=start_case,
+                stop_case=stop_case,
+                step_case=step_case,
+                leave_out=leave_out,
+                keep_only=keep_only,
+                subsample=subsample,
+            )
+        caseslice = slice(start_case, stop_case, step_case)
+        if self.chunk_size:
+            args = self.__prepare_for_compute(x, include_data=False)
+            chunks = (
+                _casewise_ce_ptr((*args, *data_arrays))
+                for data_arrays in self._iter_chunks(caseslice)
+            )
+        else:
+            chunks = [_casewise_ce_ptr(self.__prepare_for_compute(x, caseslice=caseslice))]
+        n_params = len(self._frame)
+        d2_loglike = np.zeros((n_params, n_params), dtype=np.float64)
+        d2_chunk = np.zeros((n_params, n_params), dtype=np.float64)
+        d_loglike = np.zeros(n_params, dtype=np.float64)
+        loglike = np.zeros(1, dtype=np.float64)
+        with np.errstate(divide='ignore', over='ignore', ):
+            for chunk_args in chunks:
+                n_blocks = max(1, min(get_num_threads(), chunk_args[17].shape[0]))
+                _numba_master_d2_reduce(
+                    *chunk_args,
+                    n_blocks,
+                    d2_chunk,
+                    d_loglike,
+                    loglike,
+                )
+                d2_loglike += d2_chunk
+        holdfast = self._frame.holdfast.to_numpy() != 0
+        d2_loglike[holdfast, :] = 0.0
+        d2_loglike[:, holdfast] = 0.0
+        return d2_loglike * self.weight_normalization
 
     def neg_loglike(
             self,
@@ -1957,18 +3901,34 @@ class NumbaModel(_BaseModel):
     def __getstate__(self):
         state = dict(
             float_dtype=self.float_dtype,
+            accumulate_dtype=self._accumulate_dtype,
+            reduce_in_kernel=self.reduce_in_kernel,
+            chunk_size=self.chunk_size,
             constraint_intensity=self.constraint_intensity,
             constraint_sharpness=self.constraint_sharpness,
             _constraint_funcs=self._constraint_funcs,
+            reuse_utility=self.reuse_utility,
+            data_cache=self.data_cache,
+            sparse_ce=self.sparse_ce,
+            shared_data=self.shared_data,
             _private__graph=self._private__graph,
         )
         return super().__getstate__(), state
 
     def __setstate__(self, state):
         self.float_dtype = state[1]['float_dtype']
+        self.accumulate_dtype = state[1].get('accumulate_dtype', None)
+        self.reduce_in_kernel = state[1].get('reduce_in_kernel', False)
+        self.chunk_size = state[1].get('chunk_size', None)
         self.constraint_intensity = state[1]['constraint_intensity']
         self.constraint_sharpness = state[1]['constraint_sharpness']
         self._constraint_funcs = state[1]['_constraint_funcs']
+        self.reuse_utility = state[1].get('reuse_utility', True)
+        self.data_cache = state[1].get('data_cache', None)
+        self.sparse_ce = state[1].get('sparse_ce', False)
+        self.shared_data = state[1].get('shared_data', None)
+        self.ce_work_arrays = None
+        self._utility_cache = None
         self._private__graph = state[1]["_private__graph"]
         super().__setstate__(state[0])
 
@@ -1990,6 +3950,10 @@ class NumbaModel(_BaseModel):
         """
         if self._data_arrays is not None:
             return self._data_arrays.wt.sum()
+        if self.chunk_size and self._dataset is not None:
+            if 'wt' in self._dataset:
+                return float(self._dataset['wt'].sum())
+            return float(self.n_cases)
         raise MissingDataError("no data_arrays are set")
 
     @property
@@ -2036,19 +4000,141 @@ class NumbaModel(_BaseModel):
         if dataset is self._dataset:
             return
         from xarray import Dataset as _Dataset
-        if isinstance(dataset, Dataset):
+        if isinstance(dataset, str):
+            # the name of a dataset published to shared memory
+            from .shared_data import attach_dataset
+            self._dataset = attach_dataset(dataset)
+            self._data_arrays = None
+            self.shared_data = dataset
+        elif isinstance(dataset, Dataset):
             self._dataset = dataset
             self._data_arrays = None
+            self.shared_data = None
         elif isinstance(dataset, _Dataset):
             self._dataset = Dataset(dataset)
             self._data_arrays = None
+            self.shared_data = None
         else:
             raise TypeError(f"dataset must be Dataset not {type(dataset)}")
+        self._dataset_origin = None
 
     @dataset.deleter
     def dataset(self):
         self._dataset = None
         self._data_arrays = None
+        self._dataset_origin = None
+        self._previous_dataset = None
+        self.shared_data = None
+
+    def share_dataset(self, name=None):
+        """
+        Publish the prepared data of this model to shared memory.
+
+        Other processes can then use the same data without a copy of
+        their own, by setting the `dataset` of their models to the name
+        of the shared data.  A model that is pickled after sharing, e.g.
+        to be sent to a worker process, attaches to the shared data by
+        name when it is unpickled.  This model also switches over to use
+        the shared copy, so its private copy can be released.
+
+        Parameters
+        ----------
+        name : str, optional
+            The name for the shared memory block.  If not given, a
+            unique name is generated.
+
+        Returns
+        -------
+        SharedDataset
+            The handle on the shared data.  Keep it for as long as the
+            data is needed, and call its `unlink` method afterwards.
+        """
+        from .shared_data import publish_dataset
+        dataset = self.dataset
+        if dataset is None:
+            raise MissingDataError("no prepared dataset to share")
+        handle = publish_dataset(dataset, name=name)
+        self.dataset = handle.name
+        return handle
+
+    def cross_validate(self, cv=5, **kwargs):
+        """
+        Compute a k-fold cross-validated log likelihood.
+
+        Folds are estimated concurrently on copies of this model that
+        share its loaded data, see
+        `larch.model.optimization.cross_validate` for details.  The
+        estimated parameters of each fold are also written to the
+        parameter frame, in columns named like `cv_000`, and the full
+        results are available afterwards as
+        `most_recent_cross_validation`.
+
+        Parameters
+        ----------
+        cv : int, default 5
+            The number of folds.
+        warm_start : bool, default True
+            Start every fold from the estimates on all the cases.
+        executor : {'thread', None}, default 'thread'
+            Run the folds concurrently in a thread pool, or one after
+            another.
+        start_case, stop_case, step_case : int, optional
+            Only use the cases in this slice.
+        **kwargs
+            Other arguments are passed to `maximize_loglike`.
+
+        Returns
+        -------
+        float
+            The log likelihood as computed from the holdout folds.
+        """
+        from ..model.optimization import cross_validate
+        result = cross_validate(self, cv=cv, **kwargs)
+        for fold in result.parameters.columns:
+            self._frame[f'cv_{fold:03d}'] = result.parameters[fold].values
+        self._most_recent_cross_validation = result
+        return result.loglike
+
+    @property
+    def most_recent_cross_validation(self):
+        """
+        dictx : Results of the last `cross_validate`.
+
+        With the total held out log likelihood as `loglike`, the held
+        out log likelihood of each fold as `fold_loglike`, a DataFrame of
+        the estimated `parameters` for each fold, and the results of
+        `maximize_loglike` for each fold as `fold_results`.
+        """
+        return getattr(self, '_most_recent_cross_validation', None)
+
+    def copy(self, share_data=False):
+        """
+        Create a copy of the model.
+
+        Parameters
+        ----------
+        share_data : bool, default False
+            Give the copy the same datatree and prepared dataset as this
+            model.  The loaded arrays are shared, not copied, so the copy
+            is ready for computation without preparing the data again.
+            Otherwise the copy has no data, as for `Model.copy`.
+
+        Returns
+        -------
+        NumbaModel
+        """
+        result = super().copy()
+        if share_data:
+            self.unmangle()
+            result._datatree = self.datatree
+            result.dataflows = getattr(self, 'dataflows', None)
+            result._dataset = self._dataset
+            result._dataset_origin = getattr(self, '_dataset_origin', None)
+            result._data_arrays = self._data_arrays
+            result.shared_data = self.shared_data
+            result._fixed_arrays = None
+            result.work_arrays = None
+        return result
 
     @property
     def data_as_loaded(self):
@@ -2083,6 +4169,106 @@ class NumbaModel(_BaseModel):
             self.mangle()
         self._float_dtype = float_dtype
 
+    @property
+    def accumulate_dtype(self):
+        """dtype : The dtype used to accumulate loglike, gradient and BHHH.
+
+        By default this is the same as `float_dtype`.  Setting
+        `float_dtype` to float32 and this to float64 gives a mixed
+        precision mode: the data and utility arrays are stored and
+        processed in single precision, halving their memory use and
+        bandwidth, while the sums over cases are accumulated in double
+        precision so the loglike and its derivatives do not lose
+        accuracy as the number of cases grows.  When this differs from
+        `float_dtype`, totals are reduced in the kernel as when
+        `reduce_in_kernel` is set.
+        """
+        acc = getattr(self, '_accumulate_dtype', None)
+        if acc is None:
+            return self.float_dtype
+        return acc
+
+    @accumulate_dtype.setter
+    def accumulate_dtype(self, x):
+        if x is not None:
+            x = np.dtype(x).type
+        if getattr(self, '_accumulate_dtype', None) != x:
+            self.work_arrays = None
+        self._accumulate_dtype = x
+
+    @property
+    def _reduces_in_kernel(self):
+        return (
+            self.reduce_in_kernel
+            or bool(self.chunk_size)
+            or self._sparse_ce_active
+            or np.dtype(self.accumulate_dtype) != np.dtype(self.float_dtype)
+        )
+
+    @property
+    def reduce_in_kernel(self):
+        """bool : Reduce loglike, gradient and BHHH across cases inside the kernel.
+
+        When enabled, the totals are accumulated in per-thread partial sums
+        and the casewise gradient and BHHH arrays are never stored, so the
+        peak memory use does not grow with n_cases * n_params**2.  Methods
+        that return casewise results still work, but compute them on demand.
+        """
+        try:
+            return self._reduce_in_kernel
+        except AttributeError:
+            return False
+
+    @reduce_in_kernel.setter
+    def reduce_in_kernel(self, x):
+        x = bool(x)
+        if self.reduce_in_kernel != x:
+            self.work_arrays = None
+        self._reduce_in_kernel = x
+
+    @property
+    def chunk_size(self):
+        """int or None : Stream cases through the kernel in chunks of this size.
+
+        When set, the model data are never converted into a single set
+        of arrays for all cases.  Instead, chunks of cases are loaded from
+        the `dataset` one at a time, while the next chunk is prefetched
+        in a background thread, and the loglike, gradient and BHHH are
+        accumulated across chunks, as when `reduce_in_kernel` is set.
+        This lets a model be estimated on a dataset opened lazily from a
+        zarr store, or backed by memory-mapped arrays, that is larger
+        than the available memory.
+
+        Only a `dataset` set directly on the model is read out-of-core.
+        A model using a `datatree` still evaluates all the variables it
+        needs into an in-memory dataset when the data is prepared, so
+        streaming only avoids a second copy of that data.  To estimate
+        on data larger than memory, prepare it once (e.g. with
+        `Dataset.to_zarr`), and set the `dataset` of the model to the
+        reopened store.
+
+        Computations that need the data of all cases at once, such as
+        latent class and mixed logit models using this model as a
+        component, raise a ValueError while this is set.
+        """
+        try:
+            return self._chunk_size
+        except AttributeError:
+            return None
+
+    @chunk_size.setter
+    def chunk_size(self, x):
+        if x is not None:
+            x = int(x)
+            if x < 1:
+                raise ValueError(f"chunk_size must be positive, not {x}")
+        if self.chunk_size != x:
+            self.work_arrays = None
+            if x is not None and getattr(self, '_dataset', None) is not None:
+                # release the in-memory copy, chunks are read from the dataset
+                self._data_arrays = None
+        self._chunk_size = x
+
     def choice_avail_summary(self):
         """
         Generate a summary of choice and availability statistics.
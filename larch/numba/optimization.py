@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 from ..exceptions import BHHHSimpleStepFailure
 
 
@@ -218,3 +219,312 @@ def fit_bhhh(
         logger.debug(f"  constraint sharpness {model.constraint_sharpness}")
 
     return current_ll, tolerance, iter, np.asarray(steps), message
+
+
+def fit_trust_region(
+        model,
+        ctol=1e-5,
+        maxiter=100,
+        callback=None,
+        logger=None,
+        damping=1e-3,
+        max_damping=1e10,
+        accept_ratio=1e-4,
+        hessian='bhhh',
+        leave_out=-1,
+        keep_only=-1,
+        subsample=-1,
+):
+    """
+    Maximize the log likelihood with Levenberg-Marquardt trust region steps.
+
+    Each iteration solves ``(B + damping * D) s = g`` for a step `s`,
+    where `g` is the gradient, `B` is the BHHH matrix (or the negative
+    analytic Hessian) and `D` is the diagonal of `B`.  The log
+    likelihood, gradient and BHHH matrix at the proposed values come
+    from a single `loglike2_bhhh` call, which is used both to decide
+    whether to accept the step, by comparing the actual gain to the
+    gain predicted by the quadratic model, and if accepted as the
+    starting point of the next iteration.  So unlike a line search,
+    each iteration needs only one pass over the data.  The damping is
+    reduced after good steps and increased after rejected ones.
+
+    Parameters
+    ----------
+    ctol : float, default 1e-5
+        Convergence tolerance, on the gain predicted by a full Newton
+        step with the BHHH matrix.
+    maxiter : int, default 100
+        The maximum number of iterations.
+    callback : callable, optional
+        Called with the parameter values after each accepted step.
+    logger : logging.Logger, optional
+    damping : float, default 1e-3
+        The initial damping.
+    max_damping : float, default 1e10
+        Give up when the damping needed to make an improving step
+        grows past this.
+    accept_ratio : float, default 1e-4
+        Accept steps that achieve at least this fraction of the
+        predicted gain.
+    hessian : {'bhhh', 'analytic'}, default 'bhhh'
+        The curvature matrix for the quadratic model.  The analytic
+        Hessian is better near the optimum, but needs an extra pass
+        over the data for every accepted step.  It is not available
+        for models where `d2_loglike` uses finite differences, i.e.
+        cross-nested models, models with sparse idce data, or with
+        a `constraint_intensity`.
+
+    Returns
+    -------
+    loglike, convergence_tolerance, n_iters, steps, message, n_evaluations
+        As for `fit_bhhh`, with `steps` giving the damping used for
+        each accepted step, and also the number of passes over the
+        data.
+    """
+    if logger is None:
+        class NoLogger:
+            debug = lambda *x: None
+            info = lambda *x: None
+        logger = NoLogger()
+
+    if hessian not in ('bhhh', 'analytic'):
+        raise ValueError(f"hessian must be 'bhhh' or 'analytic', not {hessian!r}")
+    if hessian == 'analytic' and not model._has_analytic_d2_loglike:
+        # the finite difference Hessian takes two passes per parameter
+        raise ValueError(
+            "the analytic Hessian is not available for this model, use hessian='bhhh'"
+        )
+
+    slicing = dict(leave_out=leave_out, keep_only=keep_only, subsample=subsample)
+    freedoms = (model.pf.holdfast == 0).to_numpy()
+    minimum = model.pf.minimum.to_numpy()
+    maximum = model.pf.maximum.to_numpy()
+
+    def curvature(result):
+        if hessian == 'analytic':
+            return -np.asarray(model.d2_loglike(**slicing))
+        return np.asarray(result.bhhh)
+
+    current_pvals = model.pvals.copy()
+    current = model.loglike2_bhhh(**slicing)
+    current_ll = current.ll
+    current_dll = np.asarray(current.dll)
+    current_curv = curvature(current)
+    n_evaluations = 2 if hessian == 'analytic' else 1
+    logger.debug(f"initial loglike {current_ll}")
+
+    iter = 0
+    steps = []
+    nu = 2.0
+    message = "Optimization terminated for undetermined reason."
+    while True:
+        # parameters held at a bound by the gradient are fixed for this step
+        active = (
+            ((current_pvals <= minimum) & (current_dll < 0))
+            | ((current_pvals >= maximum) & (current_dll > 0))
+        )
+        free = freedoms & ~active
+        g = current_dll[free]
+        H = current_curv[free, :][:, free]
+        try:
+            newton = np.linalg.solve(H, g)
+        except np.linalg.LinAlgError:
+            newton = np.linalg.lstsq(H, g, rcond=None)[0]
+        tolerance = np.dot(newton, g)
+        if abs(tolerance) <= ctol:
+            message = "Optimization terminated successfully."
+            break
+        if iter >= maxiter:
+            message = f"Optimization terminated after {iter} iterations."
+            break
+
+        scaling = np.maximum(np.diag(H), np.finfo(float).eps)
+        while True:
+            try:
+                step = np.linalg.solve(H + damping * np.diag(scaling), g)
+            except np.linalg.LinAlgError:
+                step = np.linalg.lstsq(H + damping * np.diag(scaling), g, rcond=None)[0]
+            proposed_pvals = current_pvals.copy()
+            proposed_pvals[free] += step
+            proposed_pvals = np.clip(proposed_pvals, minimum, maximum)
+            step = proposed_pvals[free] - current_pvals[free]
+            predicted = np.dot(g, step) - 0.5 * step @ H @ step
+            model.set_values(proposed_pvals)
+            proposed = model.loglike2_bhhh(**slicing)
+            n_evaluations += 1
+            gain = proposed.ll - current_ll
+            ratio = gain / predicted if predicted > 0 else -np.inf
+            if gain > 0 and ratio >= accept_ratio:
+                break
+            logger.debug(f"rejected step with damping {damping}, gain {gain}, predicted {predicted}")
+            damping *= nu
+            nu *= 2.0
+            if damping > max_damping or not np.any(step):
+                break
+
+        if not (gain > 0 and ratio >= accept_ratio):
+            model.set_values(current_pvals)
+            message = "Optimization terminated, no improving step found."
+            break
+
+        iter += 1
+        steps.append(damping)
+        logger.debug(f"trust region step with damping {damping} gains {gain} to {proposed.ll}")
+        damping *= max(1.0 / 3.0, 1.0 - (2.0 * ratio - 1.0) ** 3)
+        nu = 2.0
+        current_pvals = model.pvals.copy()
+        current_ll = proposed.ll
+        current_dll = np.asarray(proposed.dll)
+        current_curv = curvature(proposed)
+        if hessian == 'analytic':
+            n_evaluations += 1
+        if callback is not None:
+            callback(
+                current_pvals,
+                {
+                    'penalty': proposed.penalty * model.n_cases,
+                    'total_loglike': current_ll,
+                    'actual_loglike': current_ll - proposed.penalty,
+                },
+            )
+
+    logger.debug(f"trust region used {n_evaluations} evaluations of loglike2_bhhh")
+    return current_ll, tolerance, iter, np.asarray(steps), message, n_evaluations
+
+
+def minibatch_estimate(
+        model,
+        batch_size=1024,
+        max_epochs=50,
+        learning_rate=0.05,
+        beta1=0.9,
+        beta2=0.999,
+        epsilon=1e-8,
+        rtol=1e-3,
+        seed=None,
+        finish_method='bhhh',
+        finish_maxiter=10,
+        covariance=True,
+        logger=None,
+        **kwargs,
+):
+    """
+    Estimate a model with mini-batch Adam steps, finishing with full-batch steps.
+
+    For very large samples, each full pass over the data is expensive,
+    and early iterations far from the optimum do not need an exact
+    gradient.  This makes Adam steps using the gradient from blocks of
+    `batch_size` contiguous cases, which are visited in a random order
+    in each epoch.  Whenever an epoch fails to improve the average log
+    likelihood per case by a relative `rtol`, the batch size is doubled,
+    so that the gradient becomes less noisy as the optimum nears.  Once
+    the batch size reaches the whole sample, or after `max_epochs`, the
+    estimation is handed off to `maximize_loglike` with `finish_method`
+    for the final precision.
+
+    Steps are taken in parameters scaled by the square root of the
+    diagonal of the per-case BHHH matrix at the starting values, so a
+    single learning rate suits parameters of very different magnitudes.
+
+    Parameters
+    ----------
+    model : NumbaModel
+    batch_size : int, default 1024
+        The initial number of cases in each block.
+    max_epochs : int, default 50
+        The maximum number of passes through the blocks.
+    learning_rate : float, default 0.05
+        The Adam step size, in scaled parameters.
+    beta1, beta2, epsilon : float
+        The Adam moment decay rates and denominator offset.
+    rtol : float, default 1e-3
+        Relative improvement in the log likelihood per case across an
+        epoch, below which the batch size is doubled.
+    seed : int, optional
+        Seed for the order of blocks.
+    finish_method : str or None, default 'bhhh'
+        The method for the final full-batch estimation, or None to
+        skip it.
+    finish_maxiter : int, default 10
+        Maximum iterations for the final estimation.
+    covariance : bool, default True
+        Compute the parameter covariance and standard errors at the end.
+    logger : logging.Logger, optional
+    **kwargs
+        Other arguments are passed to `maximize_loglike` for the final
+        estimation.
+
+    Returns
+    -------
+    dictx
+        The result of the final estimation, with `minibatch_epochs` and
+        a `minibatch_history` of the batch size and average log
+        likelihood per case in each epoch.
+    """
+    from ..util import dictx
+    if logger is None:
+        class NoLogger:
+            debug = lambda *x: None
+            info = lambda *x: None
+        logger = NoLogger()
+
+    rng = np.random.default_rng(seed)
+    n_cases = model.n_cases
+    freedoms = (model.pf.holdfast == 0).to_numpy()
+    minimum = model.pf.minimum.to_numpy()
+    maximum = model.pf.maximum.to_numpy()
+    batch_size = max(1, min(int(batch_size), n_cases))
+
+    # scale parameters by their per-case curvature at the start
+    probe = model.loglike2_bhhh(start_case=0, stop_case=batch_size)
+    scale = np.sqrt(np.maximum(np.diag(np.asarray(probe.bhhh)) / batch_size, 0))
+    scale[~(scale > 0)] = 1.0
+
+    x = model.pvals.copy()
+    m = np.zeros_like(x)
+    v = np.zeros_like(x)
+    t = 0
+    history = []
+    previous_epoch_ll = None
+    epoch = 0
+    while epoch < max_epochs and batch_size < n_cases:
+        epoch += 1
+        starts = np.arange(0, n_cases, batch_size)
+        rng.shuffle(starts)
+        epoch_ll = 0.0
+        for start in starts:
+            stop = min(start + batch_size, n_cases)
+            part = model.loglike2(x, start_case=int(start), stop_case=int(stop), return_series=False)
+            epoch_ll += part.ll
+            # gradient per case, in the scaled parameters
+            g = np.asarray(part.dll, dtype=np.float64) / (stop - start) / scale
+            t += 1
+            m = beta1 * m + (1 - beta1) * g
+            v = beta2 * v + (1 - beta2) * g * g
+            m_hat = m / (1 - beta1 ** t)
+            v_hat = v / (1 - beta2 ** t)
+            step = learning_rate * m_hat / (np.sqrt(v_hat) + epsilon) / scale
+            x = np.where(freedoms, np.clip(x + step, minimum, maximum), x)
+        epoch_ll /= n_cases
+        history.append((batch_size, epoch_ll))
+        logger.debug(f"minibatch epoch {epoch}, batch size {batch_size}, loglike per case {epoch_ll}")
+        if previous_epoch_ll is not None and epoch_ll - previous_epoch_ll < rtol * abs(previous_epoch_ll):
+            batch_size *= 2
+        previous_epoch_ll = epoch_ll
+    model.set_values(x)
+
+    if finish_method is not None:
+        kwargs.setdefault('quiet', True)
+        result = model.maximize_loglike(method=finish_method, maxiter=finish_maxiter, **kwargs)
+    else:
+        result = dictx(loglike=model.loglike(), x=pd.Series(model.pvals, index=model.pnames))
+    if covariance:
+        model.calculate_parameter_covariance()
+    result = dictx(result)
+    result['minibatch_epochs'] = epoch
+    result['minibatch_history'] = pd.DataFrame(
+        history, columns=['batch_size', 'loglike_per_case'],
+        index=pd.RangeIndex(1, len(history) + 1, name='epoch'),
+    )
+    return result
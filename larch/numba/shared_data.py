@@ -0,0 +1,192 @@
+"""
+Prepared model data in shared memory.
+
+Several processes estimating models on the same data can share a single
+copy of a prepared Dataset.  One process publishes the dataset into a
+named `multiprocessing.shared_memory` block, and other processes attach
+to that block by name, getting a Dataset whose arrays are views onto the
+shared memory instead of private copies.
+
+The block starts with the length of a JSON manifest describing the
+variables, then the manifest, then the raw data of each variable.
+"""
+
+import json
+import logging
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .data_cache import _dataset_from_manifest, _variable_manifest
+
+log = logging.getLogger("Larch")
+
+_ALIGN = 64
+_HEADER_BYTES = 8
+
+# shared memory blocks attached in this process, which must stay open
+# as long as any arrays viewing them may be in use
+_attached = {}
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class SharedDataset:
+    """
+    A Dataset published to shared memory.
+
+    The process that publishes the data owns the shared memory block,
+    and should call `unlink` when no process needs the data any more.
+    The block is released by the operating system only after that, and
+    after every attached process has exited or closed it.
+    """
+
+    def __init__(self, shm):
+        self._shm = shm
+
+    @property
+    def name(self):
+        """str : The name used to attach to this data from other processes."""
+        return self._shm.name
+
+    @property
+    def size(self):
+        """int : The size of the shared memory block in bytes."""
+        return self._shm.size
+
+    def attach(self):
+        """
+        Get a Dataset viewing the shared data.
+
+        Returns
+        -------
+        Dataset
+        """
+        return attach_dataset(self.name)
+
+    def unlink(self):
+        """Remove the shared memory block."""
+        _attached.pop(self.name, None)
+        try:
+            self._shm.close()
+        except BufferError:
+            # arrays in this process still view the block, it is
+            # released when they are garbage collected
+            pass
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unlink()
+
+    def __repr__(self):
+        return f"<larch.numba.SharedDataset '{self.name}', {self.size} bytes>"
+
+
+def publish_dataset(dataset, name=None):
+    """
+    Copy a prepared Dataset into shared memory.
+
+    Parameters
+    ----------
+    dataset : Dataset
+    name : str, optional
+        The name for the shared memory block.  If not given, a unique
+        name is generated.
+
+    Returns
+    -------
+    SharedDataset
+    """
+    arrays, variables, attrs = _variable_manifest(dataset)
+    offset = 0
+    for name_, arr in arrays.items():
+        variables[name_].update(
+            offset=offset,
+            dtype=arr.dtype.str,
+            shape=list(arr.shape),
+        )
+        offset += _aligned(arr.nbytes)
+    manifest = json.dumps(dict(variables=variables, attrs=attrs)).encode("utf8")
+    data_start = _aligned(_HEADER_BYTES + len(manifest))
+    size = data_start + max(offset, 1)
+    if name is None:
+        name = f"larch_{uuid.uuid4().hex[:16]}"
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        shm.buf[:_HEADER_BYTES] = len(manifest).to_bytes(_HEADER_BYTES, 'little')
+        shm.buf[_HEADER_BYTES:_HEADER_BYTES + len(manifest)] = manifest
+        for name_, arr in arrays.items():
+            start = data_start + variables[name_]['offset']
+            target = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, offset=start)
+            target[...] = arr
+            del target
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    # attaching in this process reuses the creator's block, which must
+    # stay registered with the resource tracker, unlike blocks attached
+    # from other processes
+    _attached[shm.name] = shm
+    log.debug(f"published dataset to shared memory '{shm.name}', {size} bytes")
+    return SharedDataset(shm)
+
+
+def _open_shared(name):
+    shm = _attached.get(name)
+    if shm is not None:
+        return shm
+    try:
+        # Python 3.13+, attaching does not hand ownership to this process
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # otherwise the resource tracker would remove the block
+            # when this process exits, while others still use it
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    _attached[name] = shm
+    return shm
+
+
+def attach_dataset(name):
+    """
+    Attach to a Dataset published in shared memory.
+
+    Parameters
+    ----------
+    name : str
+        The name of the shared memory block, as given by
+        `SharedDataset.name`.
+
+    Returns
+    -------
+    Dataset
+        Arrays in the dataset view the shared memory, so changes made
+        to them are seen by every process using the data.
+    """
+    shm = _open_shared(name)
+    n = int.from_bytes(bytes(shm.buf[:_HEADER_BYTES]), 'little')
+    manifest = json.loads(bytes(shm.buf[_HEADER_BYTES:_HEADER_BYTES + n]).decode("utf8"))
+    data_start = _aligned(_HEADER_BYTES + n)
+    return _dataset_from_manifest(
+        manifest,
+        lambda name_, info: np.ndarray(
+            tuple(info['shape']),
+            dtype=np.dtype(info['dtype']),
+            buffer=shm.buf,
+            offset=data_start + info['offset'],
+        ),
+    )
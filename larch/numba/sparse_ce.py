@@ -0,0 +1,503 @@
+"""
+Evaluation of models on |idce| data without densifying it.
+
+With sampled alternatives, each case only has data for a small number of
+the alternatives, but the regular kernel works on arrays with a row for
+every alternative (and nest) of every case.  Here the choices,
+availability and outputs are all kept in the same case-alternative row
+order as the |idce| data, with the case pointers giving the rows of each
+case.  For models without nests the kernel only touches the rows that
+are present; nested models use a per-thread scratch row of nodes that is
+filled from the sparse data one case at a time, so nothing the size of
+all cases times all alternatives is ever allocated.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+from numba import njit, prange
+
+from .model import _is_cross_nested, _numba_master_case
+
+
+class CEWorkArrays(NamedTuple):
+    """Outputs of the sparse kernel, one value per case-alternative row."""
+    utility: np.ndarray
+    probability: np.ndarray
+
+
+def co_features_by_alt(model_utility_co_alt, n_alts):
+    """
+    Group the idco utility features by alternative.
+
+    Parameters
+    ----------
+    model_utility_co_alt : array of int
+        The alternative of each idco utility feature.
+    n_alts : int
+
+    Returns
+    -------
+    order : ndarray of int32
+        Feature positions, sorted by alternative.
+    alt_ptr : ndarray of int32, shape [n_alts+1]
+        The features for alternative `a` are ``order[alt_ptr[a]:alt_ptr[a+1]]``.
+    """
+    model_utility_co_alt = np.asarray(model_utility_co_alt)
+    order = np.argsort(model_utility_co_alt, kind='stable').astype(np.int32)
+    alt_ptr = np.searchsorted(
+        model_utility_co_alt[order], np.arange(n_alts + 1),
+    ).astype(np.int32)
+    return order, alt_ptr
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _ce_row_utility(
+        row,                           # int input scalar
+        alt,                           # int input scalar
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input shape=[1]
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        co_order,                      # int input shape=[n_co_features]
+        co_alt_ptr,                    # int input shape=[n_alts+1]
+        parameter_arr,                 # float input shape=[n_params]
+        array_co,                      # float input shape=[n_co_vars]
+        array_ce_data,                 # float input shape=[n_casealts, n_ca_vars]
+):
+    u = 0.0
+    if model_q_ca_param.shape[0]:
+        if model_q_scale_param[0] >= 0:
+            theta = parameter_arr[model_q_scale_param[0]]
+        else:
+            theta = 1.0
+        size = 0.0
+        for i in range(model_q_ca_param.shape[0]):
+            size += (
+                array_ce_data[row, model_q_ca_data[i]]
+                * model_q_ca_param_scale[i]
+                * np.exp(parameter_arr[model_q_ca_param[i]])
+            )
+        u += np.log(size) * theta
+    for i in range(model_utility_ca_param.shape[0]):
+        u += (
+            array_ce_data[row, model_utility_ca_data[i]]
+            * model_utility_ca_param_scale[i]
+            * parameter_arr[model_utility_ca_param[i]]
+        )
+    for k in range(co_alt_ptr[alt], co_alt_ptr[alt + 1]):
+        i = co_order[k]
+        if model_utility_co_data[i] == -1:
+            u += parameter_arr[model_utility_co_param[i]] * model_utility_co_param_scale[i]
+        else:
+            u += (
+                array_co[model_utility_co_data[i]]
+                * model_utility_co_param_scale[i]
+                * parameter_arr[model_utility_co_param[i]]
+            )
+    return u
+
+
+@njit(error_model='numpy', fastmath=True, cache=True)
+def _ce_row_gradient(
+        row,                           # int input scalar
+        alt,                           # int input scalar
+        weight,                        # float input scalar
+        model_q_ca_param_scale,        # float input shape=[n_q_ca_features]
+        model_q_ca_param,              # int input shape=[n_q_ca_features]
+        model_q_ca_data,               # int input shape=[n_q_ca_features]
+        model_q_scale_param,           # int input shape=[1]
+        model_utility_ca_param_scale,  # float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # int input shape=[n_u_ca_features]
+        model_utility_co_param_scale,  # float input shape=[n_co_features]
+        model_utility_co_param,        # int input shape=[n_co_features]
+        model_utility_co_data,         # int input shape=[n_co_features]
+        co_order,                      # int input shape=[n_co_features]
+        co_alt_ptr,                    # int input shape=[n_alts+1]
+        holdfast_arr,                  # int8 input shape=[n_params]
+        parameter_arr,                 # float input shape=[n_params]
+        array_co,                      # float input shape=[n_co_vars]
+        array_ce_data,                 # float input shape=[n_casealts, n_ca_vars]
+        gradient,                      # float output shape=[n_params]
+):
+    """
+    Add weight * dU/dparams for one case-alternative row to the gradient.
+    """
+    if model_q_ca_param.shape[0]:
+        q_scale_slot = model_q_scale_param[0]
+        if q_scale_slot >= 0:
+            theta = parameter_arr[q_scale_slot]
+        else:
+            theta = 1.0
+        size = 0.0
+        for i in range(model_q_ca_param.shape[0]):
+            size += (
+                array_ce_data[row, model_q_ca_data[i]]
+                * model_q_ca_param_scale[i]
+                * np.exp(parameter_arr[model_q_ca_param[i]])
+            )
+        if size > 0:
+            if q_scale_slot >= 0 and not holdfast_arr[q_scale_slot]:
+                gradient[q_scale_slot] += weight * np.log(size)
+            for i in range(model_q_ca_param.shape[0]):
+                p = model_q_ca_param[i]
+                if not holdfast_arr[p]:
+                    gradient[p] += weight * theta * (
+                        array_ce_data[row, model_q_ca_data[i]]
+                        * model_q_ca_param_scale[i]
+                        * np.exp(parameter_arr[p])
+                    ) / size
+    for i in range(model_utility_ca_param.shape[0]):
+        p = model_utility_ca_param[i]
+        if not holdfast_arr[p]:
+            gradient[p] += weight * array_ce_data[row, model_utility_ca_data[i]] * model_utility_ca_param_scale[i]
+    for k in range(co_alt_ptr[alt], co_alt_ptr[alt + 1]):
+        i = co_order[k]
+        p = model_utility_co_param[i]
+        if holdfast_arr[p]:
+            continue
+        if model_utility_co_data[i] == -1:
+            gradient[p] += weight * model_utility_co_param_scale[i]
+        else:
+            gradient[p] += weight * array_co[model_utility_co_data[i]] * model_utility_co_param_scale[i]
+
+
+@njit(error_model='numpy', fastmath=True, cache=True, parallel=True, nogil=True)
+def _numba_sparse_ce_reduce(
+        model_q_ca_param_scale,  # [0] float input shape=[n_q_ca_features]
+        model_q_ca_param,        # [1] int input shape=[n_q_ca_features]
+        model_q_ca_data,         # [2] int input shape=[n_q_ca_features]
+        model_q_scale_param,     # [3] int input shape=[1]
+
+        model_utility_ca_param_scale,  # [4] float input shape=[n_u_ca_features]
+        model_utility_ca_param,        # [5] int input shape=[n_u_ca_features]
+        model_utility_ca_data,         # [6] int input shape=[n_u_ca_features]
+
+        model_utility_co_alt,          # [ 7] int input shape=[n_co_features]
+        model_utility_co_param_scale,  # [ 8] float input shape=[n_co_features]
+        model_utility_co_param,        # [ 9] int input shape=[n_co_features]
+        model_utility_co_data,         # [10] int input shape=[n_co_features]
+
+        edgeslots,     # [11] int input shape=[edges, 4]
+        mu_slots,      # [12] int input shape=[nests]
+        start_slots,   # [13] int input shape=[nests]
+        len_slots,     # [14] int input shape=[nests]
+
+        holdfast_arr,  # [15] int8 input shape=[n_params]
+        parameter_arr, # [16] float input shape=[n_params]
+
+        ce_ch,             # float input shape=[n_casealts]
+        ce_av,             # int8 input shape=[n_casealts]
+        array_wt,          # float input shape=[n_cases]
+        array_co,          # float input shape=[n_cases, n_co_vars]
+        array_ce_data,     # float input shape=[n_casealts, n_ca_vars]
+        array_ce_altidx,   # int input shape=[n_casealts]
+        array_ce_caseptr,  # int input shape=[n_cases+1]
+
+        return_flags,  # int8 input shape=[4]
+
+        co_order,      # int input shape=[n_co_features]
+        co_alt_ptr,    # int input shape=[n_alts+1]
+        cases,         # int input shape=[n_selected]
+        n_alts,        # int input
+        d_penalty,     # float input shape=[n_params or 0]
+        n_blocks,      # int input
+
+        utility,             # float output shape=[n_casealts or 0]
+        probability,         # float output shape=[n_casealts or 0]
+        casewise_d_loglike,  # float output shape=[n_selected or 0, n_params]
+        casewise_loglike,    # float output shape=[n_selected or 0]
+        bhhh,                # float output shape=[n_params, n_params]
+        d_loglike,           # float output shape=[n_params]
+        loglike,             # float output shape=[1]
+):
+    """
+    Evaluate the selected cases of sparse |idce| data, reducing in the kernel.
+
+    Blocks of cases are processed in parallel as in `_numba_master_reduce`.
+    When the nesting graph has only a root with no mu parameter, each case
+    is evaluated directly on its own rows of data; otherwise each case is
+    scattered into a scratch row of nodes and evaluated with
+    `_numba_master_case`.  Utility and probability are written per
+    case-alternative row, only when those outputs have non-zero length.
+    """
+    n_params = parameter_arr.shape[0]
+    n_nodes = n_alts + mu_slots.shape[0]
+    n_selected = cases.shape[0]
+    return_grad = return_flags[2]
+    return_bhhh = return_flags[3]
+    keep_nodes = utility.shape[0] > 0
+    keep_casewise = casewise_loglike.shape[0] > 0
+    use_penalty = d_penalty.shape[0] > 0
+    flat = mu_slots.shape[0] == 1 and mu_slots[0] < 0 and not _is_cross_nested(edgeslots)
+    block_size = (n_selected + n_blocks - 1) // n_blocks
+    upslots = edgeslots[:, 0]
+    dnslots = edgeslots[:, 1]
+
+    max_rows = 0
+    for k in range(n_selected):
+        c = cases[k]
+        n_rows = array_ce_caseptr[c + 1] - array_ce_caseptr[c]
+        if n_rows > max_rows:
+            max_rows = n_rows
+
+    partial_bhhh = np.zeros((n_blocks, n_params, n_params), dtype=bhhh.dtype)
+    partial_d_loglike = np.zeros((n_blocks, n_params), dtype=d_loglike.dtype)
+    partial_loglike = np.zeros(n_blocks, dtype=loglike.dtype)
+
+    for b in prange(n_blocks):
+        case_bhhh = np.zeros((n_params, n_params), dtype=bhhh.dtype)
+        case_d_loglike = np.zeros(n_params, dtype=d_loglike.dtype)
+        case_loglike = np.zeros(1, dtype=loglike.dtype)
+        # scratch for the flat path
+        row_utility = np.zeros(max_rows, dtype=d_loglike.dtype)
+        row_probability = np.zeros(max_rows, dtype=d_loglike.dtype)
+        expected = np.zeros(n_params, dtype=d_loglike.dtype)
+        gradient = np.zeros(n_params, dtype=d_loglike.dtype)
+        # scratch for the nested path
+        node_ch = np.zeros(n_nodes, dtype=ce_ch.dtype)
+        node_av = np.zeros(n_nodes, dtype=np.int8)
+        node_utility = np.zeros(n_nodes, dtype=array_ce_data.dtype)
+        node_logprob = np.zeros(n_nodes, dtype=array_ce_data.dtype)
+        node_probability = np.zeros(n_nodes, dtype=array_ce_data.dtype)
+        node_ca = np.zeros((n_alts, 0), dtype=array_ce_data.dtype)
+        node_ptr = np.zeros(2, dtype=array_ce_caseptr.dtype)
+        case_dutility = np.zeros((0, n_params), dtype=d_loglike.dtype)
+        case_adjoint = np.zeros(n_nodes, dtype=d_loglike.dtype)
+
+        case_stop = min((b + 1) * block_size, n_selected)
+        for k in range(b * block_size, case_stop):
+            c = cases[k]
+            row_start = array_ce_caseptr[c]
+            row_stop = array_ce_caseptr[c + 1]
+            wt = array_wt[c]
+            case_loglike[0] = 0.0
+
+            if flat:
+                shifter = -np.inf
+                for row in range(row_start, row_stop):
+                    if ce_av[row]:
+                        u = _ce_row_utility(
+                            row,
+                            array_ce_altidx[row],
+                            model_q_ca_param_scale,
+                            model_q_ca_param,
+                            model_q_ca_data,
+                            model_q_scale_param,
+                            model_utility_ca_param_scale,
+                            model_utility_ca_param,
+                            model_utility_ca_data,
+                            model_utility_co_param_scale,
+                            model_utility_co_param,
+                            model_utility_co_data,
+                            co_order,
+                            co_alt_ptr,
+                            parameter_arr,
+                            array_co[c],
+                            array_ce_data,
+                        )
+                    else:
+                        u = -np.inf
+                    row_utility[row - row_start] = u
+                    if u > shifter:
+                        shifter = u
+                total = 0.0
+                for j in range(row_stop - row_start):
+                    if row_utility[j] > -np.inf:
+                        total += np.exp(row_utility[j] - shifter)
+                if total > 0:
+                    logsum = np.log(total) + shifter
+                else:
+                    logsum = np.inf
+                for row in range(row_start, row_stop):
+                    j = row - row_start
+                    if row_utility[j] > -np.inf:
+                        row_probability[j] = np.exp(row_utility[j] - logsum)
+                    else:
+                        row_probability[j] = 0.0
+                    if ce_ch[row]:
+                        case_loglike[0] += (row_utility[j] - logsum) * ce_ch[row] * wt
+                    if keep_nodes:
+                        utility[row] = row_utility[j]
+                        probability[row] = row_probability[j]
+
+                if return_grad or return_bhhh:
+                    case_d_loglike[:] = 0.0
+                    if return_bhhh:
+                        case_bhhh[:, :] = 0.0
+                    expected[:] = 0.0
+                    for row in range(row_start, row_stop):
+                        if row_probability[row - row_start] > 0:
+                            _ce_row_gradient(
+                                row,
+                                array_ce_altidx[row],
+                                row_probability[row - row_start],
+                                model_q_ca_param_scale,
+                                model_q_ca_param,
+                                model_q_ca_data,
+                                model_q_scale_param,
+                                model_utility_ca_param_scale,
+                                model_utility_ca_param,
+                                model_utility_ca_data,
+                                model_utility_co_param_scale,
+                                model_utility_co_param,
+                                model_utility_co_data,
+                                co_order,
+                                co_alt_ptr,
+                                holdfast_arr,
+                                parameter_arr,
+                                array_co[c],
+                                array_ce_data,
+                                expected,
+                            )
+                    for row in range(row_start, row_stop):
+                        this_ch = ce_ch[row]
+                        if this_ch == 0 or not row_probability[row - row_start] > 0:
+                            continue
+                        for i in range(n_params):
+                            gradient[i] = -expected[i]
+                        _ce_row_gradient(
+                            row,
+                            array_ce_altidx[row],
+                            1.0,
+                            model_q_ca_param_scale,
+                            model_q_ca_param,
+                            model_q_ca_data,
+                            model_q_scale_param,
+                            model_utility_ca_param_scale,
+                            model_utility_ca_param,
+                            model_utility_ca_data,
+                            model_utility_co_param_scale,
+                            model_utility_co_param,
+                            model_utility_co_data,
+                            co_order,
+                            co_alt_ptr,
+                            holdfast_arr,
+                            parameter_arr,
+                            array_co[c],
+                            array_ce_data,
+                            gradient,
+                        )
+                        weight = this_ch * wt
+                        for i in range(n_params):
+                            case_d_loglike[i] += gradient[i] * weight
+                        if return_bhhh:
+                            for i in range(n_params):
+                                _temp = gradient[i] * weight
+                                if _temp:
+                                    for j in range(n_params):
+                                        case_bhhh[i, j] += _temp * gradient[j]
+            else:
+                node_ch[:] = 0
+                node_av[:] = 0
+                for row in range(row_start, row_stop):
+                    node_ch[array_ce_altidx[row]] = ce_ch[row]
+                    node_av[array_ce_altidx[row]] = ce_av[row]
+                for s in range(upslots.size):
+                    node_ch[upslots[s]] += node_ch[dnslots[s]]
+                    if node_av[dnslots[s]]:
+                        node_av[upslots[s]] = 1
+                node_ptr[0] = row_start
+                node_ptr[1] = row_stop
+                _numba_master_case(
+                    model_q_ca_param_scale,
+                    model_q_ca_param,
+                    model_q_ca_data,
+                    model_q_scale_param,
+                    model_utility_ca_param_scale,
+                    model_utility_ca_param,
+                    model_utility_ca_data,
+                    model_utility_co_alt,
+                    model_utility_co_param_scale,
+                    model_utility_co_param,
+                    model_utility_co_data,
+                    edgeslots,
+                    mu_slots,
+                    start_slots,
+                    len_slots,
+                    holdfast_arr,
+                    parameter_arr,
+                    node_ch,
+                    node_av,
+                    array_wt[c:c + 1],
+                    array_co[c],
+                    node_ca,
+                    array_ce_data,
+                    array_ce_altidx,
+                    node_ptr,
+                    return_flags,
+                    case_dutility,
+                    case_adjoint,
+                    gradient,
+                    node_utility,
+                    node_logprob,
+                    node_probability,
+                    case_bhhh,
+                    case_d_loglike,
+                    case_loglike,
+                )
+                if keep_nodes:
+                    for row in range(row_start, row_stop):
+                        utility[row] = node_utility[array_ce_altidx[row]]
+                        probability[row] = node_probability[array_ce_altidx[row]]
+
+            partial_loglike[b] += case_loglike[0]
+            if keep_casewise:
+                casewise_loglike[k] = case_loglike[0]
+            if return_grad or return_bhhh:
+                if keep_casewise:
+                    casewise_d_loglike[k, :] = case_d_loglike
+                partial_d_loglike[b, :] += case_d_loglike
+                if return_bhhh:
+                    if use_penalty:
+                        # match the casewise outer product of the penalized gradient
+                        for i in range(n_params):
+                            g_i = case_d_loglike[i] + d_penalty[i]
+                            for j in range(n_params):
+                                partial_bhhh[b, i, j] += g_i * (case_d_loglike[j] + d_penalty[j])
+                    else:
+                        partial_bhhh[b, :, :] += case_bhhh
+
+    loglike[0] = 0.0
+    d_loglike[:] = 0.0
+    bhhh[:, :] = 0.0
+    for b in range(n_blocks):
+        loglike[0] += partial_loglike[b]
+        d_loglike[:] += partial_d_loglike[b]
+        bhhh[:, :] += partial_bhhh[b]
+
+
+def ce_to_dense_nodes(values, ce_altidx, ce_caseptr, cases, n_nodes, fill):
+    """
+    Expand per-row values of the selected cases to a dense [cases, nodes] array.
+
+    Parameters
+    ----------
+    values : array, shape [n_casealts]
+    ce_altidx : array of int, shape [n_casealts]
+    ce_caseptr : array of int, shape [n_cases+1]
+    cases : array of int
+        Positions of the cases to include.
+    n_nodes : int
+    fill : scalar
+        Value for alternatives with no row, and for nests.
+
+    Returns
+    -------
+    ndarray
+    """
+    out = np.full((len(cases), n_nodes), fill, dtype=values.dtype)
+    lengths = ce_caseptr[cases + 1] - ce_caseptr[cases]
+    out_rows = np.repeat(np.arange(len(cases)), lengths)
+    rows = np.concatenate(
+        [np.arange(ce_caseptr[c], ce_caseptr[c + 1]) for c in cases]
+    ) if len(cases) else np.zeros(0, dtype=np.int64)
+    out[out_rows, ce_altidx[rows]] = values[rows]
+    return out
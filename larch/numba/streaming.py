@@ -0,0 +1,125 @@
+"""
+Streaming evaluation of models over chunks of cases.
+
+These tools let a model walk through its data a fixed number of cases
+at a time, so that only one or two chunks of data need to be held in
+memory at once.  Data can come from a `Dataset` whose variables are
+lazy (e.g. opened from a zarr store with `xarray.open_zarr`) or backed
+by memory-mapped arrays, or from `DataArrays` already in memory.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .data_arrays import DataArrays
+
+
+def chunk_bounds(n_cases, chunk_size, caseslice=None):
+    """
+    Generate the bounds of chunks of cases.
+
+    Parameters
+    ----------
+    n_cases : int
+        The total number of cases in the data.
+    chunk_size : int
+        The number of selected cases in each chunk.
+    caseslice : slice, optional
+        Select a subset of the cases, with a positive step.
+
+    Yields
+    ------
+    start, stop, step : int
+        A contiguous range of case positions covering one chunk, and the
+        step used to select cases within that range.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, not {chunk_size}")
+    if caseslice is None:
+        caseslice = slice(None)
+    start, stop, step = caseslice.indices(n_cases)
+    if step < 1:
+        raise ValueError("streaming evaluation requires a positive step_case")
+    span = chunk_size * step
+    for lo in range(start, stop, span):
+        yield lo, min(lo + span, stop), step
+
+
+def load_chunk(source, start, stop, step=1, graph=None, float_dtype=np.float64):
+    """
+    Load one chunk of cases into memory.
+
+    Parameters
+    ----------
+    source : Dataset or DataArrays
+        The data to load from.  A Dataset is sliced before its values
+        are read, so that lazy or memory-mapped variables only load
+        the requested cases.  DataArrays are sliced and copied, except
+        for any idce data, which is shared by all chunks and read
+        through the case pointers as needed.
+    start, stop, step : int
+        The range of case positions to load.
+    graph : NestingTree, optional
+        Required when `source` is a Dataset.
+    float_dtype : dtype, default np.float64
+        Used when `source` is a Dataset.
+
+    Returns
+    -------
+    DataArrays
+    """
+    if isinstance(source, DataArrays):
+        caseslice = slice(start, stop, step)
+        return DataArrays(
+            ch=np.ascontiguousarray(source.ch[caseslice]),
+            av=np.ascontiguousarray(source.av[caseslice]),
+            wt=np.ascontiguousarray(source.wt[caseslice]),
+            co=np.ascontiguousarray(source.co[caseslice]),
+            ca=np.ascontiguousarray(source.ca[caseslice]),
+            ce_data=source.ce_data,
+            ce_altidx=source.ce_altidx,
+            ce_caseptr=(
+                np.ascontiguousarray(source.ce_caseptr[caseslice])
+                if source.ce_caseptr.ndim == 2
+                else source.ce_caseptr
+            ),
+        )
+    if graph is None:
+        raise ValueError("a graph is required to load chunks from a Dataset")
+    arrays = source.dc.slice_cases(start, stop).dc.to_arrays(
+        graph,
+        float_dtype=float_dtype,
+    )
+    if step != 1:
+        arrays = arrays.cs[::step]
+    return arrays
+
+
+def prefetched(loaders):
+    """
+    Yield the results of a sequence of loading functions in order.
+
+    While each result is being consumed, the next one is loaded in a
+    background thread.  The model kernels release the GIL, so reading
+    and decompressing the next chunk overlaps with computing on the
+    current chunk.
+
+    Parameters
+    ----------
+    loaders : Sequence[Callable]
+        Functions taking no arguments.
+
+    Yields
+    ------
+    Any
+        The return value of each loader.
+    """
+    if not loaders:
+        return
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(loaders[0])
+        for i in range(len(loaders)):
+            result = pending.result()
+            if i + 1 < len(loaders):
+                pending = pool.submit(loaders[i + 1])
+            yield result
@@ -14,6 +14,67 @@ else:
 	_omx_base_class = _tb.file.File
 
 
+# target size in bytes of each contiguous block of rows read by `rc_lookup`
+RC_BLOCK_BYTES = 32 * 2**20
+
+
+def rc_lookup(matrix, row_indexes, col_indexes, block_bytes=None):
+	"""
+	Get values from a matrix at many (row, col) coordinates.
+
+	Instead of fetching each coordinate separately, the requested
+	rows are sorted and read from the matrix in contiguous blocks of
+	whole rows, and the values are then gathered from each block
+	with numpy fancy indexing and scattered back to their original
+	positions.  This is much faster than point indexing for on-disk
+	matrices, which decompress a whole chunk for every point read.
+
+	Parameters
+	----------
+	matrix : tables.Array or array-like
+		A two dimensional matrix.
+	row_indexes, col_indexes : array-like
+		Zero-based row and column index for each value.  These must
+		have the same shape, which is also the shape of the result.
+	block_bytes : int, optional
+		Target size of each block of rows read from the matrix,
+		defaults to `RC_BLOCK_BYTES`.
+
+	Returns
+	-------
+	numpy.ndarray
+	"""
+	rows = numpy.asarray(row_indexes)
+	cols = numpy.asarray(col_indexes)
+	shape = rows.shape
+	rows = rows.reshape(-1).astype(numpy.int64)
+	cols = cols.reshape(-1).astype(numpy.int64)
+	n_rows, n_cols = matrix.shape
+	rows[rows < 0] += n_rows
+	cols[cols < 0] += n_cols
+	if rows.size and (rows.min() < 0 or rows.max() >= n_rows or cols.min() < 0 or cols.max() >= n_cols):
+		raise IndexError(f"coordinates out of bounds for matrix with shape {matrix.shape}")
+	out = numpy.empty(rows.shape, dtype=matrix.dtype)
+	if rows.size == 0:
+		return out.reshape(shape)
+	if block_bytes is None:
+		block_bytes = RC_BLOCK_BYTES
+	block_rows = max(1, int(block_bytes // max(1, n_cols * matrix.dtype.itemsize)))
+	order = numpy.argsort(rows, kind='stable')
+	sorted_rows = rows[order]
+	sorted_cols = cols[order]
+	start = 0
+	while start < sorted_rows.size:
+		lo = sorted_rows[start]
+		hi = min(lo + block_rows, n_rows)
+		stop = numpy.searchsorted(sorted_rows, hi, side='left')
+		# only read up to the last row actually needed in this block
+		block = matrix[lo:sorted_rows[stop - 1] + 1, :]
+		out[order[start:stop]] = block[sorted_rows[start:stop] - lo, sorted_cols[start:stop]]
+		start = stop
+	return out.reshape(shape)
+
+
 class OMX_Error(Exception):
 	pass
 
@@ -815,8 +876,10 @@ class OMX(_omx_base_class):
 
 		Parameters
 		----------
-		r,c : int
+		r,c : int or array-like
 			Coordinate to extract.  This is the zero-based index.
+			Arrays of coordinates are looked up together with
+			`rc_lookup`.
 
 		Returns
 		-------
@@ -826,6 +889,11 @@ class OMX(_omx_base_class):
 		"""
 		from .util import Dict
 		result = Dict()
+		if numpy.ndim(r) or numpy.ndim(c):
+			r, c = numpy.broadcast_arrays(r, c)
+			for name,vals in self.data._v_children.items():
+				result[name] = rc_lookup(vals, r, c)
+			return result
 		for name,vals in self.data._v_children.items():
 			result[name] = vals[r,c]
 		return result
@@ -857,6 +925,11 @@ class OMX(_omx_base_class):
 		Returns
 		-------
 		pandas.DataFrame
+
+		Notes
+		-----
+		Values are read from each matrix in contiguous blocks of rows,
+		see `rc_lookup`.
 		"""
 		if mat_names is None:
 			mat_names = list(self.data._v_children.keys())
@@ -872,10 +945,13 @@ class OMX(_omx_base_class):
 		elif isinstance(col_indexes, int):
 			col_indexes = numpy.full_like(row_indexes, col_indexes)
 
-		data = {
-			mat: self[mat][row_indexes, col_indexes]
-			for mat in _mat_names
-		}
+		data = {}
+		for mat in _mat_names:
+			node = self[mat]
+			if len(node.shape) == 2:
+				data[mat] = rc_lookup(node, row_indexes, col_indexes)
+			else:
+				data[mat] = node[row_indexes, col_indexes]
 
 		if index is None:
 			try:
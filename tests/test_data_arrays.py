@@ -48,3 +48,27 @@ def test_shared_data():
     assert list(y.keys()) == ['co', 'ca', 'ch', 'wt', 'av']
     assert y.dims == {CASEID: 5029, ALTID: 6, 'var_co': 1, 'var_ca': 2}
     assert y.wt.values[:3] == approx(np.array([142.5, 117.5, 112.5], dtype=np.float32))
+
+
+def test_choice_code_values():
+    m = lx.example(1, legacy=True)
+    m.choice_co_code = 'chosen_alt'
+    chose = m.dataservice.data_ca['chose'].unstack().to_numpy()
+    chosen_alt = np.where(chose)[1] + 1
+    chosen_alt[0] = 99  # not an alternative
+    ds = lxd.to_dataset(m.dataservice)
+    ds['chosen_alt'] = sh.DataArray(chosen_alt, dims=['_caseid_',])
+    y, flows = lxd.prepare_data(ds, m)
+    assert y.ch.values[0].sum() == 0
+    assert y.ch.values[1:] == approx(chose[1:])
+
+
+def test_choice_co_vars():
+    m = lx.example(1, legacy=True)
+    chose = m.dataservice.data_ca['chose'].unstack().to_numpy()
+    m.choice_co_vars = {a: f'chosen_alt == {a}' for a in range(1, 7)}
+    ds = lxd.to_dataset(m.dataservice)
+    ds['chosen_alt'] = sh.DataArray(np.where(chose)[1] + 1, dims=['_caseid_',])
+    y, flows = lxd.prepare_data(ds, m)
+    assert list(y.ch.dims) == [CASEID, ALTID]
+    assert y.ch.values == approx(chose)
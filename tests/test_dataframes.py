@@ -577,3 +577,70 @@ def test_promotion_ce_to_ca():
 	assert dfs.data_ce is None
 	assert dfs.data_ca is not None
 	assert dfs.data_ca.shape == (30174, 6)
+
+
+def test_ce_conversions():
+	from larch.data_warehouse import example_file
+
+	ca = pandas.read_csv(example_file('MTCwork.csv.gz'), index_col=('casenum', 'altnum'))
+	dfs = DataFrames(ca, ch="chose", crack=True)
+	ce_index = dfs.data_ce.index
+
+	expanded = dfs.data_ce_as_ca()
+	reference = dfs.data_ce.unstack().fillna(0).stack()
+	pandas.testing.assert_frame_equal(expanded, reference, check_dtype=False)
+
+	ch_ce = dfs.data_ch_as_ce()
+	assert ch_ce.shape == (22033, 1)
+	assert ch_ce.iloc[:, 0].values == approx(
+		dfs.data_ch.stack().reindex(ce_index).values
+	)
+	assert ch_ce.values.sum() == approx(dfs.data_ch.values.sum())
+
+	av_ce = dfs.data_av_as_ce()
+	assert av_ce.shape == (22033, 1)
+	assert (av_ce.values == 1).all()
+
+	wt_ce = dfs.data_wt_as_ce()
+	if wt_ce is not None:
+		assert wt_ce.shape == (22033, 1)
+
+	arr = numpy.arange(dfs.n_cases * dfs.n_alts, dtype=numpy.float64).reshape(dfs.n_cases, dfs.n_alts)
+	s = dfs.array_to_ce(arr)
+	caseidx = numpy.unique(ce_index.codes[0], return_inverse=True)[1]
+	assert s.values == approx(arr[caseidx, ce_index.codes[1]])
+
+
+def test_dfs_feathers_memory_map():
+	import tempfile
+	m = example(1, legacy=True)
+	m.load_data()
+	df = pandas.read_csv(example_file("MTCwork.csv.gz"))
+	df.set_index(['casenum', 'altnum'], inplace=True)
+	ds = DataFrames(df)
+	with tempfile.TemporaryDirectory() as td:
+		filename = os.path.join(td, 'dfs')
+		m.dataframes.to_feathers(filename, uncompressed=True)
+		dfs2 = DataFrames.from_feathers(filename, memory_map=True)
+		pandas.testing.assert_frame_equal(m.dataframes.data_co, dfs2.data_co)
+		pandas.testing.assert_frame_equal(m.dataframes.data_ca, dfs2.data_ca)
+		pandas.testing.assert_frame_equal(m.dataframes.data_av, dfs2.data_av)
+		pandas.testing.assert_frame_equal(m.dataframes.data_ch, dfs2.data_ch)
+		# viewed in place from the memory map, not copied
+		assert not dfs2.data_co.values.flags.writeable
+		assert not dfs2.data_ca.values.flags.writeable
+		assert dfs2.data_ch.values.flags.writeable
+
+		filename2 = os.path.join(td, 'dfs_ce')
+		ds.to_feathers(filename2, uncompressed=True)
+		ds2 = DataFrames.from_feathers(filename2, memory_map=True)
+		pandas.testing.assert_frame_equal(ds.data_ce, ds2.data_ce)
+		assert not ds2.data_ce.values.flags.writeable
+		ds3 = DataFrames.from_feathers(filename2)
+		pandas.testing.assert_frame_equal(ds.data_ce, ds3.data_ce)
+
+		d_ce = ds.data_ce.copy()
+		ds.data_ce.iloc[:] = 0.0
+		ds.inject_feathers(filename2)
+		pandas.testing.assert_frame_equal(ds.data_ce, d_ce)
+		del dfs2, ds2, ds3
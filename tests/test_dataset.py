@@ -13,3 +13,104 @@ def test_dataset():
 
     assert d.dc['chose'].dc.CASEID == 'caseid'
     assert d.dc['chose'].dc.ALTID == 'altid'
+
+
+def test_sample_alternatives():
+    import numpy as np
+    d = lx.examples.MTC(format='dataset')
+    size = np.asarray([4.0, 2.0, 1.0, 1.0, 0.5, 0.5])
+    s = d.dc.sample_alternatives(3, size=size, chosen='chose', avail='avail', seed=42)
+
+    assert s.dc.CASEALT == '_casealt_'
+    ptr = s[s.dc.CASEPTR].values
+    altidx = s[s.dc.ALTIDX].values
+    assert ptr.shape == (d.dims['caseid'] + 1,)
+    assert ptr[-1] == altidx.size
+    assert np.all(np.diff(ptr) >= 1)
+    assert np.all(np.diff(ptr) <= 4)
+    # every chosen alternative is in the sample
+    assert s['chose'].values.sum() == approx(d['chose'].values.sum())
+    # unavailable alternatives are never drawn, unless chosen
+    assert np.all((s['avail'].values != 0) | (s['chose'].values != 0))
+
+    # correction is log(n_j) - log(K * q_j)
+    av = d['avail'].values
+    corr = s['sampling_correction'].values
+    for c in range(5):
+        rows = slice(ptr[c], ptr[c + 1])
+        w = np.where(av[c] != 0, size, 0)
+        q = w[altidx[rows]] / w.sum()
+        n = np.exp(corr[rows]) * 3 * q
+        assert n == approx(np.round(n))
+        assert np.round(n).sum() == 3 + int(d['chose'].values[c].sum())
+
+    again = d.dc.sample_alternatives(3, size=size, chosen='chose', avail='avail', seed=42)
+    assert np.array_equal(again[again.dc.ALTIDX].values, altidx)
+
+
+def test_sample_alternatives_strata():
+    import numpy as np
+    d = lx.examples.MTC(format='dataset')
+    strata = np.asarray(['car', 'car', 'car', 'transit', 'active', 'active'])
+    s = d.dc.sample_alternatives(
+        {'car': 2, 'transit': 1, 'active': 0}, strata=strata, seed=0,
+    )
+    altidx = s[s.dc.ALTIDX].values
+    ptr = s[s.dc.CASEPTR].values
+    assert not np.isin(altidx, [4, 5]).any()
+    assert all(3 in case for case in np.split(altidx, ptr[1:-1]))
+    # each transit draw is certain, so its correction is zero
+    assert s['sampling_correction'].values[altidx == 3] == approx(0.0)
+
+
+def test_subset_subspaces_lazy_skims():
+    import numpy as np
+    from larch.numba import example, Dataset, DataTree
+    hh, tour, skims = example(200, ['hh', 'tour', 'skims'])
+    tours = Dataset.construct(tour.set_index('TOURID'), caseid='TOURID')
+    hh = Dataset(hh.set_index('HHID'))
+    od = Dataset.construct.from_omx_lazy(skims)
+    assert od['AUTO_TIME'].chunks is not None
+    tree = DataTree(
+        tours=tours,
+        hh=hh,
+        od=od,
+        root_node_name='tours',
+        relationships=(
+            "tours.HHID @ hh.HHID",
+            "hh.HOMETAZ @ od.otaz",
+            "tours.DTAZ @ od.dtaz",
+        ),
+    )
+    trimmed = tree.subset_subspaces({'co': ['AUTO_TIME', 'log(AUTO_DIST)']})
+    sub = trimmed.subspaces['od']
+    assert set(sub.data_vars) == {'AUTO_TIME', 'AUTO_DIST'}
+    assert sub['AUTO_TIME'].chunks is None
+    assert set(sub.otaz.values) == set(np.unique(hh['HOMETAZ'].values))
+    assert set(sub.dtaz.values) == set(np.unique(tours['DTAZ'].values))
+    full = od['AUTO_TIME'].sel(otaz=sub.otaz, dtaz=sub.dtaz).values
+    assert sub['AUTO_TIME'].values == approx(full)
+    trimmed.digitize_relationships(inplace=True)
+    flow = trimmed.setup_flow({'t': 'AUTO_TIME'})
+    expected = od['AUTO_TIME'].values[
+        hh.sel(HHID=tours['HHID'].values)['HOMETAZ'].values - 1,
+        tours['DTAZ'].values - 1,
+    ]
+    assert flow.load(trimmed, dtype=np.float64).reshape(-1) == approx(expected)
+
+    # prepared data only trims lazy trees, and reuses the trimmed tree
+    from larch.numba.data_arrays import _subset_lazy_subspaces
+    request = {'co': ['AUTO_TIME']}
+    first = _subset_lazy_subspaces(tree, request)
+    assert set(first.subspaces['od'].data_vars) == {'AUTO_TIME'}
+    assert _subset_lazy_subspaces(tree, request) is first
+    assert _subset_lazy_subspaces(tree, {'co': ['AUTO_DIST']}) is not first
+    assert _subset_lazy_subspaces(trimmed, request) is trimmed
+    # replacing source data in place invalidates the cached tree
+    first = _subset_lazy_subspaces(tree, request)
+    tree.subspaces['od']['AUTO_TIME'] = od['AUTO_TIME'] * 2
+    second = _subset_lazy_subspaces(tree, request)
+    assert second is not first
+    assert second.subspaces['od']['AUTO_TIME'].values == approx(
+        first.subspaces['od']['AUTO_TIME'].values * 2
+    )
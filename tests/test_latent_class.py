@@ -175,3 +175,77 @@ def test_latent_class_full_data(swissmetro_raw_df):
 		'B_TIME': -40104.940072046316,
 		'W_OTHER': 245.43145056623683,
 	})
+
+
+def test_latent_class_numba(swissmetro_raw_df):
+	from larch.numba import Model as NumbaModel
+
+	dfs = larch.DataFrames(swissmetro_raw_df, alt_codes=[1,2,3])
+
+	m1 = NumbaModel(dataservice=dfs)
+	m1.availability_co_vars = {
+		1: "TRAIN_AV_SP",
+		2: "SM_AV",
+		3: "CAR_AV_SP",
+	}
+	m1.choice_co_code = 'CHOICE'
+	m1.utility_co[1] = P("ASC_TRAIN") + X("TRAIN_CO*(GA==0)") * P("B_COST")
+	m1.utility_co[2] = X("SM_CO*(GA==0)") * P("B_COST")
+	m1.utility_co[3] = P("ASC_CAR") + X("CAR_CO") * P("B_COST")
+
+	m2 = NumbaModel(dataservice=dfs)
+	m2.availability_co_vars = {
+		1: "TRAIN_AV_SP",
+		2: "SM_AV",
+		3: "CAR_AV_SP",
+	}
+	m2.choice_co_code = 'CHOICE'
+	m2.utility_co[1] = P("ASC_TRAIN") + X("TRAIN_TT") * P("B_TIME") + X("TRAIN_CO*(GA==0)") * P("B_COST")
+	m2.utility_co[2] = X("SM_TT") * P("B_TIME") + X("SM_CO*(GA==0)") * P("B_COST")
+	m2.utility_co[3] = P("ASC_CAR") + X("CAR_TT") * P("B_TIME") + X("CAR_CO") * P("B_COST")
+
+	km = NumbaModel()
+	km.utility_co[2] = P.W_OTHER
+
+	from larch.model.latentclass import LatentClassModel
+	m = LatentClassModel(km, {1:m1, 2:m2})
+	m.load_data()
+	assert m._uses_numba()
+
+	m.set_value(P.ASC_CAR, 0.125/2)
+	m.set_value(P.ASC_TRAIN, -0.398/2)
+	m.set_value(P.B_COST, -.0126/2)
+	m.set_value(P.B_TIME, -0.028/2)
+	m.set_value(P.W_OTHER, 1.095/2)
+
+	check1 = m.check_d_loglike()
+	assert dict(check1.data.analytic) == approx({
+		'ASC_CAR': -81.69736186616234,
+		'ASC_TRAIN': -613.131371089499,
+		'B_COST': -6697.31706964777,
+		'B_TIME': -40104.940072046316,
+		'W_OTHER': 245.43145056623683,
+	})
+
+	m.set_value(P.ASC_CAR, 0.125)
+	m.set_value(P.ASC_TRAIN, -0.398)
+	m.set_value(P.B_COST, -.0126)
+	m.set_value(P.B_TIME, -0.028)
+	m.set_value(P.W_OTHER, 1.095)
+	assert m.loglike() == approx(-5208.502259337974)
+
+	pr = m.probability()
+	assert pr.shape == (m.n_cases, 3)
+	assert pr.sum(1) == approx(1.0)
+
+	# cross validation folds partition the cases
+	folds = [m.loglike2(leave_out=i, subsample=3).ll for i in range(3)]
+	kept = [m.loglike2(keep_only=i, subsample=3).ll for i in range(3)]
+	assert sum(kept) == approx(-5208.502259337974)
+	assert sum(folds) == approx(2 * -5208.502259337974)
+
+	y = m.loglike2_bhhh()
+	g = m.loglike2(persist=0).dll
+	assert y.dll == approx(g)
+	assert y.bhhh.shape == (len(m.pf), len(m.pf))
+	assert y.bhhh == approx(y.bhhh.T)
@@ -89,3 +89,103 @@ def test_simple_model_group():
 	mg3.append(m2)
 	mg3.doctor()
 	assert mg3.loglike() == approx(-3620.697667552756)
+
+
+def test_model_group_executor():
+
+	df = pd.read_csv(example_file("MTCwork.csv.gz"))
+	df.set_index(['casenum','altnum'], inplace=True)
+	d = larch.DataFrames(df, ch='chose', crack=True)
+
+	models = []
+	for femdum in (0, 1):
+		m = larch.Model(dataservice=d.selector_co(f"femdum == {femdum}"))
+		m.utility_co[2] = P("ASC_SR2")  + P("hhinc#2") * X("hhinc")
+		m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+		m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+		m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+		m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+		m.utility_ca = P(f"tottime_{femdum}")*X("tottime") + P("totcost")*X("totcost")
+		m.load_data()
+		models.append(m)
+
+	from larch.model.model_group import ModelGroup
+
+	serial = ModelGroup(models)
+	serial.set_values(totcost=-0.002, tottime_0=-0.03, tottime_1=-0.02, ASC_SR2=-1)
+	ref = serial.loglike2_bhhh(return_series=True)
+	assert ref.ll == approx(sum(m.loglike() for m in models))
+
+	threaded = ModelGroup(models, executor='thread')
+	threaded.set_values(**serial.pf.value)
+	assert threaded.loglike() == approx(ref.ll)
+	pd.testing.assert_series_equal(threaded.loglike2().dll, ref.dll)
+	result = threaded.loglike2_bhhh(return_series=True)
+	assert result.ll == approx(ref.ll)
+	pd.testing.assert_frame_equal(result.bhhh, ref.bhhh)
+	# totcost is shared, so its BHHH entry adds up over both members
+	assert ref.bhhh.loc['totcost', 'totcost'] == approx(
+		sum(m.loglike2_bhhh(return_series=True).bhhh.loc['totcost', 'totcost'] for m in models)
+	)
+	assert ref.bhhh.loc['tottime_0', 'tottime_1'] == 0
+	threaded.shutdown_executor()
+
+
+def test_model_group_process_executor():
+	import numpy as np
+	import pytest
+	pytest.importorskip("sharrow")
+	from xarray import DataArray
+	from larch.numba import DataFrames, Dataset, NumbaModel
+	from larch.model.model_group import ModelGroup
+
+	df = pd.read_csv(example_file("MTCwork.csv.gz"), index_col=['casenum', 'altnum'])
+	d = DataFrames(df, ch='chose', crack=True)
+	dataset = Dataset.from_dataframe(d.data_co)
+	dataset = dataset.merge(Dataset.from_dataframe(d.data_ce).fillna(0.0))
+	dataset['avail'] = DataArray(d.data_av.values, dims=['_caseid_', '_altid_'], coords=dataset.coords)
+	dataset.dc.CASEID = '_caseid_'
+	dataset.dc.ALTID = '_altid_'
+
+	models = []
+	for femdum in (0, 1):
+		m = NumbaModel(alts=dataset['_altid_'].values)
+		m.utility_co[2] = P("ASC_SR2")  + P("hhinc#2") * X("hhinc")
+		m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+		m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+		m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+		m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+		m.utility_ca = P(f"tottime_{femdum}")*X("tottime") + P("totcost")*X("totcost")
+		m.availability_var = 'avail'
+		m.choice_ca_var = 'chose'
+		m.datatree = dataset.isel(_caseid_=np.where(dataset['femdum'].values == femdum)[0])
+		models.append(m)
+
+	serial = ModelGroup(models)
+	serial.set_values(totcost=-0.002, tottime_0=-0.03, tottime_1=-0.02, ASC_SR2=-1)
+	ref = serial.loglike2_bhhh(return_series=True)
+
+	processes = ModelGroup(models, executor='process', n_workers=2)
+	processes.set_values(**serial.pf.value)
+	try:
+		assert processes.loglike() == approx(ref.ll)
+		pd.testing.assert_series_equal(processes.loglike2().dll, ref.dll)
+		result = processes.loglike2_bhhh(return_series=True)
+		assert result.ll == approx(ref.ll)
+		pd.testing.assert_frame_equal(result.bhhh, ref.bhhh)
+		# new parameter values reach the workers
+		processes.set_values(totcost=-0.001)
+		serial.set_values(totcost=-0.001)
+		assert processes.loglike() == approx(serial.loglike())
+		assert len(processes._shared_data) == 2
+	finally:
+		processes.shutdown_executor()
+	assert processes._shared_data == []
+
+	df = pd.read_csv(example_file("MTCwork.csv.gz"), index_col=['casenum', 'altnum'])
+	m = larch.Model(dataservice=larch.DataFrames(df, ch='chose', crack=True))
+	m.utility_co[2] = P("ASC_SR2")
+	m.load_data()
+	legacy = ModelGroup([m, m.copy()], executor='process')
+	with pytest.raises(TypeError):
+		legacy.loglike()
@@ -1155,7 +1155,7 @@ def test_eville_mode_with_dataset():
     assert m.n_cases == 20739
 
 
-def test_eville_idce_quant():
+def _eville_idce_tree():
     from larch.numba import example, DataTree
     hh, pp, tour, skims, emp = example(200, ['hh', 'pp', 'tour', 'skims', 'emp'])
     tour = tour.drop(
@@ -1188,9 +1188,13 @@ def test_eville_idce_quant():
         obs_ca.loc[obs_ca.chosen == 0].sample(frac=frac_to_keep, replace=False, random_state=1),
         obs_ca.loc[obs_ca.chosen == 1]
     ]).sort_index()
-    tree = DataTree(
+    return DataTree(
         obs=Dataset.construct.from_idce(obs_idce, crack=False),
     )
+
+
+def test_eville_idce_quant():
+    tree = _eville_idce_tree()
     mx = NumbaModel(datatree=tree)
     mx.choice_ca_var = "chosen"
     mx.quantity_ca = P.emp_p * X('TOTAL_EMP')
@@ -1204,3 +1208,727 @@ def test_eville_idce_quant():
     result = mx.maximize_loglike()
     assert result.loglike == approx(-69408.93781754425)
     assert result.x['distance'] == approx(-0.37974107678625235)
+
+
+def test_reduce_in_kernel():
+    from larch.numba import example
+    m = example(1)
+    m.set_values(
+        totcost=-0.001,
+        tottime=-0.01,
+        ASC_BIKE=-1,
+        ASC_SR2=-1,
+    )
+    ref = m.loglike2_bhhh()
+    ref_casewise = m.loglike_casewise()
+    ref_pr = m.probability()
+    m.reduce_in_kernel = True
+    assert m.work_arrays is None
+    red = m.loglike2_bhhh()
+    assert m.work_arrays.bhhh.shape == (1, len(m.pf), len(m.pf))
+    assert red.ll == approx(ref.ll)
+    assert np.asarray(red.dll) == approx(np.asarray(ref.dll))
+    assert np.asarray(red.bhhh) == approx(np.asarray(ref.bhhh))
+    assert m.loglike() == approx(ref.ll)
+    assert m.loglike_casewise() == approx(ref_casewise)
+    assert m.probability() == approx(ref_pr)
+    assert m.bhhh(start_case=3, step_case=7) == approx(
+        example(1).bhhh(m.pvals, start_case=3, step_case=7)
+    )
+
+
+def _finite_difference_d2(m):
+    from larch.math.optimize import approx_fprime
+    return approx_fprime(m.pvals, lambda y: m.d_loglike(y))
+
+
+def test_analytic_d2_loglike_mnl():
+    from larch.numba import example
+    m = example(1)
+    m.set_values(
+        totcost=-0.001,
+        tottime=-0.01,
+        ASC_BIKE=-1,
+        ASC_SR2=-1,
+    )
+    d2 = m.d2_loglike()
+    fd = _finite_difference_d2(m)
+    assert d2 == approx(d2.T)
+    assert d2 == approx(fd, rel=1e-3, abs=1e-3 * np.abs(fd).max())
+
+
+def test_analytic_d2_loglike_nl(mtc):
+    m5 = NumbaModel()
+    m5.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m5.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m5.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m5.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m5.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m5.utility_ca = PX("tottime") + PX("totcost")
+    m5.dataframes = mtc
+    m5.graph.add_node(9, children=(5, 6), parameter='MU_NonMotorized')
+    m5.graph.add_node(10, children=(1, 2, 3), parameter='MU_Car')
+    m5.set_values(
+        totcost=-0.0013,
+        tottime=-0.018,
+        ASC_BIKE=-0.85,
+        ASC_SR2=-0.52,
+        ASC_TRAN=-0.05,
+        MU_NonMotorized=0.7,
+        MU_Car=0.6,
+    )
+    d2 = m5.d2_loglike()
+    fd = _finite_difference_d2(m5)
+    assert d2 == approx(d2.T)
+    assert d2 == approx(fd, rel=1e-3, abs=1e-3 * np.abs(fd).max())
+    m5.lock_value('MU_Car', 0.6)
+    i = m5.pf.index.get_loc('MU_Car')
+    d2 = m5.d2_loglike()
+    assert np.all(d2[i] == 0)
+    assert np.all(d2[:, i] == 0)
+
+
+def test_analytic_d2_loglike_quantity(mtcq):
+    m5 = NumbaModel()
+    m5.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m5.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m5.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m5.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m5.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m5.utility_ca = PX("tottime") + PX("totcost")
+    m5.quantity_ca = (
+            + P("FakeSizeAlt") * X('altnum+1')
+            + P("FakeSizeIvtt") * X('ivtt+1')
+    )
+    m5.quantity_scale = P("Theta")
+    m5.dataframes = mtcq
+    m5.set_values(
+        totcost=-0.0013,
+        tottime=-0.018,
+        FakeSizeAlt=0.123,
+        Theta=0.8,
+    )
+    d2 = m5.d2_loglike()
+    fd = _finite_difference_d2(m5)
+    assert d2 == approx(d2.T)
+    assert d2 == approx(fd, rel=1e-3, abs=1e-3 * np.abs(fd).max())
+
+
+def test_streaming_chunks(mtc_dataset):
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    m.set_values(totcost=-0.001, tottime=-0.01, ASC_BIKE=-1, ASC_SR2=-1)
+    ref = m.loglike2_bhhh()
+    ref_pr = m.probability()
+    ref_slice = m.loglike(start_case=10, stop_case=2000, step_case=3)
+    m.chunk_size = 777
+    assert m._data_arrays is None
+    assert m.work_arrays is None
+    streamed = m.loglike2_bhhh()
+    assert streamed.ll == approx(ref.ll)
+    assert np.asarray(streamed.dll) == approx(np.asarray(ref.dll))
+    assert np.asarray(streamed.bhhh) == approx(np.asarray(ref.bhhh))
+    assert m.probability() == approx(ref_pr)
+    assert m.loglike(start_case=10, stop_case=2000, step_case=3) == approx(ref_slice)
+    assert m.loglike() == approx(-7309.600971749634)
+    # kernels for other models need every case in memory at once
+    with raises(ValueError):
+        m._kernel_arrays()
+    assert m._data_arrays is None
+
+
+def test_streaming_lazy_idce(tmp_path):
+    from larch.numba import DataTree
+    from larch.data_warehouse import example_file
+    from xarray import open_zarr
+    df = pd.read_csv(example_file("MTCwork.csv.gz"), index_col=['casenum', 'altnum'])
+    tree = DataTree(main=Dataset.construct.from_idce(df, crack=True))
+    m = NumbaModel(datatree=tree)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.choice_ca_var = 'chose'
+    m.availability_var = '1'
+    m.set_values(totcost=-0.001, tottime=-0.01, ASC_BIKE=-1, ASC_SR2=-1)
+    ref = m.loglike2_bhhh()
+    m.dataset.to_zarr(tmp_path / "prepared.zarr")
+    lazy = Dataset(open_zarr(tmp_path / "prepared.zarr", chunks={}))
+    m.datatree = None
+    m.dataset = lazy
+    m.chunk_size = 1000
+    streamed = m.loglike2_bhhh()
+    assert streamed.ll == approx(ref.ll)
+    assert np.asarray(streamed.dll) == approx(np.asarray(ref.dll))
+    assert np.asarray(streamed.bhhh) == approx(np.asarray(ref.bhhh))
+
+
+def test_mixed_precision():
+    from larch.numba import example
+    m = example(1)
+    m.set_values(
+        totcost=-0.001,
+        tottime=-0.01,
+        ASC_BIKE=-1,
+        ASC_SR2=-1,
+    )
+    ref = m.loglike2_bhhh()
+    m.float_dtype = np.float32
+    m.accumulate_dtype = np.float64
+    mixed = m.loglike2_bhhh()
+    assert m._data_arrays.ca.dtype == np.float32
+    assert m.work_arrays.d_loglike.dtype == np.float64
+    assert np.asarray(mixed.dll).dtype == np.float64
+    assert mixed.ll == approx(ref.ll, rel=1e-6)
+    assert np.asarray(mixed.dll) == approx(np.asarray(ref.dll), rel=1e-4, abs=1e-3)
+    assert np.asarray(mixed.bhhh) == approx(np.asarray(ref.bhhh), rel=1e-4)
+    assert m.probability().dtype == np.float32
+
+
+def test_sparse_gradient_nl(mtcq):
+    from larch.math.optimize import approx_fprime
+    m5 = NumbaModel()
+    m5.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m5.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m5.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m5.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m5.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m5.utility_ca = PX("tottime") + PX("totcost")
+    m5.quantity_ca = (
+            + P("FakeSizeAlt") * X('altnum+1')
+            + P("FakeSizeIvtt") * X('ivtt+1')
+    )
+    m5.quantity_scale = P("Theta")
+    m5.dataframes = mtcq
+    m5.graph.add_node(9, children=(5, 6), parameter='MU_NonMotorized')
+    m5.graph.add_node(10, children=(1, 2, 3), parameter='MU_Car')
+    m5.graph.add_node(11, children=(10, 4), parameter='MU_Motorized')
+    m5.set_values(
+        totcost=-0.0013,
+        tottime=-0.018,
+        ASC_BIKE=-0.85,
+        ASC_SR2=-0.52,
+        ASC_TRAN=-0.05,
+        FakeSizeAlt=0.123,
+        Theta=0.8,
+        MU_NonMotorized=0.7,
+        MU_Car=0.6,
+        MU_Motorized=0.8,
+    )
+    fd = approx_fprime(m5.pvals, lambda y: m5.loglike(y))
+    ref = m5.loglike2_bhhh()
+    assert np.asarray(ref.dll) == approx(fd, rel=1e-4, abs=1e-4 * np.abs(fd).max())
+    casewise = m5.d_loglike_casewise()
+    assert np.asarray(ref.bhhh) == approx(casewise.T @ casewise)
+    m5.reduce_in_kernel = True
+    red = m5.loglike2_bhhh()
+    assert red.ll == approx(ref.ll)
+    assert np.asarray(red.dll) == approx(np.asarray(ref.dll))
+    assert np.asarray(red.bhhh) == approx(np.asarray(ref.bhhh))
+
+
+def _mixed_mtc_spec(m):
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.set_values(totcost=-0.001, tottime=-0.01, ASC_BIKE=-1, ASC_SR2=-1)
+    return m
+
+
+def test_mixed_logit_panel(mtc):
+    from larch.numba.mixed import MixedNumbaModel, Normal, LogNormal
+    from larch.math.optimize import approx_fprime
+    base = _mixed_mtc_spec(NumbaModel())
+    base.dataframes = mtc
+    n_groups = -(-base.n_cases // 3)
+    m = MixedNumbaModel(
+        mixtures=[Normal('tottime', 'sd_tottime'), Normal('ASC_SR2', 'sd_SR2')],
+        n_draws=20,
+        groupid=np.arange(base.n_cases) // 3,
+    )
+    _mixed_mtc_spec(m)
+    m.dataframes = mtc
+    assert 'sd_tottime' in m.pf.index
+
+    # with no spread, the panel likelihood is the MNL likelihood
+    m.set_values(sd_tottime=0, sd_SR2=0)
+    assert m.loglike() == approx(base.loglike())
+    assert m.probability() == approx(base.probability())
+
+    m.set_values(sd_tottime=0.02, sd_SR2=0.5)
+    ll = m.loglike2_bhhh()
+    assert ll.ll < base.loglike()
+    fd = approx_fprime(m.pvals, lambda y: m.loglike(y))
+    assert np.asarray(ll.dll) == approx(fd, rel=1e-4, abs=1e-4 * np.abs(fd).max())
+    casewise = m.d_loglike_casewise()
+    assert casewise.shape == (n_groups, len(m.pf))
+    assert np.asarray(ll.bhhh) == approx(casewise.T @ casewise)
+
+    # the Hessian includes the std parameters of the mixtures
+    d2 = m.d2_loglike()
+    fd2 = _finite_difference_d2(m)
+    assert d2 == approx(fd2, rel=1e-3, abs=1e-3 * np.abs(fd2).max())
+    assert d2[m.pf.index.get_loc('sd_SR2'), m.pf.index.get_loc('sd_SR2')] != 0
+
+    m.mixtures = [LogNormal('totcost', 'sd_totcost')]
+    m.set_values(totcost=-7.0, sd_totcost=0.3)
+    fd = approx_fprime(m.pvals, lambda y: m.loglike(y))
+    assert np.asarray(m.d_loglike()) == approx(fd, rel=1e-4, abs=1e-4 * np.abs(fd).max())
+
+
+def _cnl_mtc_spec(m):
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.graph.add_node(9, children=(1, 2, 3), parameter='MU_Car')
+    m.graph.add_node(10, children=(3, 4), parameter='MU_Shared')
+    m.graph.add_node(11, children=(5, 6), parameter='MU_NonMotorized')
+    return m
+
+
+def test_cross_nested_numba(mtc):
+    from larch.math.optimize import approx_fprime
+    m = _cnl_mtc_spec(NumbaModel())
+    m.dataframes = mtc
+    values = dict(
+        totcost=-0.0013, tottime=-0.018, ASC_BIKE=-0.85, ASC_SR2=-0.52,
+        ASC_TRAN=-0.05, MU_Car=0.6, MU_Shared=0.8, MU_NonMotorized=0.7,
+    )
+    m.set_values(**values)
+    assert m.is_cross_nested
+
+    # equal allocations match the cython implementation
+    from larch import Model
+    legacy = _cnl_mtc_spec(Model())
+    legacy.dataframes = mtc
+    legacy.set_values(**values)
+    assert m.loglike() == approx(legacy.loglike())
+    pr = m.probability()
+    assert pr[:, :6] == approx(legacy.probability()[:, :6], rel=1e-5)
+    assert pr[:, :6].sum(1) == approx(1.0)
+
+    # parameterized allocations, with analytic gradient and BHHH
+    m.graph.edges[9, 3]['alpha'] = 'alpha_Car_SR3P'
+    m.graph.edges[10, 3]['alpha'] = 'alpha_Shared_SR3P'
+    m.mangle()
+    m.set_values(alpha_Car_SR3P=0.3, alpha_Shared_SR3P=0.7)
+    ll_param = m.loglike()
+    fd = approx_fprime(m.pvals, lambda y: m.loglike(y))
+    ref = m.loglike2_bhhh()
+    assert ref.ll == approx(ll_param)
+    assert np.asarray(ref.dll) == approx(fd, rel=1e-4, abs=1e-4 * np.abs(fd).max())
+    casewise = m.d_loglike_casewise()
+    assert np.asarray(ref.bhhh) == approx(casewise.T @ casewise)
+    m.reduce_in_kernel = True
+    red = m.loglike2_bhhh()
+    assert red.ll == approx(ref.ll)
+    assert np.asarray(red.dll) == approx(np.asarray(ref.dll))
+
+
+def test_reuse_utility_nl(mtc):
+    m = NumbaModel()
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.dataframes = mtc
+    m.graph.add_node(9, children=(5, 6), parameter='MU_NonMotorized')
+    m.graph.add_node(10, children=(1, 2, 3), parameter='MU_Car')
+    m.set_values(totcost=-0.0013, tottime=-0.018, ASC_BIKE=-0.85, ASC_SR2=-0.52)
+    m.loglike2_bhhh()
+    x = m.pvals.copy()
+    x[m.get_slot_x('MU_Car')] = 0.6
+    x[m.get_slot_x('MU_NonMotorized')] = 0.7
+    args = m._NumbaModel__prepare_for_compute(x)
+    assert m._can_reuse_utility(args, 0, slice(None, None, None))
+    reused = m.loglike2_bhhh(x)
+    x[m.get_slot_x('tottime')] = -0.02
+    args = m._NumbaModel__prepare_for_compute(x)
+    assert not m._can_reuse_utility(args, 0, slice(None, None, None))
+    x[m.get_slot_x('tottime')] = -0.018
+    m.reuse_utility = False
+    fresh = m.loglike2_bhhh(x)
+    assert reused.ll == approx(fresh.ll)
+    assert np.asarray(reused.dll) == approx(np.asarray(fresh.dll))
+    assert np.asarray(reused.bhhh) == approx(np.asarray(fresh.bhhh))
+
+
+def test_prepared_data_cache(mtc_dataset, tmp_path):
+    from larch.numba import data_arrays
+    from larch.numba.data_cache import evict
+
+    def make_model():
+        m = NumbaModel(alts=mtc_dataset['_altid_'].values, data_cache=tmp_path)
+        m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+        m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+        m.utility_ca = PX("tottime") + PX("totcost")
+        m.availability_var = 'avail'
+        m.choice_ca_var = 'chose'
+        m.datatree = mtc_dataset
+        return m
+
+    cold = make_model()
+    ll = cold.loglike()
+    entries = [p for p in tmp_path.iterdir() if not p.name.startswith('.')]
+    assert len(entries) == 1
+
+    calls = []
+    original_prep_ca = data_arrays._prep_ca
+
+    def counting_prep_ca(*args, **kwargs):
+        calls.append(1)
+        return original_prep_ca(*args, **kwargs)
+
+    data_arrays._prep_ca = counting_prep_ca
+    try:
+        warm = make_model()
+        assert warm.loglike() == approx(ll)
+        assert not calls
+        changed = mtc_dataset.copy()
+        changed['tottime'] = changed['tottime'] * 2
+        warm.datatree = changed
+        warm.loglike()
+        assert calls
+    finally:
+        data_arrays._prep_ca = original_prep_ca
+    assert len([p for p in tmp_path.iterdir() if not p.name.startswith('.')]) == 2
+
+    evict(tmp_path, max_size=0)
+    assert not [p for p in tmp_path.iterdir() if not p.name.startswith('.')]
+
+
+def test_sparse_idce():
+    tree = _eville_idce_tree()
+
+    def make_model(sparse_ce):
+        m = NumbaModel(datatree=tree, sparse_ce=sparse_ce)
+        m.choice_ca_var = "chosen"
+        m.quantity_ca = P.emp_p * X('TOTAL_EMP')
+        m.quantity_scale = P.Theta
+        m.utility_ca = P.distance * X.distance
+        m.availability_var = 'avail'
+        m.set_values(distance=-0.3, Theta=0.9)
+        return m
+
+    dense = make_model(False)
+    sparse = make_model(True)
+    assert sparse._data_arrays.ch.ndim == 1
+    assert sparse.work_arrays.utility.size == 0
+    ref = dense.loglike2_bhhh()
+    got = sparse.loglike2_bhhh()
+    assert got.ll == approx(ref.ll)
+    assert np.asarray(got.dll) == approx(np.asarray(ref.dll))
+    assert np.asarray(got.bhhh) == approx(np.asarray(ref.bhhh))
+    assert sparse.loglike(start_case=5, stop_case=50) == approx(dense.loglike(start_case=5, stop_case=50))
+    pr = sparse.probability()
+    assert pr == approx(dense.probability())
+    assert sparse.ce_work_arrays.probability.shape == sparse._data_arrays.ce_altidx.shape
+
+    # nested models evaluate each case through a scratch row of nodes
+    n_alts = dense.graph.n_elementals()
+    for m in (dense, sparse):
+        alts = list(m.graph.elementals)
+        m.graph.new_node(parameter='MU_near', children=alts[: n_alts // 2], name='near')
+        m.set_values(MU_near=0.7)
+    ref = dense.loglike2_bhhh()
+    got = sparse.loglike2_bhhh()
+    assert got.ll == approx(ref.ll)
+    assert np.asarray(got.dll) == approx(np.asarray(ref.dll))
+
+
+def test_incremental_prepare_data(mtc_dataset, monkeypatch):
+    from larch.numba import data_arrays
+
+    def make_model():
+        m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+        m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+        m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+        m.utility_ca = PX("tottime") + PX("totcost")
+        m.availability_var = 'avail'
+        m.choice_ca_var = 'chose'
+        m.datatree = mtc_dataset
+        return m
+
+    m = make_model()
+    m.loglike()
+
+    loaded = []
+    original_prep_ca = data_arrays._prep_ca
+    original_prep_co = data_arrays._prep_co
+
+    def recording_prep_ca(model_dataset, shared_data_ca, vars_ca, tag='ca', **kwargs):
+        loaded.append((tag, vars_ca))
+        return original_prep_ca(model_dataset, shared_data_ca, vars_ca, tag=tag, **kwargs)
+
+    def recording_prep_co(model_dataset, shared_data_co, vars_co, tag='co', **kwargs):
+        loaded.append((tag, vars_co))
+        return original_prep_co(model_dataset, shared_data_co, vars_co, tag=tag, **kwargs)
+
+    monkeypatch.setattr(data_arrays, '_prep_ca', recording_prep_ca)
+    monkeypatch.setattr(data_arrays, '_prep_co', recording_prep_co)
+
+    m.utility_ca = m.utility_ca + PX("ovtt")
+    m.utility_co[4] = P("ASC_TRAN") + P("vehbywrk#4") * X("vehbywrk")
+    m.set_values(ovtt=-0.05, tottime=-0.02, totcost=-0.003, **{"vehbywrk#4": -0.3})
+    ll = m.loglike()
+    assert ('ca', ['ovtt']) in loaded
+    assert ('co', ['vehbywrk']) in loaded
+    assert list(m.dataset.indexes['var_ca']) == ['totcost', 'tottime', 'ovtt']
+
+    monkeypatch.undo()
+    fresh = make_model()
+    fresh.utility_ca = fresh.utility_ca + PX("ovtt")
+    fresh.utility_co[4] = P("ASC_TRAN") + P("vehbywrk#4") * X("vehbywrk")
+    fresh.set_values(ovtt=-0.05, tottime=-0.02, totcost=-0.003, **{"vehbywrk#4": -0.3})
+    assert ll == approx(fresh.loglike())
+
+
+def test_shared_dataset(mtc_dataset):
+    import pickle
+
+    def make_model():
+        m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+        m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+        m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+        m.utility_ca = PX("tottime") + PX("totcost")
+        m.availability_var = 'avail'
+        m.choice_ca_var = 'chose'
+        m.set_values(tottime=-0.02, totcost=-0.003, ASC_SR2=-1.5)
+        return m
+
+    m = make_model()
+    m.datatree = mtc_dataset
+    ll = m.loglike()
+    with m.share_dataset() as shared:
+        assert m.shared_data == shared.name
+        # the publisher uses its own block, without attaching by name
+        from larch.numba.shared_data import _attached
+        assert _attached[shared.name] is shared._shm
+        assert m.loglike() == approx(ll)
+
+        worker = make_model()
+        worker.dataset = shared.name
+        assert worker.datatree is None
+        assert worker.loglike() == approx(ll)
+        assert not worker._data_arrays.ca.flags.owndata
+
+        # an unpickled model re-attaches by name
+        clone = pickle.loads(pickle.dumps(worker))
+        assert clone.shared_data == shared.name
+        assert clone.loglike() == approx(ll)
+
+
+def test_multi_start_estimate(mtc_dataset):
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    m.set_cap(20)
+
+    assert m.copy().datatree is None
+    clone = m.copy(share_data=True)
+    assert clone.dataset is m.dataset
+    assert clone.loglike() == approx(m.loglike())
+
+    results = m.multi_start_estimate(
+        starts=4, scale=0.5, seed=0, prune_after=2, keep=2,
+        executor=None, method='slsqp',
+    )
+    assert len(results) == 4
+    assert sum(r.pruned for r in results) == 2
+    assert [r.loglike for r in results] == sorted((r.loglike for r in results), reverse=True)
+    # the log likelihood of an MNL model is concave
+    assert results[0].loglike == approx(-3626.1862595453385)
+    assert m.loglike() == approx(results[0].loglike)
+    assert len(results[0].history) == 2
+
+    for executor in ('process', 'thread'):
+        m.set_values('null')
+        results = m.multi_start_estimate(
+            starts=3, scale=0.5, seed=0, executor=executor, n_workers=2, method='slsqp',
+        )
+        assert len(results) == 3
+        assert results[0].loglike == approx(-3626.1862595453385)
+        assert m.loglike() == approx(results[0].loglike)
+    assert m.shared_data is None
+
+
+def test_multi_start_estimate_dataframes():
+    from larch.numba import example
+    m = example(1)
+    assert m.dataset is None
+    # no dataset to share, so the starts run one after another
+    results = m.multi_start_estimate(starts=2, scale=0.5, seed=0, method='slsqp')
+    assert len(results) == 2
+    assert results[0].loglike == approx(-3626.1862595453385)
+
+
+def test_cross_validate(mtc_dataset):
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    m.set_cap(20)
+
+    ll_cv = m.cross_validate(cv=3, method='slsqp')
+    result = m.most_recent_cross_validation
+    assert isinstance(ll_cv, float)
+    assert ll_cv == result.loglike
+    assert m.loglike() == approx(-3626.1862595453385)
+    assert result.parameters.shape == (len(m.pf), 3)
+    assert 'cv_002' in m.pf.columns
+    assert result.loglike == approx(result.fold_loglike.sum())
+    # held out loglikes are worse than in-sample ones, but not by much
+    assert -3626.1862595453385 - 50 < result.loglike < -3626.1862595453385
+
+    # each fold matches estimating on a copy of the data without it
+    fold = 1
+    keep = np.arange(m.n_cases) % 3 != fold
+    other = m.copy(share_data=False)
+    other.datatree = mtc_dataset.isel(_caseid_=np.nonzero(keep)[0])
+    other.maximize_loglike(method='slsqp', quiet=True)
+    assert other.pvals == approx(result.parameters[fold].values, rel=1e-2)
+
+    serial = m.cross_validate(cv=3, method='slsqp', executor=None, start_case=0, step_case=2)
+    assert serial > result.loglike
+
+
+def test_cross_validate_dataframes():
+    from larch.numba import example
+    from larch.model.optimization import cross_validate
+    m = example(1)
+    assert m.dataset is None
+    original_weights = m.dataframes.data_wt
+    result = cross_validate(m, cv=3, method='slsqp')
+    assert m.dataframes.data_wt is original_weights
+    assert m.loglike() == approx(-3626.1862595453385)
+    assert result.loglike == approx(result.fold_loglike.sum())
+    assert -3626.1862595453385 - 50 < result.loglike < -3626.1862595453385
+    # folds were estimated without their held out cases
+    assert not np.allclose(result.parameters[0], result.parameters[1])
+
+
+def test_trust_region_bhhh(mtc_dataset):
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    result = m.maximize_loglike(method='trust-bhhh', quiet=True)
+    assert result.loglike == approx(-3626.1862595453385)
+    # one pass over the data per trial step, with few rejected steps
+    assert len(result.steps) + 1 <= result.n_evaluations < 40
+    assert m.pf.loc['totcost', 'value'] == approx(-0.00492, rel=1e-2)
+
+    m.set_values('null')
+    m.lock_value('ASC_WALK', -0.2)
+    m.set_value('tottime', value=-0.07, maximum=-0.06)
+    result = m.maximize_loglike(method='trust-bhhh', quiet=True)
+    assert m.pf.loc['tottime', 'value'] <= -0.06
+    assert m.pf.loc['ASC_WALK', 'value'] == -0.2
+    m.set_cap(20)
+    reference = m.maximize_loglike(method='slsqp', quiet=True)
+    assert result.loglike == approx(reference.loglike)
+
+    # the analytic Hessian costs one more pass for the start and each step
+    m.set_values('null')
+    ll, tol, n_iters, steps, message, n_evaluations = m.fit_trust_region(hessian='analytic')
+    assert ll == approx(reference.loglike)
+    assert n_evaluations >= 2 * (len(steps) + 1)
+    m.constraint_intensity = 1.0
+    with raises(ValueError):
+        m.fit_trust_region(hessian='analytic')
+
+
+def test_fused_scipy_objective(mtc_dataset):
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    m.set_cap(20)
+    m.loglike()
+
+    runner = m._loglike_runner
+    n_passes = 0
+
+    def counting_runner(*args, **kwargs):
+        nonlocal n_passes
+        n_passes += 1
+        return runner(*args, **kwargs)
+
+    m._loglike_runner = counting_runner
+    result = m.maximize_loglike(method='slsqp', quiet=True)
+    assert result.loglike == approx(-3626.1862595453385)
+    assert n_passes == result.n_evaluations
+    # gradients at evaluated points are served from the cache
+    assert n_passes < result.nfev + result.njev
+
+    m.set_values('null')
+    result = m.maximize_loglike(method='trust-constr', bhhh_hessian=True, quiet=True)
+    assert result.loglike == approx(-3626.1862595453385, rel=1e-5)
+
+
+def test_minibatch_estimate(mtc_dataset):
+    pytest.importorskip("sharrow")
+    m = NumbaModel(alts=mtc_dataset['_altid_'].values)
+    m.utility_co[2] = P("ASC_SR2") + P("hhinc#2") * X("hhinc")
+    m.utility_co[3] = P("ASC_SR3P") + P("hhinc#3") * X("hhinc")
+    m.utility_co[4] = P("ASC_TRAN") + P("hhinc#4") * X("hhinc")
+    m.utility_co[5] = P("ASC_BIKE") + P("hhinc#5") * X("hhinc")
+    m.utility_co[6] = P("ASC_WALK") + P("hhinc#6") * X("hhinc")
+    m.utility_ca = PX("tottime") + PX("totcost")
+    m.availability_var = 'avail'
+    m.choice_ca_var = 'chose'
+    m.datatree = mtc_dataset
+    m.set_cap(20)
+    result = m.minibatch_estimate(batch_size=256, seed=0, finish_method=None, covariance=False)
+    history = result.minibatch_history
+    assert len(history) == result.minibatch_epochs
+    assert history.batch_size.is_monotonic_increasing
+    assert history.loglike_per_case.iloc[-1] > history.loglike_per_case.iloc[0]
+    assert result.loglike > -7309.600971749634
+    m.set_values('null')
+    result = m.minibatch_estimate(batch_size=256, seed=0)
+    assert result.loglike == approx(-3626.1862595453385)
+    assert np.isfinite(m.pf.std_err).all()
@@ -0,0 +1,26 @@
+import numpy
+import larch
+import larch.exampville
+from larch.omx import rc_lookup
+from pytest import approx
+
+
+def test_rc_lookup():
+	skims = larch.OMX(larch.exampville.files.skims, mode='r')
+	try:
+		rng = numpy.random.default_rng(42)
+		n_rows, n_cols = skims.shape
+		rows = rng.integers(0, n_rows, 5000)
+		cols = rng.integers(0, n_cols, 5000)
+		full = skims['AUTO_TIME'][:]
+		# small blocks force many separate reads
+		for block_bytes in (1, 1000, None):
+			assert rc_lookup(skims['AUTO_TIME'], rows, cols, block_bytes=block_bytes) == approx(full[rows, cols])
+		assert rc_lookup(full, rows.reshape(50, 100), cols.reshape(50, 100)).shape == (50, 100)
+		df = skims.get_rc_dataframe(rows, cols)
+		for name in skims.data._v_children:
+			assert df[name].values == approx(skims[name][:][rows, cols])
+		at = skims.all_matrix_at(rows[:10], cols[:10])
+		assert at['AUTO_TIME'] == approx(full[rows[:10], cols[:10]])
+	finally:
+		skims.close()